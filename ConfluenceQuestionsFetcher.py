@@ -1,18 +1,86 @@
 import requests
-from atlassian import Confluence
-from typing import Union
 import logging
+import threading
 import time
 
+from json_stream import AnswerRecord, QuestionRecord, iter_json_array
+from load_control import AdaptiveConcurrencyLimiter, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Characters of a streamed listing decoded at a time
+LISTING_CHUNK_SIZE = 64 * 1024
+
 class ConfluenceQuestionsFetcher:
-    def __init__(self, confluence_url, confluence_username, confluence_password):
-        self.confluence = Confluence(
-            url=confluence_url,
-            username=confluence_username,
-            password=confluence_password
-        )
-        self.base_url = confluence_url.rstrip('/') + '/rest/questions/1.0'
+    def __init__(self, confluence_url, confluence_username, confluence_password,
+                 latency_slo=1.0, max_concurrency=8, request_timeout=30, stream_listings=True):
+        """Initialize the fetcher.
+
+        Args:
+            confluence_url (str): The Confluence base URL
+            confluence_username (str): The Confluence username
+            confluence_password (str): The Confluence password
+            latency_slo (float): Response time in seconds the fetcher keeps Confluence under
+            max_concurrency (int): Highest number of concurrent requests to Confluence
+            request_timeout (float): Seconds after which a request counts as timed out
+            stream_listings (bool): Decode the question and answer listings while they download,
+                                    instead of loading each page whole
+        """
+        self.confluence_url = confluence_url.rstrip('/')
+        self.base_url = self.confluence_url + '/rest/questions/1.0'
         self.auth = (confluence_username, confluence_password)
+        self.request_timeout = request_timeout
+        self.stream_listings = stream_listings
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter(latency_slo=latency_slo, max_limit=max_concurrency)
+        self.circuit_breaker = CircuitBreaker()
+        # Request statistics, used to project the duration of a real run from a dry run
+        self.stats_lock = threading.Lock()
+        self.request_count = 0
+        self.request_seconds = 0.0
+
+    def _get(self, url, params=None, stream=False):
+        """Send a GET request to Confluence within the adaptive load limits."""
+        return self.request('GET', url, params=params, stream=stream)
+
+    def request(self, method, url, params=None, stream=False):
+        """Send a request to Confluence within the adaptive load limits.
+
+        The request waits while the circuit breaker is open and for a free slot in the
+        concurrency limit. Its latency and outcome then feed back into both; server
+        errors, rate limiting (429) and timeouts count as overload.
+
+        Args:
+            method (str): The HTTP method, such as 'GET' or 'HEAD'
+            url (str): The URL to request
+            params (dict, optional): Query parameters
+            stream (bool): Return once the headers arrived and leave the body to be read;
+                           only the time to the headers then counts as latency
+
+        Returns:
+            requests.Response: The response
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails
+        """
+        self.circuit_breaker.before_request()
+        self.concurrency_limiter.acquire()
+        started = time.monotonic()
+        overloaded = True
+        try:
+            response = requests.request(method, url, params=params, auth=self.auth, timeout=self.request_timeout,
+                                        stream=stream)
+            overloaded = response.status_code >= 500 or response.status_code == 429
+            return response
+        finally:
+            elapsed = time.monotonic() - started
+            with self.stats_lock:
+                self.request_count += 1
+                self.request_seconds += elapsed
+            self.concurrency_limiter.release(elapsed, overloaded)
+            if overloaded:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
 
     def fetch_questions(self, space_key=None, limit=None, start=None):
         """Fetch questions from Confluence.
@@ -40,13 +108,83 @@ class ConfluenceQuestionsFetcher:
         if start is not None:
             params['start'] = start
             
-        response = requests.get(url, params=params, auth=self.auth)
+        response = self._get(url, params=params)
         response.raise_for_status()
         
         questions = response.json()
+        # Questions keep the space they were listed from, which routes their category
+        if space_key:
+            for question in questions:
+                question.setdefault('spaceKey', space_key)
         logging.info(f"Fetched {len(questions)} questions from Confluence")
         return questions
 
+    def iter_questions(self, space_key=None, limit=50, start=0):
+        """Fetch a page of the question listing, yielding the questions as they are decoded.
+
+        Args:
+            space_key (str, optional): The Confluence space key to fetch from
+            limit (int): Number of questions to fetch
+            start (int): Starting offset for pagination
+
+        Yields:
+            QuestionRecord: The questions, with only the fields the migration uses
+
+        Raises:
+            requests.exceptions.HTTPError: If the API request fails
+        """
+        params = {'spaceKey': space_key, 'limit': limit, 'start': start}
+        for question in self._iter_listing(f"{self.base_url}/question", params, QuestionRecord):
+            # Questions keep the space they were listed from, which routes their category
+            if space_key:
+                question.setdefault('spaceKey', space_key)
+            yield question
+
+    def _iter_listing(self, url, params, record_type):
+        """Fetch a listing and yield its items projected onto records.
+
+        With stream_listings, items are decoded while the response downloads, so a
+        page never has to be held whole, neither as text nor as decoded dicts.
+        """
+        response = self._get(url, params=params, stream=self.stream_listings)
+        with response:
+            response.raise_for_status()
+            if self.stream_listings:
+                # Listings are JSON, which is UTF-8 unless the server says otherwise
+                response.encoding = response.encoding or 'utf-8'
+                items = iter_json_array(response.iter_content(LISTING_CHUNK_SIZE, decode_unicode=True), key='results')
+            else:
+                items = response.json()
+                if isinstance(items, dict):
+                    items = items.get('results', [])
+            for item in items:
+                yield record_type.from_item(item)
+
+    def list_spaces(self, batch_size=100):
+        """List the keys of all global Confluence spaces.
+
+        Args:
+            batch_size (int): Number of spaces to fetch per request
+
+        Returns:
+            list: The space keys
+        """
+        url = f"{self.confluence_url}/rest/api/space"
+        space_keys = []
+        start = 0
+
+        while True:
+            response = self._get(url, params={'type': 'global', 'limit': batch_size, 'start': start})
+            response.raise_for_status()
+            spaces = response.json().get('results', [])
+            space_keys.extend(space['key'] for space in spaces)
+            if len(spaces) < batch_size:
+                break
+            start += batch_size
+
+        logger.info("Found %d Confluence spaces", len(space_keys))
+        return space_keys
+
     def get_all_questions(self, space_key=None):
         """Fetch all questions using pagination and return them sorted by creation date.
         
@@ -54,7 +192,7 @@ class ConfluenceQuestionsFetcher:
             space_key (str, optional): The Confluence space key to fetch from
             
         Returns:
-            list: List of question objects sorted by creation date (oldest first)
+            list: QuestionRecords sorted by creation date (oldest first)
         """
         logging.info("Starting to fetch all questions from Confluence...")
         if space_key:
@@ -66,13 +204,14 @@ class ConfluenceQuestionsFetcher:
         
         while True:
             logging.info(f"Fetching questions batch starting at offset {start}...")
-            questions_batch = self.fetch_questions(space_key, limit=batch_size, start=start)
-            
-            if not questions_batch:
+            batch_count = 0
+            for question in self.iter_questions(space_key, limit=batch_size, start=start):
+                all_questions.append(question)
+                batch_count += 1
+
+            if not batch_count:
                 break
-                
-            batch_count = len(questions_batch)
-            all_questions.extend(questions_batch)
+
             logging.info(f"Fetched {batch_count} questions (total so far: {len(all_questions)})")
             
             # If we have enough questions for the try_count, we can stop fetching
@@ -96,6 +235,50 @@ class ConfluenceQuestionsFetcher:
         
         return sorted_questions
 
+    def fetch_new_questions(self, space_key=None, known_ids=None, batch_size=50):
+        """Fetch the questions asked since an index snapshot was taken.
+
+        The question listing returns the most recent questions first, so paging stops
+        at the first batch that contains an already known question.
+
+        Args:
+            space_key (str, optional): The Confluence space key to fetch from
+            known_ids (set, optional): IDs of the questions already in the snapshot
+            batch_size (int): Number of questions to fetch per request
+
+        Returns:
+            list: QuestionRecords not present in known_ids
+        """
+        known_ids = known_ids or set()
+
+        # Probe the most recent question first: when it is known, nothing changed
+        latest = list(self.iter_questions(space_key, limit=1, start=0))
+        if not latest or latest[0]['id'] in known_ids:
+            logging.info("No new questions since the last snapshot")
+            return []
+
+        new_questions = []
+        start = 0
+
+        while True:
+            batch_count = 0
+            fresh_count = 0
+            for question in self.iter_questions(space_key, limit=batch_size, start=start):
+                batch_count += 1
+                if question['id'] not in known_ids:
+                    new_questions.append(question)
+                    fresh_count += 1
+            if not batch_count:
+                break
+
+            if fresh_count < batch_count or batch_count < batch_size:
+                break
+
+            start += batch_size
+
+        logging.info(f"Found {len(new_questions)} new questions since the last snapshot")
+        return new_questions
+
     def get_question_details(self, question_id):
         """Fetch detailed information for a specific question.
         
@@ -109,15 +292,17 @@ class ConfluenceQuestionsFetcher:
             requests.exceptions.HTTPError: If the API request fails
         """
         url = f"{self.base_url}/question/{question_id}"
-        response = requests.get(url, auth=self.auth)
+        response = self._get(url)
         response.raise_for_status()
         return response.json()
 
-    def get_answers(self, question_id):
-        """Fetch all answers for a specific question.
+    def get_answers(self, question_id, limit=None, start=None):
+        """Fetch answers for a specific question.
         
         Args:
             question_id (str): The ID of the question to fetch answers for
+            limit (int, optional): Maximum number of answers to fetch
+            start (int, optional): Starting offset for pagination
             
         Returns:
             Union[list, dict]: List of answers or dictionary containing answer results
@@ -127,21 +312,57 @@ class ConfluenceQuestionsFetcher:
             requests.exceptions.RequestException: For other request-related errors
         """
         url = f"{self.base_url}/question/{question_id}/answers"  # Note the plural 'answers'
+        params = {}
+        if limit is not None:
+            params['limit'] = limit
+        if start is not None:
+            params['start'] = start
         try:
-            response = requests.get(url, auth=self.auth)
+            response = self._get(url, params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
-                print(f"Error 404: Answers for question ID {question_id} not found or the API endpoint might not exist.")
+                logger.error("Error 404: Answers for question ID %s not found or the API endpoint might not exist.", question_id)
             raise
         except requests.exceptions.RequestException as e:
-            print(f"An error occurred while fetching answers: {e}")
+            logger.error("An error occurred while fetching answers: %s", e)
             raise
 
+    def get_all_answers(self, question_id, batch_size=50):
+        """Fetch every answer of a question, paging through the answer listing.
+        
+        Args:
+            question_id (str): The ID of the question to fetch answers for
+            batch_size (int): Number of answers to fetch per request
+            
+        Returns:
+            list: AnswerRecords, with only the fields the migration uses
+        """
+        url = f"{self.base_url}/question/{question_id}/answers"
+        all_answers = []
+        start = 0
+
+        while True:
+            try:
+                answers = list(self._iter_listing(url, {'limit': batch_size, 'start': start}, AnswerRecord))
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code == 404:
+                    logger.error("Error 404: Answers for question ID %s not found or the API endpoint might not exist.", question_id)
+                raise
+            if not answers:
+                break
+
+            all_answers.extend(answers)
+            if len(answers) < batch_size:
+                break
+            start += batch_size
+
+        return all_answers
+
     def get_answer_details(self, answer_id):
         url = f"{self.base_url}/answer/{answer_id}"
-        response = requests.get(url, auth=self.auth)
+        response = self._get(url)
         response.raise_for_status()
         return response.json()
 
@@ -158,32 +379,28 @@ class ConfluenceQuestionsFetcher:
         if space_key:
             logging.info(f"Using space key: {space_key}")
         
-        all_questions = []
+        question_data = []
         start = 0
         batch_size = 50 
         
         while True:
             logging.info(f"Fetching questions batch starting at offset {start}...")
-            questions_batch = self.fetch_questions(space_key, limit=batch_size, start=start)
-            
-            if not questions_batch:
+            batch_count = 0
+            # Only the ID and creation date of each question are kept
+            for question in self.iter_questions(space_key, limit=batch_size, start=start):
+                question_data.append((question['id'], question['dateAsked']))
+                batch_count += 1
+
+            if not batch_count:
                 break
-                
-            batch_count = len(questions_batch)
-            all_questions.extend(questions_batch)
-            logging.info(f"Fetched {batch_count} questions (total so far: {len(all_questions)})")
+
+            logging.info(f"Fetched {batch_count} questions (total so far: {len(question_data)})")
             
             if batch_count < batch_size:
                 break
                 
             start += batch_size
         
-        # Extract ID and creation date for each question
-        question_data = [
-            (question['id'], question['dateAsked'])
-            for question in all_questions
-        ]
-        
         # Sort by creation date (oldest first)
         sorted_questions = sorted(question_data, key=lambda x: x[1])
         
@@ -1,12 +1,36 @@
-from typing import Dict, Optional
+import threading
+from typing import Dict, Optional, Tuple
 from pydiscourse.exceptions import DiscourseClientError
 
+
+def parse_space_categories(value: Optional[str]) -> Dict[str, str]:
+    """Parse a space routing setting such as 'DEV=Developer Questions,OPS=Operations'.
+
+    Args:
+        value (str, optional): Comma separated SPACE_KEY=Category Name pairs
+
+    Returns:
+        dict: Category name per space key
+    """
+    routes = {}
+    for pair in (value or '').split(','):
+        if '=' in pair:
+            space_key, name = pair.split('=', 1)
+            if space_key.strip() and name.strip():
+                routes[space_key.strip()] = name.strip()
+    return routes
+
+
 class DiscourseCategoryManager:
-    def __init__(self, client):
+    def __init__(self, client, space_categories: Optional[Dict[str, str]] = None,
+                 space_tag_prefix: Optional[str] = None):
         """Initialize the category manager.
         
         Args:
             client: The base Discourse client instance
+            space_categories (dict, optional): Category name per Confluence space key, for
+                                               spaces whose questions get a category of their own
+            space_tag_prefix (str, optional): Prefix of the tag naming the space of each topic
         """
         self.client = client
         
@@ -15,17 +39,32 @@ class DiscourseCategoryManager:
             'use_case': 'Use Case',
             'general': 'General Questions'
         }
+
+        # Routed spaces are set up with the other categories, under a key of their own
+        self.space_categories = {}
+        for space_key, name in (space_categories or {}).items():
+            self.space_categories[space_key] = f"space:{space_key}"
+            self.categories[f"space:{space_key}"] = name
+        self.space_tag_prefix = space_tag_prefix
         
         self.category_ids = {}
         self.category_slugs = {}
         
-        # Set up the categories
-        self.setup_categories()
+        # Categories are set up on first use, so runs that never create a topic make no request
+        self.categories_ready = False
+        self.lock = threading.Lock()
+
+    def _ensure_categories(self) -> None:
+        """Set up the categories if that has not happened yet."""
+        with self.lock:
+            if not self.categories_ready:
+                self.setup_categories()
 
     def setup_categories(self) -> None:
         """Set up all required categories."""
         # Get all categories
         categories = self.client.categories()
+        self.categories_ready = True
         
         for category_key, category_name in self.categories.items():
             # Search for existing category
@@ -56,15 +95,22 @@ class DiscourseCategoryManager:
         self.category_ids[key] = new_category['category']['id']
         self.category_slugs[key] = new_category['category']['slug']
 
-    def determine_category(self, tags: Optional[list] = None) -> int:
-        """Determine which category to use based on tags.
+    def determine_category(self, tags: Optional[list] = None, space_key: Optional[str] = None) -> int:
+        """Determine which category to use based on the space and tags.
+
+        A routed space always uses its own category; other questions are placed
+        by their tags.
         
         Args:
             tags (list, optional): List of tags to check
+            space_key (str, optional): The Confluence space the question comes from
             
         Returns:
             int: The ID of the determined category
         """
+        self._ensure_categories()
+        if space_key in self.space_categories:
+            return self.category_ids[self.space_categories[space_key]]
         tags = tags or []
         return self.category_ids['use_case'] if 'usecase' in tags else self.category_ids['general']
 
@@ -77,6 +123,7 @@ class DiscourseCategoryManager:
         Returns:
             int: The category ID, or None if not found
         """
+        self._ensure_categories()
         return self.category_ids.get(key)
 
     def get_category_slug(self, key: str) -> Optional[str]:
@@ -88,4 +135,31 @@ class DiscourseCategoryManager:
         Returns:
             str: The category slug, or None if not found
         """
-        return self.category_slugs.get(key) 
\ No newline at end of file
+        self._ensure_categories()
+        return self.category_slugs.get(key)
+
+    def find_categories(self) -> Dict[str, Tuple[int, str]]:
+        """Look up the categories that exist, without creating the missing ones.
+
+        Returns:
+            dict: The ID and slug of each existing category, by category key
+        """
+        with self.lock:
+            if self.categories_ready:
+                return {key: (self.category_ids[key], self.category_slugs[key]) for key in self.categories
+                        if key in self.category_ids}
+        ids_by_name = {category['name']: (category['id'], category['slug']) for category in self.client.categories()}
+        return {key: ids_by_name[name] for key, name in self.categories.items() if name in ids_by_name}
+
+    def space_tag(self, space_key: Optional[str]) -> Optional[str]:
+        """Get the tag naming the space of a topic.
+
+        Args:
+            space_key (str, optional): The Confluence space the question comes from
+
+        Returns:
+            str: The tag, or None when spaces are not tagged
+        """
+        if not self.space_tag_prefix or not space_key:
+            return None
+        return f"{self.space_tag_prefix}{space_key.lower()}"
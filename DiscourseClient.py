@@ -1,21 +1,30 @@
-import requests
-import json
-import tempfile
 import os
+import json
 import logging
+import secrets
+import threading
+import time
+
+import requests
 
 from pydiscourse.client import DiscourseClient as BaseDiscourseClient
 from pydiscourse.exceptions import DiscourseClientError
-from typing import List, Optional
-from time import sleep
+from typing import List
 from DiscourseCategoryManager import DiscourseCategoryManager
 from DiscourseTagManager import DiscourseTagManager
+from multipart_upload import MultipartUploader
+from paging import fetch_pages
+
+# Attempts at a page of a topic list that Discourse rate limits
+PAGE_RETRIES = 5
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 class DiscourseClient:
-    def __init__(self, host, api_key, api_username):
+    def __init__(self, host, api_key, api_username, rate_limiter=None, space_categories=None, space_tag_prefix=None,
+                 multipart_threshold=10 * 1024 * 1024, multipart_part_size=8 * 1024 * 1024, multipart_workers=4,
+                 multipart_state_file='target/multipart_uploads.json', publisher=None, credential_pool=None):
         """Initialize the Discourse client.
         
         Args:
@@ -23,6 +32,17 @@ class DiscourseClient:
             api_username (str): The Discourse API username
             api_key (str): The Discourse API key
             default_category_id (int, optional): Default category ID for operations
+            rate_limiter (RateLimiter, optional): Budget that every write and topic page fetch waits on
+            space_categories (dict, optional): Category name per Confluence space key with a category of its own
+            space_tag_prefix (str, optional): Prefix of the tag naming the space of each topic
+            multipart_threshold (int): Size in bytes from which files are uploaded in parts
+            multipart_part_size (int): Size in bytes of each part of a multipart upload
+            multipart_workers (int): Number of parts of a file uploaded at the same time
+            multipart_state_file (str): File recording the parts of unfinished multipart uploads
+            publisher (AsyncDiscoursePublisher, optional): Publishes the writes over a pooled event loop
+                                                          instead of the blocking pydiscourse client
+            credential_pool (CredentialPool, optional): API keys the topic and post writes are spread over,
+                                                        each with its own write budget
         """
         # Setup logging for pydiscourse
         
@@ -33,13 +53,29 @@ class DiscourseClient:
             api_key=api_key
         )
 
+        self.rate_limiter = rate_limiter
+        self.publisher = publisher
+        self.credential_pool = credential_pool
+
+        # Clients that publish as other users, by username. They only differ in the
+        # Api-Username header, so posting as an author costs no extra request.
+        self.user_clients = {}
+        self.user_clients_lock = threading.Lock()
+
         # Initialize managers
-        self.category_manager = DiscourseCategoryManager(self.client)
+        self.category_manager = DiscourseCategoryManager(self.client, space_categories, space_tag_prefix)
         self.tag_manager = DiscourseTagManager(self.client)
 
+        # Large files are uploaded in parts straight to the storage backend
+        self.multipart_threshold = multipart_threshold
+        self.multipart_uploader = MultipartUploader(self.client, part_size=multipart_part_size, workers=multipart_workers,
+                                                    state_file=multipart_state_file,
+                                                    wait_for_write_budget=self._wait_for_write_budget)
+
         logger.info(f"Initialized Discourse client for {host}")
 
-    def create_topic(self, title, raw_content, date_asked=None, category_id=None, tags=None):
+    def create_topic(self, title, raw_content, date_asked=None, category_id=None, tags=None, external_id=None,
+                     username=None, space_key=None):
         """Create a new topic in Discourse.
         
         Args:
@@ -48,6 +84,9 @@ class DiscourseClient:
             date_asked (datetime, optional): Original creation date
             category_id (int, optional): Category ID to place the topic in
             tags (List[str], optional): List of tags to apply to the topic
+            external_id (str, optional): Idempotency key the topic can be looked up by
+            username (str, optional): Discourse user to create the topic as, instead of the API user
+            space_key (str, optional): The Confluence space of the question, which routes its category and tags
             
         Returns:
             dict: The created topic response from Discourse
@@ -56,47 +95,208 @@ class DiscourseClient:
             DiscourseClientError: If topic creation fails
         """
         try:
-            # Ensure tags is a list
-            tags = tags or []
-            
-            # Add migrated_question tag
-            if 'migrated_question' not in tags:
-                tags.append('migrated_question')
-                
+            tags = self.topic_tags(tags, space_key)
+
             # Determine category if not explicitly provided
             if category_id is None:
-                category_id = self.category_manager.determine_category(tags)
+                category_id = self.category_manager.determine_category(tags, space_key)
                 
             create_post_params = {
                 'content': raw_content,
                 'title': title,
                 'category_id': category_id,
             }
+            if external_id:
+                create_post_params['external_id'] = external_id
 
             cleaned_tags = [self.tag_manager.clean_tag_name(tag) for tag in tags]
-            topic = self.client.create_post(**create_post_params, tags=cleaned_tags)
+            if self.publisher:
+                return self.publisher.run(self.publisher.create_topic(
+                    title, raw_content, category_id, cleaned_tags, external_id=external_id, username=username))
+            # The question picks the key of the pool; its topic then keeps it
+            question_key = external_id or title
+            topic = self._write(lambda client: client.create_post(**create_post_params, tags=cleaned_tags),
+                                topic_key=question_key, username=username)
+            if self.credential_pool and topic:
+                self.credential_pool.reassign(question_key, topic.get('topic_id'))
 
             return topic
         except DiscourseClientError as e:
-            print(f"Error creating topic '{title}': {str(e)}")
+            logger.error("Error creating topic '%s': %s", title, e)
             raise
 
-    def create_post(self, topic_id, raw_content):
+    def topic_tags(self, tags, space_key=None):
+        """Get the tags of a topic: its own, the migrated_question tag and the tag of its space.
+
+        Args:
+            tags (List[str]): The tags of the question
+            space_key (str, optional): The Confluence space of the question
+
+        Returns:
+            List[str]: The tags, uncleaned
+        """
+        tags = list(tags or [])
+        if 'migrated_question' not in tags:
+            tags.append('migrated_question')
+        space_tag = self.category_manager.space_tag(space_key)
+        if space_tag and space_tag not in tags:
+            tags.append(space_tag)
+        return tags
+
+    def get_site_settings(self, names):
+        """Get the values of site settings. Requires an admin API key.
+
+        Args:
+            names (iterable): Names of the settings to get
+
+        Returns:
+            dict: The value of each setting the forum has, by name
+        """
+        names = set(names)
+        response = self.client._get("/admin/site_settings.json")
+        return {setting['setting']: setting['value'] for setting in response.get('site_settings', [])
+                if setting.get('setting') in names}
+
+    def create_post(self, topic_id, raw_content, username=None):
         """Create a new post within an existing topic.
         
         Args:
             topic_id (int): The ID of the topic to add the post to
             raw_content (str): The content of the post
+            username (str, optional): Discourse user to create the post as, instead of the API user
             
         Returns:
             dict: The created post response from Discourse
         """
-        post = self.client.create_post(
-            topic_id=topic_id,
-            content=raw_content
-        )
+        if self.publisher:
+            return self.publisher.run(self.publisher.create_post(topic_id, raw_content, username=username))
+        post = self._write(lambda client: client.create_post(topic_id=topic_id, content=raw_content),
+                           topic_key=topic_id, username=username)
         return post
 
+    def _write(self, write, topic_key=None, username=None):
+        """Send a write with the API user's client, or through the credential pool when there is one.
+
+        Args:
+            write (callable): Takes a pydiscourse client and sends the write with it
+            topic_key (optional): The topic the write belongs to, which picks its key of the pool
+            username (str, optional): Discourse user to act as, instead of the API user
+
+        Returns:
+            The result of write
+        """
+        if self.credential_pool:
+            return self.credential_pool.call(write, topic_key, username)
+        self._wait_for_write_budget()
+        return write(self._client_as(username))
+
+    def _client_as(self, username):
+        """Get the client that acts as a user; the API user's client when username is None."""
+        if not username or username == self.client.api_username:
+            return self.client
+        with self.user_clients_lock:
+            client = self.user_clients.get(username)
+            if client is None:
+                client = BaseDiscourseClient(host=self.client.host, api_username=username,
+                                             api_key=self.client.api_key, timeout=self.client.timeout)
+                self.user_clients[username] = client
+            return client
+
+    def list_users(self):
+        """Iterate over all users of the forum, including their email addresses.
+        
+        Yields:
+            dict: A user as listed by the admin API
+        """
+        page = 1
+        while True:
+            users = self.client._get("/admin/users/list/all.json", page=page, show_emails='true')
+            if not users:
+                return
+            yield from users
+            page += 1
+
+    def create_user(self, name, username, email):
+        """Create an active, approved user that can only sign in by resetting its password.
+        
+        Args:
+            name (str): The full name of the user
+            username (str): The username of the user
+            email (str): The email address of the user
+            
+        Returns:
+            dict: The response from Discourse, with the 'user_id' of the new user
+        """
+        self._wait_for_write_budget()
+        return self.client.create_user(name, username, email, secrets.token_urlsafe(32),
+                                       active='true', approved='true')
+
+    def get_topic_by_external_id(self, external_id):
+        """Look up a topic by the external ID it was created with.
+        
+        Args:
+            external_id (str): The external ID of the topic
+            
+        Returns:
+            dict: The topic, or None if no topic has this external ID
+        """
+        try:
+            # Discourse redirects to the topic, and pydiscourse does not follow redirects by default
+            return self.client._get(f"/t/external_id/{external_id}.json",
+                                    override_request_kwargs={'allow_redirects': True})
+        except DiscourseClientError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    def find_post_with_marker(self, topic_id, marker):
+        """Find the post of a topic whose raw content contains a marker.
+        
+        Args:
+            topic_id (int): The ID of the topic to search
+            marker (str): The text to look for
+            
+        Returns:
+            dict: The post, or None if no post contains the marker
+        """
+        topic = self.client._get(f"/t/{topic_id}.json", include_raw='true', print='true')
+        for post in topic.get('post_stream', {}).get('posts', []):
+            if marker in (post.get('raw') or ''):
+                return post
+        return None
+
+    def get_post_raw(self, post_id):
+        """Get the raw content of a post.
+        
+        Args:
+            post_id (int): The ID of the post
+            
+        Returns:
+            str: The raw Markdown content of the post
+        """
+        if self.publisher:
+            return self.publisher.run(self.publisher.get_post_raw(post_id))
+        return self.client.post_by_id(post_id).get('raw', '')
+
+    def update_post(self, post_id, raw_content, edit_reason='', topic_id=None):
+        """Replace the content of an existing post.
+        
+        Args:
+            post_id (int): The ID of the post to edit
+            raw_content (str): The new content of the post
+            edit_reason (str, optional): Reason shown in the post's edit history
+            topic_id (int, optional): The topic of the post, which orders the edit after the writes
+                                      to the topic and sends it with the topic's API key
+            
+        Returns:
+            dict: The updated post response from Discourse
+        """
+        if self.publisher:
+            return self.publisher.run(self.publisher.update_post(post_id, raw_content, edit_reason=edit_reason,
+                                                                 topic_id=topic_id))
+        return self._write(lambda client: client.update_post(post_id, raw_content, edit_reason=edit_reason),
+                           topic_key=topic_id)
+
     def accept_solution(self, topic_id, post_id):
         """
         Mark a post as the accepted solution for a topic.
@@ -108,14 +308,19 @@ class DiscourseClient:
         Returns:
             dict: The response from the Discourse API.
         """
+        if self.publisher:
+            return self.publisher.run(self.publisher.accept_solution(topic_id, post_id))
         data = {
             "id": post_id,
         }
-        return self.client._post("/solution/accept",json=True, **data)
+        return self._write(lambda client: client._post("/solution/accept", json=True, **data), topic_key=topic_id)
 
     def upload_file(self, filename, file_content):
         """
-        Upload a file to Discourse if it has an allowed extension.
+        Upload a file to Discourse.
+
+        Files from the multipart threshold on are uploaded in parts, smaller files and
+        all files on forums without multipart uploads in a single request.
 
         Args:
             filename (str): The name of the file to be uploaded.
@@ -124,35 +329,40 @@ class DiscourseClient:
         Returns:
             tuple: (upload_response, message)
                 upload_response (dict): The response from the Discourse API containing the upload details,
-                                        or None if the file type is not supported.
+                                        or None if the forum does not accept the file.
                 message (str): A message to be inserted into the body content if the file couldn't be uploaded,
                                or None if the upload was successful.
-        """
-        allowed_extensions = {'jpg', 'jpeg', 'png', 'gif', 'heic', 'heif', 'webp', 'avif'}
-        file_extension = filename.lower().split('.')[-1]
 
-        if file_extension not in allowed_extensions:
-            return None, f"\n\n*A file named '{filename}' was present in the original content but couldn't be uploaded due to unsupported file type.*\n\n   "
+        Raises:
+            requests.exceptions.RequestException: If the upload fails
+        """
+        if self.multipart_uploader.available and len(file_content) >= self.multipart_threshold:
+            response = self.multipart_uploader.upload(filename, file_content)
+            if response is not None:
+                return response, None
 
         try:
-            # Create a temporary file to store the content
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-
-            # Use the upload_image method from the client
-            response = self.client.upload_image(
-                image=temp_file_path,
-                upload_type="composer",
-                synchronous=True
-            )
+            if self.publisher:
+                response = self.publisher.run(self.publisher.upload_file(filename, file_content))
+            else:
+                response = self._write(lambda client: client._post(
+                    "/uploads.json",
+                    files={"file": (filename, file_content)},
+                    type="composer",
+                    synchronous="true"
+                ))
+        except DiscourseClientError as e:
+            # The file type or size is not authorized on the forum; retrying would not help
+            if e.response is not None and e.response.status_code == 422:
+                return None, f"\n\n*A file named '{filename}' was present in the original content but couldn't be uploaded: {e}*\n\n   "
+            raise
 
-            # Remove the temporary file
-            os.unlink(temp_file_path)
+        return response, None
 
-            return response, None
-        except Exception as e:
-            return None, f"\n\n[Error uploading file '{filename}': {str(e)}]"
+    def _wait_for_write_budget(self):
+        """Block until the rate limiter, if any, allows another write or page fetch."""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
 
     def delete_topic(self, topic_id: int) -> dict:
         """Delete a topic by its ID.
@@ -187,8 +397,110 @@ class DiscourseClient:
             logger.error(f"Error fetching latest topics: {str(e)}")
             return []
 
+    def iter_topic_pages(self, category_id=None, category_slug=None, workers=4,
+                         snapshot_dir='target/topic_snapshots'):
+        """Stream the topics of the forum, or of one category, page by page.
+        
+        Pages are ordered by creation date, oldest first, so the pages of older topics
+        stay the same when new topics are created. Up to `workers` pages are fetched
+        at the same time, each waiting on the rate limiter. Every page is cached in
+        the snapshot directory with its ETag, so a repeated scan only downloads the
+        pages that changed.
+        
+        Args:
+            category_id (int, optional): The ID of the category to list
+            category_slug (str, optional): The slug of the category to list; the ID alone is used without it
+            workers (int): Number of pages fetched at the same time
+            snapshot_dir (str): Directory caching the pages of earlier scans
+            
+        Yields:
+            list: The topics of each page, in page order
+
+        Raises:
+            requests.exceptions.RequestException: If a page cannot be fetched, so a listing is never partial
+        """
+        if category_id is not None:
+            category_path = f"{category_slug}/{category_id}" if category_slug else str(category_id)
+            path = f"/c/{category_path}/l/latest.json"
+            cache_dir = os.path.join(snapshot_dir, f"category-{category_id}")
+        else:
+            path = "/latest.json"
+            cache_dir = os.path.join(snapshot_dir, "all")
+
+        def fetch_page(page):
+            topics, more = self._get_topic_page(path, page, cache_dir)
+            return topics, not more
+
+        yield from fetch_pages(fetch_page, workers)
+
+    def iter_topics(self, category_id=None, category_slug=None, workers=4):
+        """Stream the topics of the forum, or of one category, oldest first.
+        
+        Yields:
+            dict: A topic as listed by Discourse
+        """
+        for topics in self.iter_topic_pages(category_id, category_slug, workers):
+            yield from topics
+
+    def _get_topic_page(self, path, page, cache_dir=None):
+        """Fetch a page of a topic list, reusing the cached page when it did not change.
+        
+        Args:
+            path (str): The topic list path
+            page (int): Page number (0-based)
+            cache_dir (str, optional): Directory caching the pages of this list
+            
+        Returns:
+            tuple: (topics, more) where more tells whether further pages exist
+
+        Raises:
+            requests.exceptions.HTTPError: If the page fails, or is still rate limited after PAGE_RETRIES attempts
+        """
+        cache_file = os.path.join(cache_dir, f"{page}.json") if cache_dir else None
+        cached = None
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+
+        headers = {
+            "Accept": "application/json; charset=utf-8",
+            "Api-Key": self.client.api_key,
+            "Api-Username": self.client.api_username,
+        }
+        if cached:
+            headers["If-None-Match"] = cached['etag']
+
+        for attempt in range(1, PAGE_RETRIES + 1):
+            self._wait_for_write_budget()
+            response = requests.get(
+                self.client.host + path,
+                params={'page': page, 'order': 'created', 'ascending': 'true'},
+                headers=headers,
+                timeout=self.client.timeout or 30,
+            )
+            if response.status_code != 429 or attempt == PAGE_RETRIES:
+                break
+            wait = _rate_limit_wait(response, 2 ** attempt)
+            logger.warning("Page %d of %s is rate limited, retrying in %.0fs", page, path, wait)
+            time.sleep(wait)
+        if response.status_code == 304 and cached:
+            return cached['topics'], cached['more']
+        response.raise_for_status()
+
+        topic_list = response.json().get('topic_list', {})
+        topics = topic_list.get('topics', [])
+        more = bool(topic_list.get('more_topics_url'))
+        etag = response.headers.get('ETag')
+        if cache_file and etag:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_file = f"{cache_file}.{threading.get_ident()}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump({'etag': etag, 'topics': topics, 'more': more}, f)
+            os.replace(temp_file, cache_file)
+        return topics, more
+
     def list_topics_by_category(self, category_id: int = None, category_slug: str = None) -> List[dict]:
-        """Fetch all topics from a specific category with pagination.
+        """Fetch all topics from a specific category.
         
         Args:
             category_id (int, optional): The ID of the category to fetch topics from
@@ -196,68 +508,38 @@ class DiscourseClient:
             
         Returns:
             List[dict]: List of topics in the category
-            
-        Raises:
-            DiscourseClientError: If the API request fails
         """
         if category_id is None and category_slug is None:
             # Use general category as default
-            category_id = self.category_manager.get_category_id('General Questions')
-            category_slug = self.category_manager.get_category_slug('General Questions')
-        
-        all_topics = []
-        page = 0
-        
-        while True:
-            try:
-                response = self.client._get(
-                    f"/c/{category_id}/l/latest.json?page={page}"
-                )
-            except DiscourseClientError as e:
-                if e.response.status_code == 400:
-                    page += 1
-                    continue
-                raise
-            
-            if not response or 'topic_list' not in response:
-                break
-                
-            topics = response['topic_list'].get('topics', [])
-            if not topics:
-                break
-                
-            all_topics.extend(topics)
-            page += 1
-            logging.info(f"Fetched page {page}, having {len(all_topics)} topics, last topic: {topics[-1]['title']}")
-            sleep(5)  # Sleep for 5 seconds between page fetches
+            category_id = self.category_manager.get_category_id('general')
+            category_slug = self.category_manager.get_category_slug('general')
 
-        return all_topics
+        return list(self.iter_topics(category_id, category_slug))
 
     def get_all_topics(self):
         """
-        Get all topics using pagination.
+        Get all topics.
         
         Returns:
             list: Complete list of all topics
+
+        Raises:
+            requests.exceptions.RequestException: If a page cannot be fetched
         """
-        try:
-            all_topics = []
-            page = 0
-            
-            while True:
-                latest_topics = self.get_latest_topics(page=page)
-                if not latest_topics:
-                    break
-                all_topics.extend(latest_topics)
-                page += 1
-                logger.info(f"Fetched page {page} of topics ({len(latest_topics)} topics)")
-                sleep(1)
-                
-            logger.info(f"Total topics fetched: {len(all_topics)}")
-            return all_topics
-            
-        except Exception as e:
-            logger.error(f"Error fetching all topics: {str(e)}")
-            return []
+        all_topics = list(self.iter_topics())
+        logger.info("Total topics fetched: %d", len(all_topics))
+        return all_topics
 
     # Add more methods as needed, using self.client to interact with the API
+
+
+def _rate_limit_wait(response, default):
+    """Get the seconds a rate limited response asks to wait, or default when it does not say."""
+    try:
+        return response.json()['extras']['wait_seconds'] + 1
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return default
@@ -1,13 +1,8 @@
-import requests
-import json
-import tempfile
-import os
-from pydiscourse.client import DiscourseClient as BaseDiscourseClient
+import logging
 from pydiscourse.exceptions import DiscourseClientError
 from typing import List, Optional
-import logging
-from time import sleep
 
+logger = logging.getLogger(__name__)
 
 class DiscourseTagManager:
     def __init__(self, client):
@@ -46,7 +41,7 @@ class DiscourseTagManager:
             )
         except DiscourseClientError as e:
             if "already exists" not in str(e):
-                print(f"Error creating tag '{tag_name}': {str(e)}")
+                logger.error("Error creating tag '%s': %s", tag_name, e)
             return None
             
     def ensure_tags_exist(self, tags: List[str]) -> List[str]:
@@ -1,23 +1,41 @@
 import argparse
+import atexit
+import importlib.util
 from ConfluenceQuestionsFetcher import ConfluenceQuestionsFetcher
+from DiscourseCategoryManager import parse_space_categories
 from DiscourseClient import DiscourseClient
-import html
 import time
 import os
 from dotenv import load_dotenv
-from pydiscourse.exceptions import DiscourseClientError, DiscourseServerError
+from pydiscourse.exceptions import DiscourseClientError
 import logging
 import json
-import html2text
-from markdownify import markdownify as md
 import requests
-import re
-from logger_config import setup_logger
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logger_config import log_context, log_stage, setup_logger
 from UserRegistry import UserRegistry
 from attachment_processor import AttachmentProcessor
 from content_formatter import ContentFormatter
+from http_cassette import Cassette
 from answer_processor import AnswerProcessor
+from async_publisher import AsyncDiscoursePublisher
+from autotune import CALIBRATION_WORKER_ID, Autotuner, load_profile
 from comment_processor import CommentProcessor
+from cost_model import CostModel
+from credential_pool import CredentialPool, PooledCredential, parse_api_credentials
+from image_optimizer import ImageOptimizer
+from link_index import LinkIndex
+from migration_checkpoint import MigrationCheckpoint
+from migration_journal import MigrationJournal, topic_external_id
+from post_validator import PostValidator
+from rate_limiter import RateLimiter
+from reconciler import Reconciler
+from retry_queue import RetryQueue
+from shard_coordinator import ShardCoordinator
+from user_mapping import UserMapping
+from write_behind import WriteBehindQueue
 
 # Load environment variables from .env file
 load_dotenv(verbose=True, override=True)
@@ -26,7 +44,8 @@ load_dotenv(verbose=True, override=True)
 logger = setup_logger()
 
 class QuestionMigrator:
-    def __init__(self, dry_run=True, try_count=None, ignore_duplicate=False):
+    def __init__(self, dry_run=True, try_count=None, ignore_duplicate=False, reset_checkpoint=False,
+                 worker_id=None, writes_per_minute=None, cost_model=None, profile=None):
         # Load configuration from environment variables
         confluence_url = os.getenv('CONFLUENCE_URL')
         confluence_username = os.getenv('CONFLUENCE_USERNAME')
@@ -35,7 +54,7 @@ class QuestionMigrator:
         discourse_api_key = os.getenv('DISCOURSE_API_KEY')
         discourse_api_username = os.getenv('DISCOURSE_API_USERNAME')
 
-        logger.info(f"Using Discourse URL: {discourse_url} with user {discourse_api_username}")
+        logger.info("Using Discourse URL: %s with user %s", discourse_url, discourse_api_username)
 
         # Validate that all required environment variables are set
         required_vars = [
@@ -46,63 +65,241 @@ class QuestionMigrator:
         if missing_vars:
             raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-        self.questions_fetcher = ConfluenceQuestionsFetcher(confluence_url, confluence_username, confluence_password)
+        # A tuned profile replaces the configured worker counts and rate budget
+        profile = profile or {}
+        writes_per_minute = writes_per_minute or profile.get('writes_per_minute')
+
+        # Load limits that keep the shared Confluence server responsive for its users
+        confluence_latency_slo = float(os.getenv('CONFLUENCE_LATENCY_SLO', '1.0'))
+        confluence_max_concurrency = profile.get('confluence_max_concurrency') or int(os.getenv('CONFLUENCE_MAX_CONCURRENCY', '8'))
+        stream_listings = os.getenv('STREAM_LISTINGS', 'true').lower() == 'true'
+
+        self.questions_fetcher = ConfluenceQuestionsFetcher(confluence_url, confluence_username, confluence_password,
+                                                            latency_slo=confluence_latency_slo,
+                                                            max_concurrency=confluence_max_concurrency,
+                                                            stream_listings=stream_listings)
         self.questions_fetcher.try_count = try_count
-        self.discourse_client = DiscourseClient(discourse_url, discourse_api_key, discourse_api_username)
+        # Each worker gets its own write budget when a rate is configured
+        rate_limiter = RateLimiter(writes_per_minute) if writes_per_minute else None
+
+        # Optional publishing over an event loop, so concurrent workers share one connection pool
+        publisher = None
+        if os.getenv('ASYNC_PUBLISHER', '').lower() in ('1', 'true', 'yes'):
+            if Cassette.active is not None:
+                # aiohttp bypasses the cassette: a replay would write to the live forum, a recording miss the writes
+                logger.warning("The asynchronous publisher is turned off while HTTP exchanges are recorded or replayed")
+            elif importlib.util.find_spec('aiohttp') is None:
+                logger.warning("aiohttp is not installed, publishing with the synchronous client")
+            else:
+                publisher = AsyncDiscoursePublisher(discourse_url, discourse_api_key, discourse_api_username,
+                                                    rate_limiter=rate_limiter,
+                                                    max_connections=int(os.getenv('PUBLISHER_CONNECTIONS', '16')))
+                atexit.register(publisher.close)
+
+        # Optional pool of further API keys, each with a write budget of its own
+        credential_pool = None
+        extra_credentials = parse_api_credentials(os.getenv('DISCOURSE_API_CREDENTIALS'))
+        if extra_credentials:
+            key_writes_per_minute = float(os.getenv('DISCOURSE_KEY_WRITES_PER_MINUTE', '0')) or writes_per_minute
+            credentials = [(discourse_api_username, discourse_api_key)]
+            credentials += [credential for credential in extra_credentials if credential[1] != discourse_api_key]
+            credential_pool = CredentialPool([
+                PooledCredential(discourse_url, username, api_key, writes_per_minute=key_writes_per_minute)
+                for username, api_key in credentials
+            ])
+            logger.info("Spreading Discourse writes over %d API keys", len(credentials))
+            if publisher:
+                logger.warning("The asynchronous publisher writes with DISCOURSE_API_KEY only, "
+                               "the credential pool is not used")
+        # Questions of some spaces can get a category of their own, and topics a tag naming their space
+        self.discourse_client = DiscourseClient(discourse_url, discourse_api_key, discourse_api_username,
+                                                rate_limiter=rate_limiter,
+                                                space_categories=parse_space_categories(os.getenv('SPACE_CATEGORIES')),
+                                                space_tag_prefix=os.getenv('SPACE_TAG_PREFIX') or None,
+                                                multipart_threshold=int(float(os.getenv('MULTIPART_THRESHOLD_MB', '10')) * 1024 * 1024),
+                                                multipart_part_size=int(float(os.getenv('MULTIPART_PART_SIZE_MB', '8')) * 1024 * 1024),
+                                                multipart_workers=profile.get('multipart_workers') or int(os.getenv('MULTIPART_WORKERS', '4')),
+                                                multipart_state_file=f'target/multipart_uploads_{worker_id}.json' if worker_id
+                                                else 'target/multipart_uploads.json',
+                                                publisher=publisher,
+                                                credential_pool=credential_pool)
         self.dry_run = dry_run
         self.try_count = try_count
         self.ignore_duplicate = ignore_duplicate
         # Ensure 'target directory exists
         os.makedirs('target', exist_ok=True)
         self.migrated_questions_file = 'target/migrated_questions.json'
-        self.migrated_questions = self.load_migrated_questions()
+        self.worker_id = worker_id
+        if worker_id:
+            # Workers keep their own state files; the shared state is merged through the coordinator
+            self.migrated_questions_file = f'target/migrated_questions_{worker_id}.json'
+        self.checkpoint_dir = 'target'
+        # Progress of each space of a multi-space run
+        self.space_progress = {}
+        self.space_progress_file = 'target/space_progress.json'
+        self.reset_checkpoint = reset_checkpoint
+        # A dry run plans the migration and predicts its cost instead of simulating it question by question
+        self.cost_model = cost_model or CostModel(writes_per_minute=writes_per_minute or 60)
+        self.plan_file = 'target/dry_run_plan.json'
+        self.plan_workers = confluence_max_concurrency
+        self.prefetch_workers = profile.get('prefetch_workers') or confluence_max_concurrency
+        # Pause after every 5 questions, which paced the writes before there was a write budget
+        self.question_pause = profile.get('question_pause', 5)
+        # With the asynchronous publisher, the bulk path keeps the writes of several topics in flight
+        self.topic_workers = int(os.getenv('PUBLISHER_TOPICS', '4')) if publisher else 1
+        # Loaded on first use, so runs that never consult it skip reading the file
+        self._migrated_questions = None
+        self.state_lock = threading.RLock()
         self.topics_created = 0
         self.confluence_url = confluence_url
         self.confluence_username = confluence_username
         self.confluence_password = confluence_password
-        self.user_registry = UserRegistry()
+        self.user_registry = UserRegistry(f'user_registry_{worker_id}.csv' if worker_id else 'user_registry.csv')
+        self.retry_queue = RetryQueue(f'target/retry_queue_{worker_id}.json' if worker_id else 'target/retry_queue.json')
+        self.journal = MigrationJournal(f'target/migration_journal_{worker_id}.jsonl' if worker_id else 'target/migration_journal.jsonl')
+
+        # Optional queueing of solutions and post edits, flushed off the path that creates topics and posts
+        self.write_behind = None
+        self.write_behind_interval = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0'))
+        if os.getenv('WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'):
+            self.write_behind = WriteBehindQueue(f'target/write_behind_{worker_id}.json' if worker_id else 'target/write_behind.json')
+
+        # Optional publishing of posts as their original authors instead of the API user
+        self.user_mapping = None
+        if os.getenv('POST_AS_AUTHOR', '').lower() in ('1', 'true', 'yes'):
+            self.user_mapping = UserMapping(
+                self.discourse_client,
+                self.user_registry,
+                f'target/user_mapping_{worker_id}.json' if worker_id else 'target/user_mapping.json',
+                create_missing=os.getenv('CREATE_MISSING_USERS', '').lower() in ('1', 'true', 'yes')
+            )
+
+        # Optional image optimization before upload
+        image_optimizer = None
+        if os.getenv('OPTIMIZE_IMAGES', '').lower() in ('1', 'true', 'yes'):
+            image_optimizer = ImageOptimizer(max_dimension=int(os.getenv('IMAGE_MAX_DIMENSION', '2048')))
+            atexit.register(image_optimizer.shutdown)
 
         self.attachment_processor = AttachmentProcessor(
             confluence_url,
             (confluence_username, confluence_password),
             self.discourse_client,
-            dry_run
+            dry_run,
+            retry_queue=self.retry_queue,
+            image_optimizer=image_optimizer,
+            questions_fetcher=self.questions_fetcher
         )
-        self.content_formatter = ContentFormatter(base_url=self.confluence_url)
+        self.link_index = LinkIndex(confluence_url, discourse_url,
+                                    f'target/link_index_{worker_id}.jsonl' if worker_id else 'target/link_index.jsonl')
+        self.content_formatter = ContentFormatter(base_url=self.confluence_url, link_index=self.link_index)
+        # Checks titles, tags and post lengths against the forum's limits before anything is uploaded
+        self.post_validator = PostValidator(self.discourse_client,
+                                            f'target/topic_titles_{worker_id}.txt' if worker_id else 'target/topic_titles.txt',
+                                            dry_run=dry_run)
         self.answer_processor = AnswerProcessor(
             self.questions_fetcher,
             self.discourse_client,
             self.attachment_processor,
             self.user_registry,
             self.content_formatter,
-            dry_run
+            dry_run,
+            prefetch_workers=self.prefetch_workers,
+            retry_queue=self.retry_queue,
+            journal=self.journal,
+            user_mapping=self.user_mapping,
+            link_index=self.link_index,
+            write_behind=self.write_behind,
+            post_validator=self.post_validator
         )
         self.comment_processor = CommentProcessor(
             self.questions_fetcher,
             self.user_registry
         )
 
+    @property
+    def migrated_questions(self):
+        with self.state_lock:
+            if self._migrated_questions is None:
+                self._migrated_questions = self.load_migrated_questions()
+            return self._migrated_questions
+
     def load_migrated_questions(self):
         if os.path.exists(self.migrated_questions_file):
             with open(self.migrated_questions_file, 'r') as f:
                 return json.load(f)
         return []
 
+    def is_migrated(self, question_id):
+        """Check whether a question was migrated, whether its ID was stored as a number or a string."""
+        return question_id in self.migrated_questions or str(question_id) in self.migrated_questions
+
     def save_migrated_questions(self):
         with open(self.migrated_questions_file, 'w') as f:
             json.dump(self.migrated_questions, f)
 
+    def state_files(self):
+        """List the files the migrator keeps its progress in; those of a worker are named after its worker ID."""
+        files = [self.migrated_questions_file, self.user_registry.registry_file, self.retry_queue.queue_file,
+                 self.journal.journal_file, self.link_index.index_file, self.post_validator.titles_file,
+                 self.discourse_client.multipart_uploader.state_file]
+        if self.write_behind:
+            files += [self.write_behind.queue_file, self.write_behind.log_file]
+        if self.user_mapping:
+            files.append(self.user_mapping.mapping_file)
+        return files
+
     def migrate_question(self, question):
+        with log_context(question_id=question['id']):
+            return self._migrate_question(question)
+
+    def _migrate_question(self, question):
         question_id = question['id']
-        if question_id in self.migrated_questions and not self.ignore_duplicate:
-            print(f"Skipping already migrated question: {question['title']} (ID: {question_id})")
+        if self.is_migrated(question_id) and not self.ignore_duplicate:
+            logger.info("Skipping already migrated question: %s (ID: %s)", question['title'], question_id)
             return
 
         title = question['title']
+
+        # Fetch the answers in the background while the question itself is published
+        answer_bundle = None if self.dry_run else self.answer_processor.prefetch_answers(question)
+
+        try:
+            topic_id = self._resume_topic(question_id)
+            if topic_id is not None:
+                logger.info("Resuming question '%s' in existing Discourse topic (ID: %s)", title, topic_id)
+                self._post_missing_parts(question, topic_id)
+            else:
+                with log_stage('topic'):
+                    topic_id = self._create_question_topic(question)
+                # Skip further processing when no topic_id is found
+                if not topic_id:
+                    return False
+
+            with log_stage('answers', topic_id=topic_id):
+                self.answer_processor.process_answers(question, topic_id, answer_bundle)
+            self.update_migration_status(question_id)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.error("Failed to migrate question '%s': %s", title, e)
+            if answer_bundle is not None:
+                answer_bundle.cancel()
+            self.retry_queue.record('question', f"question:{question_id}", {'question': dict(question)}, e)
+            return False
+
+    def _create_question_topic(self, question):
+        """Convert a question and create its Discourse topic.
+
+        Args:
+            question (dict): The question to migrate
+
+        Returns:
+            int: The ID of the created topic, or None in a dry run or when no topic was created
+        """
+        question_id = question['id']
+        # Validated before the attachments are uploaded, so a topic Discourse would refuse costs no uploads
+        title, tags = self._validate_topic(question)
         content = self.prepare_question_content(question)
-        
-        # Extract tags from the question's topics
-        tags = self._extract_tags(question)
+        parts = self.post_validator.split_post(content)
 
         # Register question author
         self.user_registry.register_user(question.get('author'))
@@ -112,52 +309,111 @@ class QuestionMigrator:
 
         if self.dry_run:
             self.simulate_topic_creation(title, content, tags)
-            return False
+            return None
 
-        try:
-            topic = self.discourse_client.create_topic(title, content, question['dateAsked'], tags=tags)
-            if isinstance(topic, dict):
-                topic_id = topic.get('topic_id')
-                if topic_id:
-                    print(f"Created Discourse topic: '{title}' (ID: {topic_id})")
-                else:
-                    logger.warning(f"No topic_id found in response:")
-            # Skip further processing when no topic_id is found
-            if not topic_id:
-                return False
+        if len(parts) > 1:
+            self.journal.parts_expected(question_id, question_id, len(parts))
+        self.journal.topic_pending(question_id)
+        username = self.user_mapping.username_for(question.get('author')) if self.user_mapping else None
+        topic = self.discourse_client.create_topic(title, parts[0], question['dateAsked'], tags=tags,
+                                                   external_id=topic_external_id(question_id), username=username,
+                                                   space_key=question.get('spaceKey'))
+        topic_id = None
+        if isinstance(topic, dict):
+            topic_id = topic.get('topic_id')
+            if topic_id:
+                logger.info("Created Discourse topic: '%s' (ID: %s)", title, topic_id, extra={'topic_id': topic_id})
+            else:
+                logger.warning("No topic_id found in response: %s", topic)
+        if not topic_id:
+            return None
 
-            self.answer_processor.process_answers(question, topic['topic_id'])
-            self.update_migration_status(question_id)
-            return True
-        except (DiscourseClientError, DiscourseServerError) as e:
-            logger.error(f"Failed to create topic '{title}': {str(e)}")
-            return False
+        self.journal.topic_created(question_id, topic_id, topic['id'])
+        self.retry_queue.bind_post(question_id, topic['id'], parts[0])
+        self.link_index.add_topic(question_id, topic_id)
+        self.link_index.defer(topic['id'], question_id, parts[0])
+        self.answer_processor.post_continuations(topic_id, question_id, question_id, parts, username)
+        return topic_id
 
-        
+    def _post_missing_parts(self, question, topic_id):
+        """Post the continuations of a question whose topic an earlier run created."""
+        question_id = question['id']
+        if self.dry_run or not self.journal.missing_parts(question_id, question_id):
+            return
+        # Preparing the content again uploads its attachments again; Discourse hands back the existing uploads
+        parts = self.post_validator.split_post(self.prepare_question_content(question))
+        username = self.user_mapping.username_for(question.get('author')) if self.user_mapping else None
+        logger.info("Posting the missing parts of question %s", question_id)
+        self.answer_processor.post_continuations(topic_id, question_id, question_id, parts, username)
 
-    def prepare_question_content(self, question):
-        question_details = self.questions_fetcher.get_question_details(question['id'])
-        body = question_details.get('body', '')
-        if isinstance(body, dict):
-            body = body.get('content', '')
+    def _validate_topic(self, question):
+        """Fit the title and tags of a question to the limits of the forum.
+
+        Returns:
+            tuple: (title, tags) to create the topic with
+        """
+        tag_manager = self.discourse_client.tag_manager
+        space_key = question.get('spaceKey')
+        tags = [tag_manager.clean_tag_name(tag)
+                for tag in self.discourse_client.topic_tags(self._extract_tags(question), space_key)]
+        required = [tag_manager.clean_tag_name(tag) for tag in self.discourse_client.topic_tags([], space_key)]
+        title = self.post_validator.validate_title(question['title'], question['id'])
+        return title, self.post_validator.validate_tags(tags, required)
+
+    def _resume_topic(self, question_id):
+        """Find the topic an earlier, interrupted run created for a question.
+
+        Args:
+            question_id (str): The ID of the question
+
+        Returns:
+            int: The topic ID, or None if the question has no topic yet
+        """
+        state = self.journal.state(question_id)
+        if not state:
+            return None
+        if state['topic_id'] is not None:
+            return state['topic_id']
+        if state['topic_pending'] and not self.dry_run:
+            # The topic may have been created right before the run stopped
+            topic = self.discourse_client.get_topic_by_external_id(topic_external_id(question_id))
+            if topic:
+                first_post = topic.get('post_stream', {}).get('posts', [{}])[0]
+                self.journal.topic_created(question_id, topic['id'], first_post.get('id'))
+                self.link_index.add_topic(question_id, topic['id'])
+                return topic['id']
+        return None
+
+    def prepare_question_content(self, question, question_details=None):
+        if question_details is None:
+            question_details = self.questions_fetcher.get_question_details(question['id'])
+        body = self._content_body(question_details)
 
         body = self.content_formatter.convert_emojis(body)    
         processed_body = self.attachment_processor.process_attachments(body, question['id'])
         return self.content_formatter.format_question_content(question, question_details, processed_body)
 
+    def _content_body(self, details):
+        body = details.get('body', '')
+        if isinstance(body, dict):
+            body = body.get('content', '')
+        return body
+
     def _extract_tags(self, question):
         return [topic['name'] for topic in question.get('topics', [])] if 'topics' in question else []
 
     def simulate_topic_creation(self, title, content, tags=None):
-        print(f"Would create Discourse topic: '{title}'")
+        logger.info("Would create Discourse topic: '%s'", title)
         if tags:
-            print(f"With tags: {', '.join(tags)}")
-        print(f"Content preview: {content[:100]}...")
+            logger.info("With tags: %s", ', '.join(tags))
+        logger.info("Content preview: %s...", content[:100])
 
     def update_migration_status(self, question_id):
-        self.migrated_questions.append(question_id)
-        self.save_migrated_questions()
-        self.topics_created += 1
+        with self.state_lock:
+            self.migrated_questions.append(question_id)
+            self.save_migrated_questions()
+            self.journal.completed(question_id)
+            self.topics_created += 1
 
     def run_migration(self, space_key=None):
         start = 0
@@ -184,12 +440,83 @@ class QuestionMigrator:
         print(f"{'Dry run: ' if self.dry_run else ''}Migration completed. Total topics created/simulated: {self.topics_created}")
 
     def migrate_single_question(self, question_id):
-        question = self.questions_fetcher.get_question_details(question_id)
-        if not question:
+        result = self._migrate_question_by_id(question_id)
+        if result == 'not found':
             print(f"Question with ID {question_id} not found.")
-            return
-        result = self.migrate_question(question)
-        print(f"Migration of question {question_id} " + ("completed." if result else "skipped."))
+        else:
+            print(f"Migration of question {question_id} " + ("completed." if result == 'migrated' else f"{result}."))
+
+    def migrate_questions_by_id(self, question_ids, workers=4):
+        """Migrate a list of questions by ID with a bounded pool of workers.
+
+        All questions share this migrator, so caches, connections and the Discourse
+        categories are set up once for the whole batch.
+
+        Args:
+            question_ids (list): IDs of the questions to migrate
+            workers (int): Number of questions migrated at the same time
+
+        Returns:
+            dict: Result per question ID ('migrated', 'skipped', 'failed' or 'not found')
+        """
+        print(f"Migrating {len(question_ids)} questions with {workers} workers...")
+        self.provision_users()
+        self.start_write_behind()
+        results = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='question') as executor:
+            futures = {question_id: executor.submit(self._migrate_question_by_id, question_id)
+                       for question_id in question_ids}
+            for question_id, future in futures.items():
+                # An unexpected error fails its own question, not the batch
+                try:
+                    results[question_id] = future.result()
+                except Exception as e:
+                    logger.exception("Failed to migrate question %s: %s", question_id, e)
+                    results[question_id] = 'failed'
+        self.fix_links()
+        self.flush_writes()
+        self.log_run_statistics()
+
+        print("\nMigration results:")
+        for question_id, result in results.items():
+            print(f"  {question_id}: {result}")
+        totals = {}
+        for result in results.values():
+            totals[result] = totals.get(result, 0) + 1
+        print("Totals: " + ", ".join(f"{result}: {count}" for result, count in sorted(totals.items())))
+        return results
+
+    def _migrate_question_by_id(self, question_id):
+        """Fetch and migrate a single question.
+
+        Returns:
+            str: 'migrated', 'skipped', 'failed' or 'not found'
+        """
+        try:
+            question = self.questions_fetcher.get_question_details(question_id)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return 'not found'
+            logger.error("Failed to fetch question %s: %s", question_id, e)
+            return 'failed'
+        except requests.exceptions.RequestException as e:
+            logger.error("Failed to fetch question %s: %s", question_id, e)
+            return 'failed'
+        if not question:
+            return 'not found'
+
+        # Entries left by earlier runs do not count, only the failures of this attempt
+        attempts = self._retry_attempts(question['id'])
+        migrated = self.migrate_question(question)
+        if self._retry_attempts(question['id']) > attempts:
+            return 'failed'
+        return 'migrated' if migrated else 'skipped'
+
+    def _retry_attempts(self, question_id):
+        """Count the failed attempts the retry queue holds for a question and its answers."""
+        entries = self.retry_queue.entries
+        return sum(entries[key]['attempts'] for key in (f"question:{question_id}", f"answers:{question_id}")
+                   if key in entries)
 
     def delete_all_topics(self):
         if self.dry_run:
@@ -197,11 +524,17 @@ class QuestionMigrator:
             return
 
         logger.info("Starting to delete all topics...")
-        
+
         try:
             all_topics = self.discourse_client.get_all_topics()
+        except requests.exceptions.RequestException as e:
+            # Deleting from a partial listing would leave topics behind without saying so
+            logger.error("Failed to list the topics, none were deleted: %s", e)
+            raise
+
+        try:
             total_topics = len(all_topics)
-            logger.info(f"Found {total_topics} topics to delete")
+            logger.info("Found %d topics to delete", total_topics)
             
             deleted_count = 0
             failed_count = 0
@@ -211,88 +544,658 @@ class QuestionMigrator:
                     self.discourse_client.delete_topic(topic['id'])
                     time.sleep(1)
                     deleted_count += 1
-                    logger.info(f"[{index}/{total_topics}] Deleted topic ID: {topic['id']} - '{topic.get('title', 'No title')}'")
+                    logger.info("[%d/%d] Deleted topic ID: %s - '%s'", index, total_topics, topic['id'], topic.get('title', 'No title'))
                     
                     # Additional pause every 20 deletions
                     if deleted_count % 20 == 0:
-                        logger.info(f"Pausing after {deleted_count} deletions...")
+                        logger.info("Pausing after %d deletions...", deleted_count)
                         time.sleep(5)
                         
                 except Exception as e:
                     failed_count += 1
-                    logger.error(f"Failed to delete topic {topic['id']}: {str(e)}")
+                    logger.error("Failed to delete topic %s: %s", topic['id'], e)
                     continue
                     
         except Exception as e:
-            logger.error(f"Failed to fetch topics: {str(e)}")
+            logger.error("Failed to fetch topics: %s", e)
         
         logger.info("\nTopic deletion completed:")
-        logger.info(f"Total topics: {total_topics}")
-        logger.info(f"Successfully deleted: {deleted_count}")
-        logger.info(f"Failed to delete: {failed_count}")
+        logger.info("Total topics: %d", total_topics)
+        logger.info("Successfully deleted: %d", deleted_count)
+        logger.info("Failed to delete: %d", failed_count)
 
     def migrate_questions(self, space_key=None):
         """Migrate questions from oldest to newest.
+
+        Progress is recorded in a checkpoint so that an interrupted run resumes at the
+        question where it stopped instead of re-enumerating and re-walking the whole index.
         
         Args:
             space_key (str, optional): The Confluence space key to migrate from
         """
-        questions = self.questions_fetcher.get_all_questions(space_key)
+        checkpoint = self._load_checkpoint(space_key)
+        questions = checkpoint.questions
+
+        if self.dry_run:
+            self.plan_questions(questions)
+            return
+
+        self.provision_users(questions[checkpoint.position:])
+        self.start_write_behind()
+        self._migrate_checkpoint(checkpoint)
+        self.fix_links()
+        self.flush_writes()
+        self.log_run_statistics()
+
+    def migrate_spaces(self, space_keys=None, workers=4):
+        """Migrate several Confluence spaces in one run.
+
+        Spaces are migrated at the same time by a pool of workers, each space oldest
+        question first from a checkpoint of its own. All spaces share this migrator, so
+        they draw on one Discourse write budget and one Confluence load limit, and the
+        capacity a space leaves unused goes to the others.
+
+        Args:
+            space_keys (list, optional): Keys of the spaces to migrate; all spaces when empty
+            workers (int): Number of spaces migrated at the same time
+
+        Returns:
+            dict: Progress per space key
+        """
+        space_keys = space_keys or self.questions_fetcher.list_spaces()
+        if not space_keys:
+            logger.info("No Confluence spaces to migrate")
+            return {}
+        workers = max(1, min(workers, len(space_keys)))
+        logger.info("Migrating %d spaces with %d workers: %s", len(space_keys), workers, ', '.join(space_keys))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='space') as executor:
+            checkpoints = list(executor.map(self._load_space_checkpoint, space_keys))
+
+        if self.dry_run:
+            self.plan_questions([question for checkpoint in checkpoints for question in checkpoint.questions])
+            return {}
+
+        self.provision_users([question for checkpoint in checkpoints
+                              for question in checkpoint.questions[checkpoint.position:]])
+        self.start_write_behind()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='space') as executor:
+            list(executor.map(self._migrate_space, checkpoints))
+        self.fix_links()
+        self.flush_writes()
+
+        logger.info("Space migration completed:")
+        for space_key, progress in self.space_progress.items():
+            logger.info("  %s: %s, %s/%s questions, %s migrated, %s skipped", space_key, progress['status'],
+                        progress['position'], progress['questions'], progress['migrated'], progress['skipped'])
+        self.log_run_statistics()
+        return self.space_progress
+
+    def log_run_statistics(self):
+        """Log what image optimization saved, how long the Discourse writes took and which keys made them."""
+        if self.attachment_processor.image_optimizer:
+            self.attachment_processor.image_optimizer.log_savings()
+        if self.discourse_client.publisher:
+            self.discourse_client.publisher.log_report()
+        if self.write_behind is not None:
+            logger.info("Write-behind queue: %s", self.write_behind.summary())
+        if self.discourse_client.credential_pool:
+            for credential, stats in self.discourse_client.credential_pool.summary().items():
+                logger.info("API key %s: %d writes, rate limited %d times, %s", credential, stats['writes'],
+                            stats['throttled'], stats['state'])
+
+    def _load_space_checkpoint(self, space_key):
+        with log_context(space_key=space_key):
+            return self._load_checkpoint(space_key)
+
+    def _migrate_space(self, checkpoint):
+        """Migrate the questions of one space, recording its progress in the space progress file."""
+        space_key = checkpoint.space_key
+        with self.state_lock:
+            progress = self.space_progress.setdefault(space_key, {})
+            progress['status'] = 'running'
+        with log_context(space_key=space_key):
+            try:
+                self._migrate_checkpoint(checkpoint, progress)
+                status = 'completed'
+            except Exception as e:
+                # The other spaces carry on; this one resumes from its checkpoint next run
+                logger.exception("Failed to migrate space %s: %s", space_key, e)
+                status = 'failed'
+            with self.state_lock:
+                progress['status'] = status
+            self.save_space_progress()
+
+    def save_space_progress(self):
+        with self.state_lock:
+            temp_file = f"{self.space_progress_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.space_progress, f, indent=2)
+            os.replace(temp_file, self.space_progress_file)
+
+    def _migrate_checkpoint(self, checkpoint, progress=None):
+        """Migrate the questions of a checkpoint from its cursor on, oldest first.
+
+        Args:
+            checkpoint (MigrationCheckpoint): The checkpoint to migrate
+            progress (dict, optional): Counters kept up to date in the space progress file
+        """
+        questions = checkpoint.questions
         total_questions = len(questions)
         
         migrated_count = 0
         skipped_count = 0
+
+        def record_progress():
+            if progress is not None:
+                with self.state_lock:
+                    progress.update(questions=total_questions, position=checkpoint.position,
+                                    migrated=migrated_count, skipped=skipped_count)
+                self.save_space_progress()
         
-        logging.info(f"Starting migration of questions...")
+        logger.info("Starting migration of questions at position %d/%d...", checkpoint.position, total_questions)
+        record_progress()
+
+        # Questions that were in flight when the previous run stopped are finished first
+        for question in checkpoint.pending_in_flight():
+            if self.try_count and self.topics_created >= self.try_count:
+                break
+            logger.info("Resuming in-flight question %s", question['id'])
+            if not self._migrate_checkpointed_question(checkpoint, question, advance=False):
+                skipped_count += 1
+            migrated_count += 1
+            record_progress()
         
+        # A try run stops after a number of topics, so its questions are migrated one at a time
+        topic_workers = 1 if self.try_count else max(1, self.topic_workers)
+        executor = ThreadPoolExecutor(max_workers=topic_workers, thread_name_prefix='topic') if topic_workers > 1 else None
+        running = set()
+
+        def finish(done):
+            nonlocal skipped_count
+            for future in done:
+                running.discard(future)
+                if not future.result():
+                    skipped_count += 1
+            record_progress()
+
         # Process questions from oldest to newest
-        for index, question in enumerate(questions, 1):
+        while checkpoint.position < total_questions:
             if self.try_count and self.topics_created >= self.try_count:
-                logging.info(f"Reached the specified try count of {self.try_count}")
+                logger.info("Reached the specified try count of %d", self.try_count)
                 break
-                
+
+            index = checkpoint.position + 1
+            question = questions[checkpoint.position]
             question_id = question['id']
             creation_date = question['dateAsked']
             creation_date_str = time.strftime('%Y-%m-%d', time.localtime(creation_date/1000))
             
             # Convert question_id to int for consistent comparison
-            if question_id in self.migrated_questions or str(question_id) in self.migrated_questions:
+            if self.is_migrated(question_id):
                 skipped_count += 1
-                logging.info(f"[{index}/{total_questions}] Skipping already migrated question {question_id} from {creation_date_str} : {question['title']}")
+                logger.info("[%d/%d] Skipping already migrated question %s from %s : %s",
+                            index, total_questions, question_id, creation_date_str, question['title'])
+                checkpoint.complete(question_id)
+                record_progress()
                 continue
                 
-            logging.info(f"[{index}/{total_questions}] Processing question {question_id} from {creation_date_str}")
-            
-            if not self.migrate_question(question):
-                skipped_count += 1
+            logger.info("[%d/%d] Processing question %s from %s", index, total_questions, question_id, creation_date_str)
 
-            migrated_count += 1
+            if executor is not None:
+                # The topic chains run side by side; the cursor moves on when a question starts, and the
+                # questions still in flight are resumed from the checkpoint after an interruption
+                if len(running) >= topic_workers:
+                    finish(wait(running, return_when=FIRST_COMPLETED).done)
+                checkpoint.start(question_id, advance=True)
+                running.add(executor.submit(self._migrate_started_question, checkpoint, question))
+                migrated_count += 1
+            else:
+                if not self._migrate_checkpointed_question(checkpoint, question):
+                    skipped_count += 1
+                migrated_count += 1
+                record_progress()
             
             # Add sleep every 5 questions
-            if migrated_count % 5 == 0:
-                logging.info("Pausing for 5 seconds after processing 5 questions...")
-                time.sleep(5)
-        
-        logging.info(f"\nMigration completed:")
-        logging.info(f"Total questions: {total_questions}")
-        logging.info(f"Successfully migrated: {migrated_count}")
-        logging.info(f"Skipped (already migrated): {skipped_count}")
+            if self.question_pause and migrated_count % 5 == 0:
+                logger.info("Pausing for %s seconds after processing 5 questions...", self.question_pause)
+                time.sleep(self.question_pause)
+
+        if executor is not None:
+            if running:
+                finish(wait(running).done)
+            executor.shutdown()
+
+        logger.info("\nMigration completed:")
+        logger.info("Total questions: %d", total_questions)
+        logger.info("Successfully migrated: %d", migrated_count)
+        logger.info("Skipped (already migrated): %d", skipped_count)
+
+    def reconcile(self, space_key=None, snapshot_max_age=3600):
+        """Check that every Confluence question arrived complete in Discourse.
+
+        Args:
+            space_key (str, optional): The Confluence space key that was migrated
+            snapshot_max_age (float): Seconds the cached listings of both sides are reused for
+
+        Returns:
+            dict: The reconciliation report
+        """
+        reconciler = Reconciler(self.questions_fetcher, self.discourse_client, self.link_index, self.retry_queue,
+                                write_behind=self.write_behind, post_validator=self.post_validator,
+                                workers=self.plan_workers, snapshot_max_age=snapshot_max_age)
+        return reconciler.reconcile(space_key)
+
+    def fix_links(self):
+        """Edit the posts with links to questions that were not migrated yet when they were created."""
+        if self.dry_run:
+            return
+        try:
+            self.link_index.fix_links(self.discourse_client, self.write_behind)
+        except requests.exceptions.RequestException as e:
+            # The links stay deferred and are fixed by the next pass
+            logger.error("Failed to fix deferred links: %s", e)
+
+    def start_write_behind(self):
+        """Start flushing the write-behind queue in the background, when an interval is configured."""
+        if self.write_behind is not None and self.write_behind_interval and not self.dry_run:
+            self.write_behind.start_background_flush(self.discourse_client, self.write_behind_interval, self.journal)
+
+    def flush_writes(self):
+        """Send the queued solutions, tags and post edits to Discourse."""
+        if self.write_behind is None or self.dry_run:
+            return
+        self.write_behind.stop_background_flush()
+        self.write_behind.flush(self.discourse_client, self.journal)
+
+    def provision_users(self, questions=()):
+        """Map the authors to Discourse users up front when posts are published as their authors.
+
+        The authors of the given questions are registered first; answer authors known from
+        earlier or dry runs are in the registry already, any others are mapped when first seen.
+
+        Args:
+            questions (list, optional): Questions about to be migrated
+        """
+        if not self.user_mapping or self.dry_run:
+            return
+        for question in questions:
+            self.user_registry.register_user(question.get('author'))
+        self.user_mapping.provision()
+
+    def plan_questions(self, questions):
+        """Plan the migration of questions without writing to Discourse.
+
+        Questions are planned concurrently and the cost model, with the predicted
+        writes, bytes and wall-clock time, is written to the plan file.
+
+        Args:
+            questions (list): The questions to plan, oldest first
+        """
+        pending = [question for question in questions if not self.is_migrated(question['id'])]
+        if self.try_count:
+            pending = pending[:self.try_count]
+
+        logger.info("Dry run: planning %d of %d questions...", len(pending), len(questions))
+        with ThreadPoolExecutor(max_workers=self.plan_workers, thread_name_prefix='plan') as executor:
+            for question, error in zip(pending, executor.map(self._plan_question_safely, pending)):
+                if error:
+                    logger.error("Failed to plan question %s: %s", question['id'], error)
+
+        self.cost_model.write_report(
+            self.plan_file,
+            confluence_requests=self.questions_fetcher.request_count,
+            confluence_seconds=self.questions_fetcher.request_seconds,
+            confluence_concurrency=self.questions_fetcher.concurrency_limiter.max_limit,
+        )
+
+    def _plan_question_safely(self, question):
+        try:
+            with log_context(question_id=question['id'], stage='plan'):
+                self.plan_question(question)
+        except requests.exceptions.RequestException as e:
+            return str(e)
+        return None
+
+    def plan_question(self, question):
+        """Preview a question and add the work it needs to the cost model.
+
+        Args:
+            question (dict): The question to plan
+        """
+        question_details = self.questions_fetcher.get_question_details(question['id'])
+        title, tags = self._validate_topic(question)
+        content = self.prepare_question_content(question, question_details)
+        self.user_registry.register_user(question.get('author'))
+        self.comment_processor.process_question_comments(question['id'], question_details)
+        self.simulate_topic_creation(title, content, tags)
+        # Bodies over the post length become continuation posts
+        continuations = len(self.post_validator.split_post(content)) - 1
+
+        attachment_urls = self.attachment_processor.find_attachment_urls(self._content_body(question_details))
+        answer_bundle = []
+        if question.get('answersCount', 0) > 0:
+            answer_bundle = self.answer_processor.fetch_answer_bundle(question)
+
+        content_bytes = len(content.encode())
+        solutions = 0
+        for answer, answer_details in answer_bundle:
+            self.user_registry.register_user(answer.get('author'))
+            body = self._content_body(answer_details)
+            attachment_urls += self.attachment_processor.find_attachment_urls(body)
+            content_bytes += len(body.encode())
+            continuations += len(self.post_validator.split_post(body)) - 1
+            if self.answer_processor.is_accepted(answer_details):
+                solutions += 1
+
+        self.cost_model.add_question(
+            question['id'], title,
+            posts=len(answer_bundle) + continuations,
+            uploads=len(attachment_urls),
+            upload_bytes=sum(self.attachment_processor.attachment_size(url) for url in attachment_urls),
+            solutions=solutions,
+            tags=len(tags),
+            content_bytes=content_bytes,
+        )
+
+    def _load_checkpoint(self, space_key=None):
+        """Load the migration checkpoint, building or refreshing its question index.
+
+        A dry run or a try-count run works on a throwaway checkpoint so that it never
+        moves the cursor of the real migration.
+
+        Args:
+            space_key (str, optional): The Confluence space key to migrate from
+
+        Returns:
+            MigrationCheckpoint: The checkpoint positioned at the next question to migrate
+        """
+        persistent = not self.dry_run and not self.try_count
+        checkpoint = MigrationCheckpoint(self.checkpoint_dir, space_key, persistent=persistent)
+
+        if persistent and self.reset_checkpoint:
+            checkpoint.reset()
+
+        if persistent and checkpoint.load():
+            new_questions = self.questions_fetcher.fetch_new_questions(space_key, checkpoint.known_ids)
+            added = checkpoint.merge_new_questions(new_questions)
+            if added:
+                logger.info("Added %d new questions to the checkpointed index", added)
+            return checkpoint
+
+        questions = self.questions_fetcher.get_all_questions(space_key)
+        if persistent:
+            checkpoint.set_index(questions)
+        else:
+            checkpoint.questions = questions
+        return checkpoint
+
+    def _migrate_checkpointed_question(self, checkpoint, question, advance=True):
+        """Migrate a question while recording it as in flight in the checkpoint.
+
+        Args:
+            checkpoint (MigrationCheckpoint): The checkpoint of the running migration
+            question (dict): The question to migrate
+            advance (bool): Whether to move the cursor once the question is handled
+
+        Returns:
+            bool: The result of migrate_question
+        """
+        checkpoint.start(question['id'])
+        result = self.migrate_question(question)
+        checkpoint.complete(question['id'], advance=advance)
+        return result
+
+    def _migrate_started_question(self, checkpoint, question):
+        """Migrate a question the cursor already moved past, then take it off the in-flight list."""
+        result = self.migrate_question(question)
+        checkpoint.complete(question['id'], advance=False)
+        return result
+
+    def retry_failed(self, include_permanent=False, wait=True):
+        """Retry the units of work recorded in the retry queue, and nothing else.
+
+        Every entry is retried with exponential backoff until it succeeds or runs out
+        of attempts. A retry that fails again is recorded by the same code path that
+        recorded the original failure.
+
+        Args:
+            include_permanent (bool): Also retry entries whose error was not transient
+            wait (bool): Wait for entries that are not due yet instead of stopping
+        """
+        retried = 0
+        resolved = 0
+        print(f"Retrying failed work: {self.retry_queue.summary() or 'nothing queued'}")
+
+        while True:
+            due = self.retry_queue.due(include_permanent)
+            if not due:
+                next_due_at = self.retry_queue.next_due_at(include_permanent)
+                if not wait or next_due_at is None:
+                    break
+                delay = max(0, next_due_at - time.time())
+                logger.info("Waiting %.0fs for the next retry to become due...", delay)
+                time.sleep(delay)
+                continue
+
+            for entry in due:
+                attempts = entry['attempts']
+                retried += 1
+                try:
+                    self._retry_entry(entry)
+                except requests.exceptions.RequestException as e:
+                    self.retry_queue.record(entry['kind'], entry['key'], {}, e)
+                    continue
+
+                current = self.retry_queue.entries.get(entry['key'])
+                if current is None or current['attempts'] == attempts:
+                    self.retry_queue.resolve(entry['key'])
+                    resolved += 1
+
+        print(f"Retried {retried} units of work, {resolved} resolved. "
+              f"Still queued: {self.retry_queue.summary() or 'nothing'}")
+
+    def _retry_entry(self, entry):
+        """Redo the work of a single retry queue entry."""
+        payload = entry['payload']
+        kind = entry['kind']
+        logger.info("Retrying %s %s (attempt %d)", kind, entry['key'], entry['attempts'] + 1)
+
+        if kind == 'question':
+            question = payload['question']
+            if self.is_migrated(question['id']):
+                return
+            self.migrate_question(question)
+        elif kind == 'answers':
+            self.answer_processor.process_answers(payload['question'], payload['topic_id'],
+                                                  answer_ids=payload['answer_ids'])
+        elif kind == 'solution':
+            self.discourse_client.accept_solution(payload['topic_id'], payload['post_id'])
+            logger.info("Marked post %s as solution for topic %s", payload['post_id'], payload['topic_id'])
+        elif kind == 'upload':
+            if not self.attachment_processor.retry_upload(entry):
+                # Recorded again as a permanent failure rather than resolved
+                raise DiscourseClientError(f"Discourse rejected the upload of {payload['filename']}")
+        else:
+            logger.warning("Unknown retry queue entry kind: %s", kind)
+
+    def migrate_shards(self, coordinator, space_key=None, shard_mode='date', shard_count=8, window_days=30):
+        """Migrate questions as one worker of a sharded migration.
+
+        The worker keeps claiming shards from the coordinator until none are left.
+        Questions within a shard are migrated oldest first, and each question is
+        migrated entirely by this worker so the writes of a topic stay in order.
+
+        Args:
+            coordinator (ShardCoordinator): The shared coordination store
+            space_key (str, optional): The Confluence space key to migrate from
+            shard_mode (str): 'date' to shard by date window, 'hash' to shard by question ID
+            shard_count (int): Number of shards in hash mode
+            window_days (int): Width of a shard in days in date mode
+        """
+        coordinator.ensure_plan(lambda: self.questions_fetcher.get_all_questions(space_key),
+                                shard_mode, shard_count, window_days)
+
+        # Questions migrated by earlier, unsharded runs are skipped as well
+        previously_migrated = set()
+        if os.path.exists('target/migrated_questions.json'):
+            with open('target/migrated_questions.json', 'r') as f:
+                previously_migrated = {str(question_id) for question_id in json.load(f)}
+
+        logger.info("Worker %s starting sharded migration...", coordinator.worker_id)
+        self.provision_users()
+        self.start_write_behind()
+        # Titles are claimed in the shared state, so two shards never give the same title to two topics
+        self.post_validator.shared_titles = coordinator
+
+        while True:
+            shard = coordinator.claim_shard()
+            if not shard:
+                break
+
+            questions = coordinator.shard_questions(shard)
+            logger.info("Worker %s claimed shard %s with %d questions", coordinator.worker_id, shard, len(questions))
+            if coordinator.taken_over_from:
+                # The questions the previous worker left half migrated resume where it stopped
+                self.journal.adopt(f'target/migration_journal_{coordinator.taken_over_from}.jsonl',
+                                   [question['id'] for question in questions])
+
+            # The lease is renewed in the background, however long a question takes
+            coordinator.start_heartbeat(shard)
+            try:
+                for question in questions:
+                    if coordinator.lease_lost.is_set():
+                        logger.warning("Leaving shard %s to the worker that took it over", shard)
+                        break
+                    question_id = question['id']
+                    if str(question_id) in previously_migrated or coordinator.is_migrated(question_id):
+                        continue
+                    if self.migrate_question(question):
+                        coordinator.record_migrated(question_id)
+                else:
+                    coordinator.complete_shard(shard)
+            finally:
+                coordinator.stop_heartbeat()
+            coordinator.merge_users(self.user_registry)
+
+        coordinator.merge_users(self.user_registry)
+        self.fix_links()
+        self.flush_writes()
+        logger.info("Worker %s finished, shard progress: %s", coordinator.worker_id, coordinator.progress())
+
+def read_question_ids(source):
+    """Read question IDs from a comma separated list, a file or stdin.
+
+    Args:
+        source (str): The IDs themselves, the path of a file holding them, or - for stdin
+
+    Returns:
+        list: The question IDs in the order given, without duplicates
+    """
+    if source == '-':
+        text = sys.stdin.read()
+    elif os.path.isfile(source):
+        with open(source, 'r') as f:
+            text = f.read()
+    else:
+        text = source
+
+    question_ids = [value.strip() for value in text.replace(',', ' ').split()]
+    return list(dict.fromkeys(question_id for question_id in question_ids if question_id))
 
 def main():
     parser = argparse.ArgumentParser(description='Migrate questions from Confluence to Discourse.')
     parser.add_argument('--dry-run', action='store_true', help='Perform a dry run without actually creating topics')
     parser.add_argument('--do-run', action='store_true', help='Actually perform the migration (sets dry-run to false, ignores try-count, and does not ignore duplicates)')
-    parser.add_argument('--try-count', type=int, default=2, help='Number of topics to attempt to create (default: 2, ignored if --do-run is set)')
+    parser.add_argument('--try-count', type=int, help='Number of topics to attempt to create (default: 2, ignored if --do-run is set; with --dry-run, the number of questions to plan)')
     parser.add_argument('--question-id', type=str, help='ID of a single question to migrate')
+    parser.add_argument('--question-ids', type=str, help='IDs of questions to migrate: a comma separated list, a file with one ID per line, or - to read them from stdin')
+    parser.add_argument('--workers', type=int, help='Number of questions migrated at the same time with --question-ids (default: 4); with --dry-run, the number of sharded workers the plan assumes (default: 1)')
     parser.add_argument("--ignore-duplicate", action="store_true", help="Ignore duplicate question check")
     parser.add_argument('--delete-all-topics', action='store_true', help='Delete all topics in Discourse')
+    parser.add_argument('--worker-id', type=str, help='Run as a worker of a sharded migration under this unique name')
+    parser.add_argument('--coordination-db', type=str, default='target/coordination.db', help='Shared SQLite database coordinating sharded workers')
+    parser.add_argument('--shard-mode', choices=['date', 'hash'], default='date', help='Split questions by date window or by question ID hash (default: date)')
+    parser.add_argument('--shard-count', type=int, default=8, help='Number of shards in hash mode (default: 8)')
+    parser.add_argument('--shard-window-days', type=int, default=30, help='Width of a shard in days in date mode (default: 30)')
+    parser.add_argument('--writes-per-minute', type=float, help='Discourse write budget of this process')
+    parser.add_argument('--export-shard-state', action='store_true', help='Merge the state of all sharded workers into the regular state files')
+    parser.add_argument('--retry-failed', action='store_true', help='Only retry the failed questions, answers, solutions and uploads recorded in target/retry_queue.json')
+    parser.add_argument('--include-permanent', action='store_true', help='With --retry-failed, also retry failures that are not transient')
+    parser.add_argument('--plan-file', type=str, default='target/dry_run_plan.json', help='Where --dry-run writes the migration plan (default: target/dry_run_plan.json)')
+    parser.add_argument('--upload-mbps', type=float, default=16, help='Upload bandwidth assumed by the --dry-run plan in megabits per second (default: 16)')
+    parser.add_argument('--download-mbps', type=float, default=64, help='Confluence download bandwidth assumed by the --dry-run plan in megabits per second (default: 64)')
+    parser.add_argument('--provision-users', action='store_true', help='Map all registered Confluence authors to Discourse users (requires POST_AS_AUTHOR)')
+    parser.add_argument('--fix-links', action='store_true', help='Only point the deferred links between questions at their migrated Discourse topics')
+    parser.add_argument('--flush-writes', action='store_true', help='Only send the solutions, tags and post edits queued in target/write_behind.json (requires WRITE_BEHIND)')
+    parser.add_argument('--reconcile', action='store_true', help='Compare Confluence with Discourse and write a report of incomplete questions to target/reconcile')
+    parser.add_argument('--snapshot-max-age', type=float, default=60, help='Minutes --reconcile reuses its cached listings for, 0 to always refresh (default: 60)')
+    parser.add_argument('--reset-checkpoint', action='store_true', help='Discard the saved migration checkpoint and re-enumerate all questions')
+    parser.add_argument('--spaces', type=str, help='Migrate these Confluence spaces in one run: a comma separated list of space keys, or "all" to discover every space')
+    parser.add_argument('--space-workers', type=int, default=4, help='Number of spaces migrated at the same time with --spaces (default: 4)')
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', type=str, metavar='DIR', help='Record every HTTP exchange of the run into a cassette directory')
+    cassette_group.add_argument('--replay', type=str, metavar='DIR', help='Serve every HTTP request from a recorded cassette directory instead of the network')
+    parser.add_argument('--calibrate', action='store_true', help='Measure a sample of questions and write a tuned profile of worker counts and rate budgets; with --dry-run nothing is written to Discourse, otherwise the sample is migrated (use a staging forum)')
+    parser.add_argument('--calibration-sample', type=int, default=20, help='Number of questions --calibrate measures (default: 20)')
+    parser.add_argument('--autotune', action='store_true', help='Apply the tuned profile and keep adjusting it to the bottleneck during the run')
+    parser.add_argument('--autotune-interval', type=float, default=60, help='Seconds between two adjustments with --autotune (default: 60)')
+    parser.add_argument('--profile', type=str, help='Tuned profile to apply; --calibrate and --autotune write it (default: target/tuned_profile.json)')
+    parser.add_argument('--replay-speed', type=float, default=0, help='With --replay, 1 waits the recorded response times, 2 half of them and 0 not at all (default: 0)')
 
     args = parser.parse_args()
 
+    if args.record:
+        Cassette(args.record).record()
+    elif args.replay:
+        Cassette(args.replay).replay(speed=args.replay_speed)
+
+    profile_file = args.profile or 'target/tuned_profile.json'
+    profile = load_profile(profile_file) if args.profile or args.autotune else None
+
     # If question-id is provided, ignore dry-run and try-count
-    if args.question_id:
+    if args.calibrate:
+        # The sample is migrated with state files of its own, so the real run does not take it as migrated
+        migrator = QuestionMigrator(dry_run=args.dry_run, try_count=None, worker_id=CALIBRATION_WORKER_ID,
+                                    writes_per_minute=args.writes_per_minute)
+        Autotuner(migrator, profile_file).calibrate(os.getenv('CONFLUENCE_SPACE_KEY'), args.calibration_sample)
+    elif args.question_id:
         migrator = QuestionMigrator(dry_run=False, try_count=None, ignore_duplicate=True)
         migrator.migrate_single_question(args.question_id)
+    elif args.question_ids:
+        migrator = QuestionMigrator(dry_run=False, try_count=None, ignore_duplicate=True)
+        migrator.migrate_questions_by_id(read_question_ids(args.question_ids), workers=args.workers or 4)
+    elif args.provision_users:
+        migrator = QuestionMigrator(dry_run=False, try_count=None)
+        if not migrator.user_mapping:
+            parser.error('--provision-users requires POST_AS_AUTHOR=true')
+        migrator.provision_users()
+    elif args.reconcile:
+        migrator = QuestionMigrator(dry_run=False, try_count=None)
+        migrator.reconcile(os.getenv('CONFLUENCE_SPACE_KEY'), snapshot_max_age=args.snapshot_max_age * 60)
+    elif args.fix_links:
+        migrator = QuestionMigrator(dry_run=False, try_count=None)
+        migrator.fix_links()
+        migrator.flush_writes()
+    elif args.flush_writes:
+        migrator = QuestionMigrator(dry_run=False, try_count=None)
+        if not migrator.write_behind:
+            parser.error('--flush-writes requires WRITE_BEHIND=true')
+        migrator.flush_writes()
+        migrator.log_run_statistics()
+    elif args.retry_failed:
+        migrator = QuestionMigrator(dry_run=False, try_count=None)
+        migrator.retry_failed(include_permanent=args.include_permanent)
+    elif args.export_shard_state:
+        coordinator = ShardCoordinator(args.coordination_db, 'export')
+        coordinator.export_state('target/migrated_questions.json', 'user_registry.csv', 'target/link_index.jsonl')
+    elif args.worker_id:
+        migrator = QuestionMigrator(dry_run=False, try_count=None, worker_id=args.worker_id,
+                                    writes_per_minute=args.writes_per_minute)
+        coordinator = ShardCoordinator(args.coordination_db, args.worker_id)
+        with log_context(worker_id=args.worker_id):
+            migrator.migrate_shards(coordinator, os.getenv('CONFLUENCE_SPACE_KEY'),
+                                    args.shard_mode, args.shard_count, args.shard_window_days)
     elif args.delete_all_topics:
         migrator = QuestionMigrator(dry_run=args.dry_run)
         migrator.delete_all_topics()
@@ -303,14 +1206,34 @@ def main():
             args.try_count = None
             args.ignore_duplicate = False
             print("Do run specified. Dry run disabled, try count ignored, and duplicates will not be ignored.")
-        elif args.try_count is not None:
-            args.dry_run = False
+        elif args.dry_run:
+            print(f"Dry run specified. Planning the migration into {args.plan_file}.")
+        else:
+            args.try_count = args.try_count or 2
             print(f"Try count set to {args.try_count}. Dry run disabled.")
         
         space_key = os.getenv('CONFLUENCE_SPACE_KEY')
         
-        migrator = QuestionMigrator(dry_run=args.dry_run, try_count=args.try_count, ignore_duplicate=args.ignore_duplicate)
-        migrator.migrate_questions(space_key)
+        cost_model = CostModel(writes_per_minute=args.writes_per_minute or 60, workers=args.workers or 1,
+                               upload_bytes_per_second=args.upload_mbps * 1_000_000 / 8,
+                               download_bytes_per_second=args.download_mbps * 1_000_000 / 8)
+        migrator = QuestionMigrator(dry_run=args.dry_run, try_count=args.try_count, ignore_duplicate=args.ignore_duplicate,
+                                    reset_checkpoint=args.reset_checkpoint, writes_per_minute=args.writes_per_minute,
+                                    cost_model=cost_model, profile=profile)
+        migrator.plan_file = args.plan_file
+        autotuner = None
+        if args.autotune and not args.dry_run:
+            autotuner = Autotuner(migrator, profile_file, interval=args.autotune_interval)
+            autotuner.start()
+        try:
+            if args.spaces:
+                space_keys = [] if args.spaces == 'all' else [key.strip() for key in args.spaces.split(',') if key.strip()]
+                migrator.migrate_spaces(space_keys, workers=args.space_workers)
+            else:
+                migrator.migrate_questions(space_key)
+        finally:
+            if autotuner:
+                autotuner.stop()
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,33 @@
 import csv
 import os
+import threading
 
 class UserRegistry:
     def __init__(self, registry_file='user_registry.csv'):
         self.registry_file = registry_file
-        self.registry = self.load_registry()
+        self._registry = None
+        self.emails = {}
+        self.lock = threading.RLock()
+
+    @property
+    def registry(self):
+        """The registry, loaded from disk on first use"""
+        with self.lock:
+            if self._registry is None:
+                self._registry = self.load_registry()
+            return self._registry
 
     def load_registry(self):
         """Load existing user registry or create new one"""
         registry = {}
+        self.emails = {}
         if os.path.exists(self.registry_file):
             with open(self.registry_file, 'r', newline='') as f:
                 reader = csv.DictReader(f)
                 for row in reader:
-                    registry[row['username']] = row['email']
+                    registry[row['FullName']] = row['username']
+                    if row.get('email'):
+                        self.emails[row['username']] = row['email']
         return registry
 
     def save_registry(self):
@@ -22,13 +36,16 @@ class UserRegistry:
             writer = csv.DictWriter(f, fieldnames=['FullName', 'username', 'email'])
             writer.writeheader()
             for fullname, username in self.registry.items():
-                writer.writerow({'FullName': fullname, 'username': username})
+                writer.writerow({'FullName': fullname, 'username': username, 'email': self.emails.get(username)})
 
     def register_user(self, user_data):
         """Register a user in the registry"""
         if not user_data:
             return
-        
+        with self.lock:
+            self._register_user(user_data)
+
+    def _register_user(self, user_data):
         username = user_data.get('name')  # This could be email or username
         full_name = user_data.get('fullName')
         email = None
@@ -39,27 +56,24 @@ class UserRegistry:
         else:
             email = user_data.get('email')  # Try to get email from data
         
-        if not username or username in self.registry:
+        if not username or full_name in self.registry:
             return
-        # Validate and clean email
-
-            
-        # Store all three attributes
-        self.registry[full_name] = {
-            'username': username,
-            'email': email,
-            'full_name': full_name
-        }
 
-
-
-        self.registry[full_name] = username  # Store full name as key, email as value
+        self.registry[full_name] = username  # Store full name as key, username as value
+        if email:
+            self.emails[username] = email
         self.save_registry()
 
     def get_user(self, username):
         """Get user details from registry"""
         return self.registry.get(username)
 
+    def get_email(self, username):
+        """Get the email address of a registered user, if known"""
+        if self._registry is None:
+            self.registry  # Loads the emails along with the registry
+        return self.emails.get(username)
+
     def get_all_users(self):
         """Get all registered users"""
-        return self.registry 
\ No newline at end of file
+        return self.registry
@@ -1,67 +1,246 @@
 import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from content_formatter import ContentFormatter
+from migration_journal import answer_marker, part_marker
+
+logger = logging.getLogger(__name__)
 
 class AnswerProcessor:
-    def __init__(self, questions_fetcher, discourse_client, attachment_processor, user_registry, content_formatter, dry_run=True):
+    def __init__(self, questions_fetcher, discourse_client, attachment_processor, user_registry, content_formatter, dry_run=True, prefetch_workers=4, retry_queue=None, journal=None, user_mapping=None, link_index=None, write_behind=None, post_validator=None):
         self.questions_fetcher = questions_fetcher
         self.discourse_client = discourse_client
         self.attachment_processor = attachment_processor
         self.user_registry = user_registry
         self.dry_run = dry_run
         self.content_formatter = content_formatter
+        self.retry_queue = retry_queue
+        self.journal = journal
+        self.user_mapping = user_mapping
+        self.link_index = link_index
+        self.write_behind = write_behind
+        self.post_validator = post_validator
+        # Bundles are assembled on their own pool so that they never wait on the
+        # answer detail fetches they submit themselves
+        self.bundle_executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='answer-bundle')
+        self.details_executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='answer-details')
+
+    def prefetch_answers(self, question):
+        """Start fetching the answer bundle of a question in the background.
+        
+        Args:
+            question (dict): The question data
+            
+        Returns:
+            Future: Resolves to the answer bundle, or None if the question has no answers
+        """
+        if question.get('answersCount', 0) <= 0:
+            return None
+        return self.bundle_executor.submit(self.fetch_answer_bundle, question)
 
-    def process_answers(self, question, topic_id):
+    def fetch_answer_bundle(self, question):
+        """Fetch every answer of a question together with its details.
+        
+        The answer listing is paged through completely and the details of all
+        answers are fetched concurrently.
+        
+        Args:
+            question (dict): The question data
+            
+        Returns:
+            List[tuple]: (answer, answer_details) pairs in chronological order
+        """
+        answers = self.questions_fetcher.get_all_answers(question['id'])
+        if not isinstance(answers, list):
+            logger.warning("Unexpected format for answers: %s", type(answers))
+            return []
+
+        details = self.details_executor.map(
+            lambda answer: self.questions_fetcher.get_answer_details(answer['id']), answers
+        )
+        bundle = list(zip(answers, details))
+        bundle.sort(key=lambda pair: pair[1].get('dateAnswered', 0))
+        return bundle
+
+    def process_answers(self, question, topic_id, bundle=None, answer_ids=None):
         """Process all answers for a given question and add them to the Discourse topic.
         
+        When an answer cannot be posted, it and the answers after it are queued for
+        retry, so that a retry still posts them in chronological order.
+        
         Args:
             question (dict): The question data containing answers
             topic_id (int): The Discourse topic ID to add answers to
+            bundle (Future, optional): Answer bundle started with prefetch_answers
+            answer_ids (list, optional): Only post the answers with these IDs
         """
         if question['answersCount'] <= 0:
             return
 
-        answers = self.questions_fetcher.get_answers(question['id'])
-        if isinstance(answers, list):
-            self._process_answer_list(answers, topic_id, question['title'])
-        elif isinstance(answers, dict) and 'results' in answers:
-            self._process_answer_list(answers['results'], topic_id, question['title'])
+        if bundle is not None:
+            answer_bundle = bundle.result()
         else:
-            logging.warning(f"Unexpected format for answers: {type(answers)}")
+            answer_bundle = self.fetch_answer_bundle(question)
+
+        if answer_ids is not None:
+            wanted = {str(answer_id) for answer_id in answer_ids}
+            answer_bundle = [pair for pair in answer_bundle if str(pair[0]['id']) in wanted]
 
-    def _process_answer_list(self, answers, topic_id, title):
-        """Process a list of answers and add them to the topic.
+        for index, (answer, answer_details) in enumerate(answer_bundle):
+            self.user_registry.register_user(answer.get('author'))
+
+            post_id = self._posted_answer(question['id'], topic_id, answer['id'])
+            try:
+                if post_id is None:
+                    self.add_answer_to_topic(topic_id, answer, question['title'], answer_details, question['id'])
+                    continue
+                # Posted by an earlier, interrupted run; only continuations and the solution may be missing
+                self._post_missing_parts(topic_id, answer, answer_details, question['id'])
+            except requests.exceptions.RequestException as e:
+                if self.retry_queue is None:
+                    raise
+                logger.error("Failed to add answer %s to topic '%s': %s", answer['id'], question['title'], e)
+                self.retry_queue.record('answers', f"answers:{question['id']}", {
+                    'question': dict(question),
+                    'topic_id': topic_id,
+                    'answer_ids': [pair[0]['id'] for pair in answer_bundle[index:]],
+                }, e)
+                return
+            if self.is_accepted(answer_details):
+                self._mark_answer_as_solution(topic_id, post_id, question['id'])
+
+    def _posted_answer(self, question_id, topic_id, answer_id):
+        """Find the post of an answer that an earlier run already created.
         
         Args:
-            answers (List[dict]): List of answer data
+            question_id (str): The ID of the question the answer belongs to
             topic_id (int): The Discourse topic ID
-            title (str): The topic title for logging
+            answer_id (str): The ID of the answer
+            
+        Returns:
+            int: The post ID, or None if the answer has not been posted
         """
-        for answer in answers:
-            self.user_registry.register_user(answer.get('author'))
-            self.add_answer_to_topic(topic_id, answer, title)
+        state = self.journal.state(question_id) if self.journal is not None else None
+        if not state:
+            return None
+        if str(answer_id) in state['answers']:
+            return state['answers'][str(answer_id)]
+        if str(answer_id) in state['pending_answers'] and not self.dry_run:
+            # The post may have been created right before the run stopped
+            post = self.discourse_client.find_post_with_marker(topic_id, answer_marker(answer_id))
+            if post:
+                self.journal.answer_posted(question_id, answer_id, post['id'])
+                if self.link_index is not None:
+                    self.link_index.add_answer(answer_id, post['id'], question_id)
+                return post['id']
+        return None
 
-    def add_answer_to_topic(self, topic_id, answer, title):
+    def add_answer_to_topic(self, topic_id, answer, title, answer_details=None, question_id=None):
         """Add a single answer as a post to a Discourse topic.
         
         Args:
             topic_id (int): The Discourse topic ID
             answer (dict): The answer data to add
             title (str): The topic title for logging
+            answer_details (dict, optional): Prefetched answer details
+            question_id (str, optional): The ID of the question, to journal the post under
         """
-        answer_id = answer['id']
-        answer_details = self.questions_fetcher.get_answer_details(answer_id)
+        if answer_details is None:
+            answer_details = self.questions_fetcher.get_answer_details(answer['id'])
         answer_content = self._prepare_answer_content(answer_details)
-        
+        # Answers over the post length of the forum go on in continuation posts
+        parts = self.post_validator.split_post(answer_content) if self.post_validator else [answer_content]
+
         if self.dry_run:
-            print(f"Would add answer to topic '{title}'")
-            print(f"Answer preview: {answer_content[:100]}...")
+            logger.info("Would add answer to topic '%s' in %d post(s)", title, len(parts))
+            logger.info("Answer preview: %s...", answer_content[:100])
             return
 
-        post = self.discourse_client.create_post(topic_id, answer_content)
-        print(f"Added answer to topic '{title}'")
+        # The marker lets a resumed run recognise the post if the journal missed it
+        answer_content = f"{parts[0]}\n\n{answer_marker(answer['id'])}"
+        journaled = self.journal is not None and question_id is not None
+        if journaled:
+            if len(parts) > 1:
+                self.journal.parts_expected(question_id, answer['id'], len(parts))
+            self.journal.answer_pending(question_id, answer['id'])
+        username = self.user_mapping.username_for(answer.get('author')) if self.user_mapping else None
+        post = self.discourse_client.create_post(topic_id, answer_content, username=username)
+        if journaled:
+            self.journal.answer_posted(question_id, answer['id'], post['id'])
+        logger.info("Added answer to topic '%s'", title, extra={'answer_id': answer['id'], 'post_id': post['id']})
+        if self.link_index is not None:
+            self.link_index.add_answer(answer['id'], post['id'], question_id)
+            self.link_index.defer(post['id'], question_id, answer_content)
+        if self.retry_queue is not None:
+            self.retry_queue.bind_post(answer_details['id'], post['id'], answer_content)
+        self.post_continuations(topic_id, question_id, answer['id'], parts, username)
         
-        if answer_details.get('accepted', True):
-            self._mark_answer_as_solution(topic_id, post['id'])
+        if self.is_accepted(answer_details):
+            self._mark_answer_as_solution(topic_id, post['id'], question_id)
+
+    def post_continuations(self, topic_id, question_id, content_id, parts, username=None):
+        """Post the continuation parts of a split question or answer that are not posted yet.
+
+        Every part carries a hidden marker, so a part that was pending when a run
+        stopped is found in the topic instead of being posted twice.
+
+        Args:
+            topic_id (int): The Discourse topic ID
+            question_id (str): The ID of the question, to journal the posts under
+            content_id (str): The ID of the question or answer that was split
+            parts (list): The content of the first post followed by that of its continuations
+            username (str, optional): Discourse user to post as
+        """
+        journaled = self.journal is not None and question_id is not None
+        for part in range(1, len(parts)):
+            if journaled and self._posted_part(question_id, topic_id, content_id, part) is not None:
+                continue
+            content = f"{parts[part]}\n\n{part_marker(content_id, part)}"
+            if journaled:
+                self.journal.part_pending(question_id, content_id, part)
+            post = self.discourse_client.create_post(topic_id, content, username=username)
+            if journaled:
+                self.journal.part_posted(question_id, content_id, part, post['id'])
+            if self.retry_queue is not None:
+                self.retry_queue.bind_post(content_id, post['id'], content)
+            if self.link_index is not None:
+                self.link_index.add_continuation(question_id, post['id'])
+                self.link_index.defer(post['id'], question_id, content)
+
+    def _posted_part(self, question_id, topic_id, content_id, part):
+        """Find the continuation post of a part that an earlier run already created.
+
+        Returns:
+            int: The post ID, or None if the part has not been posted
+        """
+        state = self.journal.state(question_id)
+        if not state:
+            return None
+        key = f"{content_id}:{part}"
+        if key in state['posted_parts']:
+            return state['posted_parts'][key]
+        if key in state['pending_parts'] and not self.dry_run:
+            post = self.discourse_client.find_post_with_marker(topic_id, part_marker(content_id, part))
+            if post:
+                self.journal.part_posted(question_id, content_id, part, post['id'])
+                if self.link_index is not None:
+                    self.link_index.add_continuation(question_id, post['id'])
+                return post['id']
+        return None
+
+    def _post_missing_parts(self, topic_id, answer, answer_details, question_id):
+        """Post the continuations of an answer whose first post an earlier run created."""
+        if self.journal is None or self.dry_run or not self.journal.missing_parts(question_id, answer['id']):
+            return
+        # Preparing the content again uploads its attachments again; Discourse hands back the existing uploads
+        parts = self.post_validator.split_post(self._prepare_answer_content(answer_details))
+        username = self.user_mapping.username_for(answer.get('author')) if self.user_mapping else None
+        logger.info("Posting the missing parts of answer %s", answer['id'])
+        self.post_continuations(topic_id, question_id, answer['id'], parts, username)
+
+    def is_accepted(self, answer_details):
+        """Check whether an answer is to be marked as the solution; answers without the flag are not."""
+        return bool(answer_details.get('accepted', False))
 
     def _prepare_answer_content(self, answer_details):
         body = answer_details.get('body', '')
@@ -73,14 +252,31 @@ class AnswerProcessor:
         processed_body = self.attachment_processor.process_attachments(body, answer_details['id'])
         return self.content_formatter.format_answer_content(answer_details, processed_body)
 
-    def _mark_answer_as_solution(self, topic_id, post_id):
+    def _mark_answer_as_solution(self, topic_id, post_id, question_id=None):
         
         if self.dry_run:
-            print(f"Would mark post {post_id} as solution for topic {topic_id}")
+            logger.info("Would mark post %s as solution for topic %s", post_id, topic_id)
+            return
+
+        journaled = self.journal is not None and question_id is not None
+        if journaled:
+            state = self.journal.state(question_id)
+            if state and post_id in state['solutions']:
+                return
+
+        if self.write_behind is not None:
+            # Accepted when the write-behind queue is flushed, off the path that creates the posts
+            self.write_behind.accept_solution(topic_id, post_id, question_id)
+            logger.info("Queued post %s as solution for topic %s", post_id, topic_id)
             return
 
         try:
             self.discourse_client.accept_solution(topic_id, post_id)
-            print(f"Marked post {post_id} as solution for topic {topic_id}")
+            logger.info("Marked post %s as solution for topic %s", post_id, topic_id)
+            if journaled:
+                self.journal.solution_accepted(question_id, post_id)
         except Exception as e:
-            logging.error(f"Failed to mark post {post_id} as solution: {str(e)}") 
\ No newline at end of file
+            logger.error("Failed to mark post %s as solution: %s", post_id, e)
+            if self.retry_queue is not None:
+                self.retry_queue.record('solution', f"solution:{topic_id}:{post_id}",
+                                        {'topic_id': topic_id, 'post_id': post_id}, e)
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from pydiscourse.exceptions import DiscourseClientError, DiscourseRateLimitedError, DiscourseServerError
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDiscoursePublisher:
+    """Publishes to Discourse from an event loop over one pool of keep-alive connections.
+
+    The publisher offers the writes of DiscourseClient as coroutines. They run on an
+    event loop in a background thread, so any number of migration threads can
+    publish through it at once: writes to different topics are in flight at the
+    same time, while the writes to one topic pass a lock of that topic in the
+    order they were submitted. The latency of every request is recorded per
+    operation and summarized by report().
+
+    From threads, submit() schedules a write and returns a future, and run() waits
+    for its result. Errors are raised as the pydiscourse exceptions the rest of the
+    migration handles, and network errors and timeouts as the requests exceptions
+    the synchronous client raises. aiohttp is imported when the publisher starts.
+    """
+
+    def __init__(self, host, api_key, api_username, rate_limiter=None, max_connections=16, timeout=120, retries=4):
+        """Initialize the publisher.
+
+        Args:
+            host (str): The Discourse host URL
+            api_key (str): The Discourse API key
+            api_username (str): The Discourse API username
+            rate_limiter (RateLimiter, optional): Budget that every write waits on
+            max_connections (int): Size of the connection pool, and so of the writes in flight
+            timeout (float): Seconds after which a request times out
+            retries (int): Attempts of a request that Discourse rate limits
+        """
+        self.host = host.rstrip('/')
+        self.api_key = api_key
+        self.api_username = api_username
+        self.rate_limiter = rate_limiter
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.loop = None
+        self.session = None
+        self.thread = None
+        self.topic_locks = {}
+        self.latencies = defaultdict(list)
+        self.stats_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        """Start the event loop and open the connection pool, if that has not happened yet."""
+        with self.start_lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=loop.run_forever, name='publisher', daemon=True)
+            self.thread.start()
+            asyncio.run_coroutine_threadsafe(self._open_session(), loop).result()
+            self.loop = loop
+
+    async def _open_session(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'Accept': 'application/json; charset=utf-8', 'Api-Key': self.api_key},
+        )
+
+    def close(self):
+        """Close the connection pool and stop the event loop."""
+        with self.start_lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def submit(self, coroutine):
+        """Schedule a write from any thread.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result of the write
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+        """Run a write from any thread and wait for its result."""
+        return self.submit(coroutine).result()
+
+    async def create_topic(self, title, raw_content, category_id, tags=None, external_id=None, username=None):
+        """Create a new topic.
+
+        Args:
+            title (str): The title of the topic
+            raw_content (str): The content/body of the topic
+            category_id (int): Category ID to place the topic in
+            tags (List[str], optional): Cleaned tags to apply to the topic
+            external_id (str, optional): Idempotency key the topic can be looked up by
+            username (str, optional): Discourse user to create the topic as, instead of the API user
+
+        Returns:
+            dict: The created first post, with its 'topic_id'
+        """
+        payload = {'title': title, 'raw': raw_content, 'category': category_id, 'tags': tags or []}
+        if external_id:
+            payload['external_id'] = external_id
+        return await self._request('create_topic', 'POST', '/posts.json', json_body=payload, username=username)
+
+    async def create_post(self, topic_id, raw_content, username=None):
+        """Create a new post within an existing topic, after the writes to the topic submitted before it.
+
+        Returns:
+            dict: The created post
+        """
+        async with self._topic_lock(topic_id):
+            return await self._request('create_post', 'POST', '/posts.json',
+                                       json_body={'topic_id': topic_id, 'raw': raw_content}, username=username)
+
+    async def update_post(self, post_id, raw_content, edit_reason='', topic_id=None):
+        """Replace the content of an existing post.
+
+        Args:
+            post_id (int): The ID of the post to edit
+            raw_content (str): The new content of the post
+            edit_reason (str, optional): Reason shown in the post's edit history
+            topic_id (int, optional): The topic of the post, to order the edit after earlier writes to it
+
+        Returns:
+            dict: The updated post
+        """
+        async with self._topic_lock(topic_id):
+            return await self._request('update_post', 'PUT', f'/posts/{post_id}.json',
+                                       json_body={'post': {'raw': raw_content, 'edit_reason': edit_reason}})
+
+    async def accept_solution(self, topic_id, post_id):
+        """Mark a post as the accepted solution, after the writes to the topic submitted before it."""
+        async with self._topic_lock(topic_id):
+            return await self._request('accept_solution', 'POST', '/solution/accept', json_body={'id': post_id})
+
+    async def upload_file(self, filename, file_content):
+        """Upload a file in a single request.
+
+        Returns:
+            dict: The upload
+        """
+        import aiohttp
+
+        def build_form():
+            # A form can only be sent once, so a retried request gets a new one
+            form = aiohttp.FormData()
+            form.add_field('type', 'composer')
+            form.add_field('synchronous', 'true')
+            form.add_field('file', file_content, filename=filename)
+            return form
+
+        return await self._request('upload_file', 'POST', '/uploads.json', data=build_form)
+
+    async def get_post_raw(self, post_id):
+        """Get the raw content of a post."""
+        post = await self._request('get_post', 'GET', f'/posts/{post_id}.json', write=False)
+        return post.get('raw', '')
+
+    def _topic_lock(self, topic_id):
+        if topic_id is None:
+            return _NoLock()
+        # Only the event loop thread touches the locks, so no thread lock is needed
+        lock = self.topic_locks.get(topic_id)
+        if lock is None:
+            lock = self.topic_locks[topic_id] = asyncio.Lock()
+        return lock
+
+    async def _request(self, operation, method, path, json_body=None, data=None, username=None, write=True):
+        import aiohttp
+
+        headers = {'Api-Username': username or self.api_username}
+        for attempt in range(1, self.retries + 1):
+            if write and self.rate_limiter:
+                await asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.acquire)
+
+            started = time.monotonic()
+            try:
+                async with self.session.request(method, self.host + path, json=json_body,
+                                                data=data() if callable(data) else data, headers=headers,
+                                                allow_redirects=False) as response:
+                    body = await response.read()
+                    elapsed = time.monotonic() - started
+                    status = response.status
+                    response_headers = dict(response.headers)
+            except asyncio.TimeoutError as e:
+                # Raised as the requests exceptions the callers handle like those of the synchronous client
+                raise requests.exceptions.Timeout(f"{method} {path} timed out after {self.timeout}s") from e
+            except aiohttp.ClientError as e:
+                raise requests.exceptions.ConnectionError(f"{method} {path} failed: {e}") from e
+
+            self._record_latency(operation, elapsed)
+            logger.debug("%s %s returned %d in %.3fs", method, path, status, elapsed,
+                         extra={'stage': operation, 'duration': round(elapsed, 3)})
+
+            if status == 429 and attempt < self.retries:
+                try:
+                    wait = json.loads(body)['extras']['wait_seconds'] + 1
+                except (ValueError, KeyError, TypeError):
+                    wait = 10
+                logger.info("Rate limited on %s %s, waiting %ss", method, path, wait)
+                await asyncio.sleep(wait)
+                continue
+            break
+
+        if status < 300:
+            return json.loads(body) if body.strip() else None
+
+        error_response = _requests_response(status, response_headers, body, self.host + path)
+        if status == 429:
+            raise DiscourseRateLimitedError("Number of rate limit retries exceeded", response=error_response)
+        if 400 <= status < 500:
+            raise DiscourseClientError(_error_message(body, status), response=error_response)
+        raise DiscourseServerError(_error_message(body, status), response=error_response)
+
+    def _record_latency(self, operation, elapsed):
+        with self.stats_lock:
+            self.latencies[operation].append(elapsed)
+
+    def report(self):
+        """Summarize the latency of the requests made so far.
+
+        Returns:
+            dict: Per operation, the request count and the mean, median, 95th percentile
+                  and slowest latency in seconds
+        """
+        with self.stats_lock:
+            latencies = {operation: sorted(values) for operation, values in self.latencies.items()}
+        return {
+            operation: {
+                'count': len(values),
+                'mean': statistics.mean(values),
+                'p50': values[len(values) // 2],
+                'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                'max': values[-1],
+            }
+            for operation, values in latencies.items()
+        }
+
+    def log_report(self):
+        for operation, stats in sorted(self.report().items()):
+            logger.info("%s: %d requests, mean %.3fs, p50 %.3fs, p95 %.3fs, max %.3fs", operation, stats['count'],
+                        stats['mean'], stats['p50'], stats['p95'], stats['max'])
+
+
+class _NoLock:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def _requests_response(status, headers, body, url):
+    """Wrap a response so error handlers can inspect it like the responses of pydiscourse."""
+    response = requests.Response()
+    response.status_code = status
+    response.headers = requests.structures.CaseInsensitiveDict(headers)
+    response._content = body
+    response.url = url
+    return response
+
+
+def _error_message(body, status):
+    try:
+        return ",".join(json.loads(body)['errors'])
+    except (ValueError, KeyError, TypeError):
+        return f"{status}: {body[:200].decode(errors='replace')}"
@@ -1,102 +1,317 @@
+import html
+import logging
 import re
 import requests
-from markdownify import markdownify as md
+from urllib.parse import unquote
+
+from logger_config import log_stage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'heic', 'heif', 'webp', 'avif', 'svg', 'bmp'}
+
+# Links to files attached to a Confluence page, such as PDFs, archives, logs and spreadsheets,
+# with the content of the link
+ATTACHMENT_LINK_PATTERN = re.compile(r'<a\s[^>]*?href="([^"]*/download/attachments/[^"]*)"[^>]*>(.*?)</a>', re.DOTALL)
+
+# Seconds an attachment request waits for Confluence without a fetcher that sets the timeout
+REQUEST_TIMEOUT = 30
 
 class AttachmentProcessor:
-    def __init__(self, confluence_url, confluence_auth, discourse_client, dry_run=True):
+    def __init__(self, confluence_url, confluence_auth, discourse_client, dry_run=True, retry_queue=None, image_optimizer=None,
+                 questions_fetcher=None):
         self.confluence_url = confluence_url
         self.confluence_auth = confluence_auth
         self.discourse_client = discourse_client
         self.dry_run = dry_run
+        self.retry_queue = retry_queue
+        self.image_optimizer = image_optimizer
+        # Attachments are requested within the concurrency limit and circuit breaker of the fetcher
+        self.questions_fetcher = questions_fetcher
 
     def process_attachments(self, body, content_id):
-        """Process all image attachments in the content body.
+        """Process all images and attached files in the content body.
         
         Args:
-            body (str): The HTML content containing image tags
+            body (str): The HTML content containing image tags and attachment links
             content_id (str): Unique identifier for the content
             
         Returns:
-            str: Processed content with updated image references
+            str: Processed content with updated image and file references
         """
-        img_tags = re.findall(r'<img.*?>', body)
         message = ""
         missing_file_sep = ""
         
-        for img_tag in img_tags:
+        images = self._find_images(body)
+        links = self._find_attachment_links(body, images)
+
+        # With an optimizer, every image is downloaded and handed to the worker pool
+        # before the first upload, so they are optimized in parallel
+        prepared = {}
+        if self.image_optimizer and not self.dry_run:
+            prepared = self._prepare_attachments(content_id, images)
+
+        for img_tag, src_match in images + links:
+            body, message, missing_file_sep = self._process_single_attachment(
+                body, content_id, img_tag, src_match, message, missing_file_sep, prepared
+            )
+        
+        return self._format_final_content(body, message)
+
+    def find_attachment_urls(self, body):
+        """List the full URLs of the images and attached files in a content body.
+        
+        Args:
+            body (str): The HTML content containing image tags and attachment links
+            
+        Returns:
+            list: The URLs, images first, in the order they appear
+        """
+        images = self._find_images(body)
+        return [self._get_full_url(src_match.group(1))
+                for _, src_match in images + self._find_attachment_links(body, images)]
+
+    def _find_images(self, body):
+        """Find the image tags of a body, once per source.
+
+        Returns:
+            list: (img_tag, src_match) pairs
+        """
+        images = []
+        sources = set()
+        for img_tag in re.findall(r'<img.*?>', body):
             src_match = re.search(r'src="(.*?)"', img_tag)
             if not src_match:
-                print(f"Warning: Couldn't find src attribute in img tag: {img_tag}")
+                logger.warning("Couldn't find src attribute in img tag: %s", img_tag)
                 continue
+            if src_match.group(1) not in sources:
+                sources.add(src_match.group(1))
+                images.append((img_tag, src_match))
+        return images
+
+    def _find_attachment_links(self, body, images=()):
+        """Find the links to attached files of a body, once per file.
+
+        Args:
+            body (str): The HTML content
+            images (list): (img_tag, src_match) pairs of the body; a file that is also
+                           shown as an image is uploaded with the image only
+
+        Returns:
+            list: (link_element, href_match) pairs
+        """
+        links = []
+        sources = {src_match.group(1) for _, src_match in images}
+        for href_match in ATTACHMENT_LINK_PATTERN.finditer(body):
+            if href_match.group(1) not in sources:
+                sources.add(href_match.group(1))
+                links.append((href_match.group(0), re.search(r'href="(.*?)"', href_match.group(0))))
+        return links
+
+    def attachment_size(self, url):
+        """Get the size of an attachment without downloading it.
+        
+        Args:
+            url (str): The full URL of the attachment
             
-            body, message, missing_file_sep = self._process_single_attachment(
-                body, content_id, img_tag, src_match, message, missing_file_sep
-            )
+        Returns:
+            int: The Content-Length reported by Confluence, or 0 if unknown
+        """
+        try:
+            response = self._request('HEAD', url)
+            response.raise_for_status()
+            return int(response.headers.get('Content-Length', 0))
+        except (requests.exceptions.RequestException, ValueError):
+            return 0
+
+    def _request(self, method, url):
+        """Request an attachment from Confluence, within the load limits of the fetcher if there is one.
+
+        Returns:
+            requests.Response: The response, with its body read
+        """
+        if self.questions_fetcher is None:
+            return requests.request(method, url, auth=self.confluence_auth, timeout=REQUEST_TIMEOUT)
+        # Only the time to the headers counts as latency, so large attachments do not cut the limit
+        response = self.questions_fetcher.request(method, url, stream=method == 'GET')
+        response.content  # Reads the body, which releases the connection
+        return response
+
+    def _attachment_filename(self, content_id, img_src):
+        return f"attachment_{content_id}_{unquote(img_src.split('/')[-1].split('?')[0])}"
+
+    def _prepare_attachments(self, content_id, images):
+        """Download the images of a body and start optimizing them.
         
-        return self._format_final_content(body, message)
+        Args:
+            content_id (str): Unique identifier for the content
+            images (list): (img_tag, src_match) pairs
+            
+        Returns:
+            dict: Per image source, a future of the optimized (filename, content)
+                  or the exception that made the download fail
+        """
+        prepared = {}
+        for _, src_match in images:
+            img_src = src_match.group(1)
+            if img_src in prepared:
+                continue
+            try:
+                response = self._request('GET', self._get_full_url(img_src))
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                prepared[img_src] = e
+                continue
+            prepared[img_src] = self.image_optimizer.submit(self._attachment_filename(content_id, img_src), response.content)
+        return prepared
 
-    def _process_single_attachment(self, body, content_id, img_tag, src_match, message, missing_file_sep):
-        """Process a single image attachment.
+    def _process_single_attachment(self, body, content_id, img_tag, src_match, message, missing_file_sep, prepared=None):
+        """Process a single image or attached file.
         
         Args:
             body (str): The content body
             content_id (str): Unique identifier for the content
-            img_tag (str): The complete image HTML tag
-            src_match (re.Match): Regex match object containing the src attribute
+            img_tag (str): The complete image HTML tag, or the complete element of an attachment link
+            src_match (re.Match): Regex match object containing the src or href attribute
             message (str): Current message accumulator for missing files
             missing_file_sep (str): Separator for missing file messages
+            prepared (dict, optional): Downloaded and optimized images by source
             
         Returns:
             tuple: (updated_body, updated_message, updated_separator)
         """
         img_src = src_match.group(1)
-        filename = f"attachment_{content_id}_{img_src.split('/')[-1].split('?')[0]}"
+        filename = self._attachment_filename(content_id, img_src)
         full_url = self._get_full_url(img_src)
         
         if self.dry_run:
-            print(f"Would download and upload attachment: {filename} from {full_url}")
+            logger.info("Would download and upload attachment: %s from %s", filename, full_url)
             return body, message, missing_file_sep
 
-        return self._handle_attachment_upload(body, img_tag, img_src, filename, full_url, message, missing_file_sep)
+        return self._handle_attachment_upload(body, content_id, img_tag, img_src, filename, full_url, message, missing_file_sep,
+                                              (prepared or {}).get(img_src))
 
     def _get_full_url(self, img_src):
+        # Sources are taken from HTML, where the & of a query string is escaped
+        img_src = html.unescape(img_src)
         return img_src if img_src.startswith(('http://', 'https://')) else f"{self.confluence_url}{img_src}"
 
-    def _handle_attachment_upload(self, body, img_tag, img_src, filename, full_url, message, missing_file_sep):
+    def _handle_attachment_upload(self, body, content_id, img_tag, img_src, filename, full_url, message, missing_file_sep, prepared=None):
         """Handle the upload of an attachment to Discourse.
         
         Args:
             body (str): The content body
-            img_tag (str): The complete image HTML tag
+            content_id (str): Unique identifier for the content
+            img_tag (str): The complete image HTML tag, or the complete element of an attachment link
             img_src (str): The source URL of the image
             filename (str): The target filename
             full_url (str): The complete URL to download from
             message (str): Current message accumulator
             missing_file_sep (str): Separator for missing file messages
+            prepared (Future or Exception, optional): The image as prepared by _prepare_attachments
             
         Returns:
             tuple: (updated_body, updated_message, updated_separator)
         """
+        upload_name = filename
         try:
-            response = requests.get(full_url, auth=self.confluence_auth)
-            response.raise_for_status()
-            
-            upload, missing_file = self.discourse_client.upload_file(filename, response.content)
-
-            if upload and 'url' in upload:
-                body = body.replace(img_src, upload['url'])
-                print(f"Uploaded attachment: {filename}")
+            if isinstance(prepared, Exception):
+                raise prepared
+            if prepared is not None:
+                upload_name, content = prepared.result()
             else:
-                body = body.replace(img_tag, '')
-                message += missing_file_sep + missing_file
-                missing_file_sep = "\n\n"
-                print(f"Couldn't upload attachment: {filename}")
+                response = self._request('GET', full_url)
+                response.raise_for_status()
+                content = response.content
         except requests.exceptions.RequestException as e:
-            body = body.replace(img_tag, '')
-            message += f"\n\n[Failed to download attachment: {filename}. Error: {str(e)}]"
-            print(f"Failed to download attachment: {filename}. Error: {str(e)}")
+            body = self._remove_attachment(body, img_tag)
+            placeholder = f"[Failed to download attachment: {filename}. Error: {str(e)}]"
+            message += f"\n\n{placeholder}"
+            logger.error("Failed to download attachment: %s. Error: %s", filename, e)
+            self._queue_failed_upload(content_id, filename, full_url, placeholder, e)
+            return body, message, missing_file_sep
+
+        try:
+            with log_stage('upload'):
+                upload, missing_file = self.discourse_client.upload_file(upload_name, content)
+        except requests.exceptions.RequestException as e:
+            upload = None
+            placeholder = f"[Error uploading file '{filename}': {str(e)}]"
+            missing_file = f"\n\n{placeholder}"
+            self._queue_failed_upload(content_id, filename, full_url, placeholder, e)
+
+        if upload and 'url' in upload:
+            body = body.replace(img_src, upload['url'])
+            logger.info("Uploaded attachment: %s", filename)
+        else:
+            body = self._remove_attachment(body, img_tag)
+            message += missing_file_sep + missing_file
+            missing_file_sep = "\n\n"
+            logger.warning("Couldn't upload attachment: %s", filename)
             
         return body, message, missing_file_sep
 
+    def _remove_attachment(self, body, img_tag):
+        # A link to a missing file is reduced to its content, an image is dropped
+        link_match = ATTACHMENT_LINK_PATTERN.fullmatch(img_tag)
+        if not link_match:
+            return body.replace(img_tag, '')
+        # The link is found again, as the images it contains may have been uploaded since
+        href = link_match.group(1)
+        return ATTACHMENT_LINK_PATTERN.sub(lambda match: match.group(2) if match.group(1) == href else match.group(0),
+                                           body)
+
+    def _queue_failed_upload(self, content_id, filename, full_url, placeholder, error):
+        """Record a failed attachment in the retry queue.
+        
+        The placeholder text left in the post is stored with it, so that a retry can
+        swap it for the uploaded image once the post exists.
+        """
+        if self.retry_queue is None:
+            return
+        self.retry_queue.record('upload', f"upload:{content_id}:{filename}", {
+            'content_id': content_id,
+            'filename': filename,
+            'url': full_url,
+            'placeholder': placeholder,
+        }, error)
+
+    def retry_upload(self, entry):
+        """Retry a queued attachment and patch it into the post that lacks it.
+        
+        Args:
+            entry (dict): The retry queue entry
+            
+        Returns:
+            bool: True if the attachment is now in place or no longer needed
+            
+        Raises:
+            requests.exceptions.RequestException: If the download, upload or post edit fails
+        """
+        payload = entry['payload']
+        post_id = payload.get('post_id')
+        if post_id is None:
+            # The content never made it into a post; migrating it again re-processes the attachment
+            return True
+
+        response = self._request('GET', payload['url'])
+        response.raise_for_status()
+        filename, content = payload['filename'], response.content
+        if self.image_optimizer:
+            filename, content = self.image_optimizer.optimize(filename, content)
+        upload, _ = self.discourse_client.upload_file(filename, content)
+        if not upload or 'url' not in upload:
+            return False
+
+        raw = self.discourse_client.get_post_raw(post_id)
+        link = f"[{payload['filename']}]({upload['url']})"
+        if payload['filename'].lower().rsplit('.', 1)[-1] in IMAGE_EXTENSIONS:
+            link = f"!{link}"
+        self.discourse_client.update_post(post_id, raw.replace(payload['placeholder'], link))
+        logger.info("Uploaded attachment %s into post %s", payload['filename'], post_id)
+        return True
+
     def _format_final_content(self, body, message):
+        # markdownify is imported on first use to keep startup fast
+        from markdownify import markdownify as md
         return md(body) + "\n\n---\n\n" + message + "\n\n" 
\ No newline at end of file
@@ -0,0 +1,400 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from logger_config import add_stage_observer, remove_stage_observer
+from rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Settings a profile holds, applied by QuestionMigrator when it is created
+PROFILE_SETTINGS = ('confluence_max_concurrency', 'prefetch_workers', 'multipart_workers', 'writes_per_minute',
+                    'question_pause')
+
+# Worker ID of the migrator that calibrates, which gives it state files apart from those of the real run
+CALIBRATION_WORKER_ID = 'calibration'
+
+
+def load_profile(path):
+    """Load a tuned configuration profile.
+
+    Returns:
+        dict: The profile, or an empty dict when the file does not exist
+    """
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_profile(path, profile):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(temp_file, path)
+
+
+class _RateLimitCounter(logging.Handler):
+    """Counts the rate limited responses the Discourse clients log while waiting them out."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.count = 0
+
+    def emit(self, record):
+        if 'rate limited' in record.getMessage().lower():
+            self.count += 1
+
+
+class Autotuner:
+    """Tunes the worker counts and rate budgets of a migration to the load of the day.
+
+    calibrate() measures a sample of questions: how the fetch throughput of
+    Confluence grows with concurrency until it saturates, how long converting a
+    question takes, and, unless the migrator is in a dry run, how fast the sample
+    can be written to the Discourse forum (meant for a staging forum). The tuned
+    settings are written to a profile that QuestionMigrator applies. A migrator
+    created with CALIBRATION_WORKER_ID keeps the state of the sample in files of
+    its own, which are removed once the calibration is done.
+
+    The profile only holds a write budget that was measured or configured: a
+    calibration in a dry run and a run without a budget that never had to adjust
+    it leave it out, so applying the profile does not throttle an unlimited run.
+
+    While a migration runs, start() adjusts the settings every interval from what
+    the last interval measured: the Discourse write budget grows while workers
+    wait on it and shrinks when Discourse rate limits, the ceiling of the
+    Confluence concurrency follows its latency, and uploads get more parallel parts
+    while they take most of the time.
+    """
+
+    def __init__(self, migrator, profile_file='target/tuned_profile.json', interval=60, max_writes_per_minute=600):
+        """Initialize the autotuner.
+
+        Args:
+            migrator (QuestionMigrator): The migrator to measure and tune
+            profile_file (str): Where the tuned profile is written
+            interval (float): Seconds between two adjustments during a run
+            max_writes_per_minute (float): Highest Discourse write budget the tuner tries
+        """
+        self.migrator = migrator
+        self.profile_file = profile_file
+        self.interval = interval
+        self.max_writes_per_minute = max_writes_per_minute
+        self.measurements = load_profile(profile_file).get('measurements', {})
+        self.stage_seconds = {}
+        self.stage_lock = threading.Lock()
+        self.rate_limits = _RateLimitCounter()
+        self.bottleneck = None
+        self.previous = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        fetcher = migrator.questions_fetcher
+        self.fetch_ceiling = max(fetcher.concurrency_limiter.max_limit * 2, 2)
+        # Whether the write budget was configured, or since measured or adjusted, and so belongs in the profile
+        self.write_budget_known = migrator.discourse_client.rate_limiter is not None
+        self._ensure_write_limiters()
+
+    def _ensure_write_limiters(self):
+        """Give every path that writes to Discourse a budget the tuner can adjust.
+
+        Without a configured budget it starts at the highest budget the tuner tries,
+        and only comes down when Discourse rate limits.
+        """
+        client = self.migrator.discourse_client
+        rate = self.migrator.cost_model.writes_per_minute if self.write_budget_known else self.max_writes_per_minute
+        if client.rate_limiter is None:
+            client.rate_limiter = RateLimiter(rate)
+            if client.publisher:
+                client.publisher.rate_limiter = client.rate_limiter
+        if client.credential_pool:
+            for credential in client.credential_pool.credentials:
+                if credential.rate_limiter is None:
+                    credential.rate_limiter = RateLimiter(rate)
+
+    def write_limiters(self):
+        client = self.migrator.discourse_client
+        limiters = [client.rate_limiter]
+        if client.credential_pool:
+            limiters += [credential.rate_limiter for credential in client.credential_pool.credentials]
+        return [limiter for limiter in limiters if limiter is not None]
+
+    def settings(self):
+        """The current values of the tuned settings."""
+        client = self.migrator.discourse_client
+        settings = {
+            'confluence_max_concurrency': self.migrator.questions_fetcher.concurrency_limiter.max_limit,
+            'prefetch_workers': self.migrator.prefetch_workers,
+            'multipart_workers': client.multipart_uploader.workers,
+            'question_pause': self.migrator.question_pause,
+        }
+        if self.write_budget_known:
+            settings['writes_per_minute'] = round(client.rate_limiter.calls_per_minute, 1)
+        return settings
+
+    def save(self, settings=None):
+        """Write the profile with the given settings, or the current ones."""
+        profile = {**(settings or self.settings()), 'measurements': self.measurements,
+                   'updated_at': datetime.now(timezone.utc).isoformat()}
+        save_profile(self.profile_file, profile)
+        logger.info("Wrote the tuned profile to %s: %s", self.profile_file,
+                    {key: profile[key] for key in PROFILE_SETTINGS if key in profile})
+        return profile
+
+    def calibrate(self, space_key=None, sample_size=20):
+        """Measure a sample of questions and write the tuned profile.
+
+        Args:
+            space_key (str, optional): The Confluence space to take the sample from
+            sample_size (int): Number of questions measured
+
+        Returns:
+            dict: The tuned profile
+        """
+        try:
+            return self._calibrate(space_key, sample_size)
+        finally:
+            self._remove_calibration_state()
+
+    def _calibrate(self, space_key, sample_size):
+        fetcher = self.migrator.questions_fetcher
+        sample = list(fetcher.iter_questions(space_key, limit=sample_size, start=0))
+        if not sample:
+            raise ValueError("No questions to calibrate with")
+        logger.info("Calibrating on %d questions", len(sample))
+
+        settings = self.settings()
+        # A budget that was only configured is not what the forum sustains
+        settings.pop('writes_per_minute', None)
+        concurrency, sweep, details = self._calibrate_fetching(sample)
+        settings['confluence_max_concurrency'] = concurrency
+        settings['prefetch_workers'] = concurrency
+        conversion = self._calibrate_conversion(sample, details)
+        self.measurements = {
+            'sample_size': len(sample),
+            'fetch_sweep': sweep,
+            'conversion_seconds': round(conversion, 4),
+        }
+
+        # The hard-coded pause between questions only stood in for a write budget
+        settings['question_pause'] = 0
+        if self.migrator.dry_run:
+            logger.info("Dry run: the write budget is not measured and left out of the profile")
+        else:
+            settings['writes_per_minute'] = self._calibrate_writes(sample, concurrency)
+
+        self.measurements['calibrated_at'] = datetime.now(timezone.utc).isoformat()
+        return self.save(settings)
+
+    def _remove_calibration_state(self):
+        """Remove the state files a calibrating migrator kept the sample in."""
+        if self.migrator.worker_id != CALIBRATION_WORKER_ID:
+            return
+        for path in self.migrator.state_files():
+            for candidate in (path, f"{path}.tmp"):
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+        logger.info("Removed the state of the calibration sample")
+
+    def _calibrate_fetching(self, sample):
+        """Fetch the sample at rising concurrency and find where the throughput saturates."""
+        fetcher = self.migrator.questions_fetcher
+        limiter = fetcher.concurrency_limiter
+        original = (limiter.max_limit, limiter.limit)
+        sweep = {}
+        details = {}
+        level = 1
+        try:
+            while level <= self.fetch_ceiling:
+                limiter.max_limit = level
+                limiter.limit = float(level)
+                latencies = []
+
+                def fetch(question):
+                    started = time.monotonic()
+                    question_details = fetcher.get_question_details(question['id'])
+                    fetcher.get_all_answers(question['id'])
+                    latencies.append(time.monotonic() - started)
+                    return question['id'], question_details
+
+                started = time.monotonic()
+                with ThreadPoolExecutor(max_workers=level, thread_name_prefix='calibrate') as executor:
+                    details.update(executor.map(fetch, sample))
+                elapsed = time.monotonic() - started
+                latencies.sort()
+                sweep[level] = {
+                    'questions_per_second': round(len(sample) / elapsed, 3),
+                    'p95_seconds': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                }
+                logger.info("Fetching at concurrency %d: %.2f questions/s, p95 %.2fs", level,
+                            sweep[level]['questions_per_second'], sweep[level]['p95_seconds'])
+                level *= 2
+        finally:
+            limiter.max_limit, limiter.limit = original
+
+        # The saturation point: the lowest concurrency within 90% of the best throughput that meets the SLO,
+        # with a question taking at least two requests
+        best = max(result['questions_per_second'] for result in sweep.values())
+        within_slo = [level for level, result in sweep.items()
+                      if result['p95_seconds'] <= limiter.latency_slo * 2 and result['questions_per_second'] >= best * 0.9]
+        concurrency = min(within_slo) if within_slo else 1
+        logger.info("Confluence saturates at a concurrency of %d", concurrency)
+        return concurrency, sweep, details
+
+    def _calibrate_conversion(self, sample, details):
+        """Time converting the sample to Markdown, without its attachments."""
+        formatter = self.migrator.content_formatter
+        started = time.monotonic()
+        for question in sample:
+            question_details = details[question['id']]
+            body = formatter.convert_emojis(self.migrator._content_body(question_details))
+            formatter.format_question_content(question, question_details, body)
+        conversion = (time.monotonic() - started) / len(sample)
+        logger.info("Converting a question takes %.3fs", conversion)
+        return conversion
+
+    def _calibrate_writes(self, sample, workers):
+        """Migrate the sample into the forum under a generous budget and measure the write rate it sustained."""
+        limiters = self.write_limiters()
+        rates = [limiter.calls_per_minute for limiter in limiters]
+        for limiter in limiters:
+            limiter.set_rate(self.max_writes_per_minute)
+        calls = sum(limiter.calls for limiter in limiters)
+        rate_limited = self._rate_limited_count()
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='calibrate') as executor:
+                list(executor.map(self.migrator.migrate_question, sample))
+        finally:
+            for limiter, rate in zip(limiters, rates):
+                limiter.set_rate(rate)
+        elapsed_minutes = (time.monotonic() - started) / 60
+        writes = sum(limiter.calls for limiter in limiters) - calls
+        throttled = self._rate_limited_count() - rate_limited
+
+        sustained = writes / max(elapsed_minutes, 1 / 60)
+        # Rate limited: the budget is below what was sent. Otherwise it is at least that, or the configured
+        # budget, and tuned up during the run
+        floor = rates[0] if self.write_budget_known else sustained
+        writes_per_minute = round(max(10.0, sustained * 0.8 if throttled else max(sustained, floor)), 1)
+        self.write_budget_known = True
+        self.measurements['writes'] = {'count': writes, 'per_minute': round(sustained, 1), 'rate_limited': throttled}
+        logger.info("Sustained %.1f writes per minute with %d rate limited responses", sustained, throttled)
+        return writes_per_minute
+
+    def start(self):
+        """Adjust the settings every interval until stop() is called."""
+        if self.thread is not None:
+            return
+        add_stage_observer(self._observe_stage)
+        for name in ('pydiscourse.client', 'async_publisher'):
+            logging.getLogger(name).addHandler(self.rate_limits)
+        self.previous = self._snapshot()
+
+        def run():
+            while not self.stop_event.wait(self.interval):
+                try:
+                    self.adjust()
+                except Exception as e:
+                    logger.error("Autotuning failed: %s", e)
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=run, name='autotune', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop adjusting and save the settings the run ended with."""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        remove_stage_observer(self._observe_stage)
+        for name in ('pydiscourse.client', 'async_publisher'):
+            logging.getLogger(name).removeHandler(self.rate_limits)
+        self.save()
+
+    def _observe_stage(self, stage, seconds):
+        with self.stage_lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def _rate_limited_count(self):
+        count = self.rate_limits.count
+        pool = self.migrator.discourse_client.credential_pool
+        if pool:
+            count += sum(credential.throttles for credential in pool.credentials)
+        return count
+
+    def _snapshot(self):
+        fetcher = self.migrator.questions_fetcher
+        limiters = self.write_limiters()
+        with fetcher.stats_lock:
+            requests_made, request_seconds = fetcher.request_count, fetcher.request_seconds
+        with self.stage_lock:
+            stages = dict(self.stage_seconds)
+        return {
+            'time': time.monotonic(),
+            'requests': requests_made,
+            'request_seconds': request_seconds,
+            'write_wait': sum(limiter.waited for limiter in limiters),
+            'rate_limited': self._rate_limited_count(),
+            'stages': stages,
+        }
+
+    def adjust(self):
+        """Measure the last interval, find its bottleneck and adjust the settings to it.
+
+        Returns:
+            str: The bottleneck of the interval
+        """
+        current = self._snapshot()
+        previous, self.previous = self.previous, current
+        elapsed = max(current['time'] - previous['time'], 1e-6)
+        requests_made = current['requests'] - previous['requests']
+        fetch_latency = (current['request_seconds'] - previous['request_seconds']) / requests_made if requests_made else 0.0
+        write_wait = (current['write_wait'] - previous['write_wait']) / elapsed
+        rate_limited = current['rate_limited'] - previous['rate_limited']
+        stages = {stage: seconds - previous['stages'].get(stage, 0.0) for stage, seconds in current['stages'].items()}
+        upload_share = stages.get('upload', 0.0) / (sum(stages.values()) or 1)
+
+        fetcher = self.migrator.questions_fetcher
+        limiter = fetcher.concurrency_limiter
+        uploader = self.migrator.discourse_client.multipart_uploader
+        limiters = self.write_limiters()
+
+        if rate_limited:
+            bottleneck = 'discourse rate limits'
+            self._scale_writes(limiters, 0.75)
+        elif fetch_latency > limiter.latency_slo:
+            bottleneck = 'confluence'
+            limiter.max_limit = max(limiter.min_limit, limiter.max_limit - 1)
+        elif write_wait > 0.5:
+            # Workers spent more than half of the interval waiting for the write budget
+            bottleneck = 'discourse write budget'
+            self._scale_writes(limiters, 1.1)
+        elif upload_share > 0.5:
+            bottleneck = 'uploads'
+            uploader.workers = min(16, uploader.workers + 1)
+        else:
+            bottleneck = 'processing'
+            if fetch_latency < limiter.latency_slo / 2 and int(limiter.limit) >= limiter.max_limit:
+                limiter.max_limit = min(self.fetch_ceiling, limiter.max_limit + 1)
+
+        if bottleneck != self.bottleneck:
+            logger.info("Bottleneck moved from %s to %s", self.bottleneck or 'nothing', bottleneck)
+            self.bottleneck = bottleneck
+        logger.debug("Autotune: fetch latency %.2fs, write wait %.2f, %d rate limited, upload share %.2f: %s",
+                     fetch_latency, write_wait, rate_limited, upload_share, self.settings())
+        return bottleneck
+
+    def _scale_writes(self, limiters, factor):
+        self.write_budget_known = True
+        for limiter in limiters:
+            limiter.set_rate(min(self.max_writes_per_minute, max(10.0, limiter.calls_per_minute * factor)))
+        logger.info("Discourse write budget set to %.1f writes per minute", limiters[0].calls_per_minute)
@@ -0,0 +1,119 @@
+"""Benchmarks of the hot paths of a migration, run with pytest.
+
+    python -m pytest benchmarks                        # compare with baseline.json
+    python -m pytest benchmarks -k attachments         # only the attachment benchmarks
+    python -m pytest benchmarks --bench-save-baseline  # accept the current timings
+
+The fastest round of every benchmark is divided by the fastest round of a fixed reference
+workload timed right before it, so the baseline records how many times slower than
+the reference a hot path is. That ratio carries over between machines, where seconds do
+not, and fastest rounds are the least disturbed by whatever else the machine is doing.
+"""
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('bench', 'migration benchmarks')
+    group.addoption('--bench-save-baseline', action='store_true',
+                    help=f'Store the results in {os.path.basename(BASELINE_FILE)}')
+    group.addoption('--bench-tolerance', type=float, default=1.0,
+                    help='Allowed slowdown relative to the baseline before a benchmark fails (default: 1.0, '
+                         'twice as slow)')
+
+
+def measure(func, min_rounds=3, max_rounds=50, min_time=0.5):
+    """Time a callable over several rounds after one warm-up call.
+
+    Returns:
+        dict: Timing statistics in seconds
+    """
+    func()
+    times = []
+    started = time.perf_counter()
+    while len(times) < min_rounds or (len(times) < max_rounds and time.perf_counter() - started < min_time):
+        round_started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - round_started)
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'rounds': len(times),
+    }
+
+
+def _reference_workload():
+    # Parsing, matching and sorting, like the hot paths, but independent of the code they measure
+    rng = random.Random('reference')
+    records = [{'id': index, 'title': f"Question {rng.random()}", 'tags': ['search', 'index']} for index in range(2000)]
+    text = json.dumps(records)
+    json.loads(text)
+    sorted(text.split())
+    text.replace('Question', 'Topic').count('0.')
+
+
+@pytest.fixture(scope='session')
+def baseline(request):
+    """Relative timings of the baseline, and the results of this session when they are saved."""
+    saved = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as f:
+            saved = json.load(f)
+    results = {}
+    yield saved, results
+    if request.config.getoption('--bench-save-baseline') and results:
+        saved.update(results)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+@pytest.fixture(autouse=True, scope='session')
+def _quiet_logging():
+    # The processors log every attachment; that output is not what is measured
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def rng(request):
+    """A source of randomness seeded by the benchmark name, for repeatable inputs."""
+    return random.Random(request.node.name)
+
+
+@pytest.fixture
+def benchmark(request, baseline):
+    """Time a callable and fail when it got slower, relative to the reference, than the baseline allows."""
+    saved, results = baseline
+    name = request.node.name
+    tolerance = request.config.getoption('--bench-tolerance')
+
+    def run(func):
+        # The reference is timed next to the benchmark, so both see the same load on the machine
+        reference = measure(_reference_workload)['min']
+        result = measure(func)
+        relative = result['min'] / reference
+        results[name] = {'relative': relative}
+        print(f"{name}: median {result['median'] * 1000:.3f} ms, {relative:.3g}x the reference "
+              f"({result['rounds']} rounds)")
+        if request.config.getoption('--bench-save-baseline') or name not in saved:
+            return result
+        expected = saved[name]['relative']
+        if relative > expected * (1 + tolerance):
+            pytest.fail(f"{name} took {relative:.3g}x the reference, the baseline is {expected:.3g}x "
+                        f"({(relative / expected - 1) * 100:+.0f}%)")
+        return result
+    return run
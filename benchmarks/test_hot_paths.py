@@ -0,0 +1,174 @@
+"""Benchmarks of content conversion, attachment processing, user registration and migration state.
+
+The modules under test are imported by the benchmarks that use them, so collecting the
+suite neither loads the environment nor configures logging the way importing
+QuestionMigrator does.
+"""
+import os
+import shutil
+import threading
+from unittest import mock
+
+import pytest
+
+WORDS = ('query index server cluster plugin dashboard search result field timeout token config '
+         'deploy upgrade license forwarder indexer latency alert report macro page space').split()
+EMOJIS = (':slight_smile:', ':thumbsup:', ':warning:', ':white_check_mark:', ':bulb:')
+CONFLUENCE_URL = 'https://oldcommunity.example.com'
+
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def generate_confluence_html(rng, paragraphs=8, images=2, tables=1, code_blocks=1, emojis=3, user_links=2,
+                             question_links=2):
+    """Generate a question or answer body the way Confluence renders it.
+
+    Args:
+        rng (random.Random): Source of randomness, seeded for repeatable inputs
+        paragraphs (int): Paragraphs of text
+        images (int): Embedded attachment images
+        tables (int): Confluence tables
+        code_blocks (int): Code macros
+        emojis (int): Emoticon images
+        user_links (int): Links to user profiles
+        question_links (int): Links to other questions
+
+    Returns:
+        str: The HTML body
+    """
+    parts = []
+    for index in range(paragraphs):
+        text = _sentence(rng)
+        if index < user_links:
+            name = rng.choice(WORDS)
+            text += f' Thanks <a href="/display/~{name}{index}" class="confluence-userlink user-mention">{name.title()}</a>!'
+        if index < question_links:
+            text += f' See <a href="/questions/{rng.randint(1000, 99999)}/{rng.choice(WORDS)}-{rng.choice(WORDS)}">this question</a>.'
+        if index < emojis:
+            short_name = rng.choice(EMOJIS)
+            text += (f' <img class="emoticon emoticon-smile" data-emoji-short-name="{short_name}" '
+                     f'src="/images/icons/emoticons/smile.svg" alt="(smile)"/>')
+        parts.append(f"<p>{text}</p>")
+
+    for _ in range(tables):
+        rows = ''.join(
+            '<tr>' + ''.join(f'<td class="confluenceTd">{rng.choice(WORDS)} {rng.randint(0, 999)}</td>' for _ in range(4)) + '</tr>'
+            for _ in range(6)
+        )
+        header = '<tr>' + ''.join(f'<th class="confluenceTh">{word.title()}</th>' for word in rng.sample(WORDS, 4)) + '</tr>'
+        parts.append(f'<div class="table-wrap"><table class="confluenceTable"><tbody>{header}{rows}</tbody></table></div>')
+
+    for _ in range(code_blocks):
+        lines = '\n'.join(f'{rng.choice(WORDS)} = "{rng.choice(WORDS)}" | stats count by {rng.choice(WORDS)}'
+                          for _ in range(8))
+        parts.append('<div class="code panel pdl"><div class="codeContent panelContent pdl">'
+                     f'<pre class="syntaxhighlighter-pre" data-syntaxhighlighter-params="brush: sql; gutter: false">{lines}</pre>'
+                     '</div></div>')
+
+    for index in range(images):
+        parts.append(f'<p><span class="confluence-embedded-file-wrapper"><img class="confluence-embedded-image" '
+                     f'src="/download/attachments/{rng.randint(10000, 99999)}/screenshot{index}.png?version=1&amp;api=v2" '
+                     f'data-image-src="/download/attachments/screenshot{index}.png"></span></p>')
+
+    rng.shuffle(parts)
+    return '\n'.join(parts)
+
+
+def generate_comments(rng, count):
+    return [{
+        'author': {'name': f'user{index}', 'fullName': f'User {index}'},
+        'dateCommented': 1600000000000 + index * 60000,
+        'body': {'content': generate_confluence_html(rng, paragraphs=2, images=0, tables=0, code_blocks=0)},
+    } for index in range(count)]
+
+
+@pytest.fixture
+def formatter():
+    from content_formatter import ContentFormatter
+    return ContentFormatter(CONFLUENCE_URL)
+
+
+def test_html_to_markdown(benchmark, rng, formatter):
+    body = formatter.convert_emojis(generate_confluence_html(rng, paragraphs=30, tables=2, code_blocks=2))
+    benchmark(lambda: formatter.html_to_markdown(body))
+
+
+def test_process_links(benchmark, rng, formatter):
+    markdown = formatter.html_to_markdown(generate_confluence_html(rng, paragraphs=30, user_links=10, question_links=20))
+    benchmark(lambda: formatter.process_links(markdown))
+
+
+def test_convert_emojis(benchmark, rng, formatter):
+    body = generate_confluence_html(rng, paragraphs=50, emojis=50)
+    benchmark(lambda: formatter.convert_emojis(body))
+
+
+def test_format_comments(benchmark, rng, formatter):
+    comments = generate_comments(rng, 20)
+    benchmark(lambda: formatter.format_comments(comments))
+
+
+class _StubDiscourseClient:
+    def upload_file(self, filename, content):
+        return {'url': f"/uploads/default/original/1X/{filename}"}, None
+
+
+class _StubResponse:
+    content = b'\x89PNG\r\n\x1a\n' + b'\0' * 2048
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.mark.parametrize('images', [0, 10, 100])
+def test_process_attachments(benchmark, rng, images):
+    from attachment_processor import AttachmentProcessor
+    processor = AttachmentProcessor(CONFLUENCE_URL, ('user', 'password'), _StubDiscourseClient(), dry_run=False)
+    body = generate_confluence_html(rng, paragraphs=max(8, images), images=images, emojis=0)
+
+    # Downloads are served locally, so only the processing is measured
+    with mock.patch('attachment_processor.requests.request', return_value=_StubResponse()):
+        benchmark(lambda: processor.process_attachments(body, '12345'))
+
+
+def test_register_users_at_10k(benchmark, rng, tmp_path):
+    from UserRegistry import UserRegistry
+    seed_file = str(tmp_path / 'seed.csv')
+    seed = UserRegistry(seed_file)
+    seed._registry = {f'User {index}': f'user{index}@example.com' for index in range(10000)}
+    seed.emails = {username: username for username in seed._registry.values()}
+    seed.save_registry()
+    # Authors of a question: a few new ones among many that are registered already
+    known = [{'name': f'user{index}@example.com', 'fullName': f'User {index}'} for index in rng.sample(range(10000), 80)]
+    new = [{'name': f'new{index}@example.com', 'fullName': f'New {index}'} for index in range(20)]
+    registry_file = str(tmp_path / 'user_registry.csv')
+
+    def run():
+        shutil.copyfile(seed_file, registry_file)
+        registry = UserRegistry(registry_file)
+        for user in known + new:
+            registry.register_user(user)
+    benchmark(run)
+
+
+@pytest.fixture
+def migrator(tmp_path):
+    """A migrator with 100k migrated questions and nothing else set up."""
+    from QuestionMigrator import QuestionMigrator
+    migrator = QuestionMigrator.__new__(QuestionMigrator)
+    migrator.migrated_questions_file = os.path.join(str(tmp_path), 'migrated_questions.json')
+    migrator._migrated_questions = list(range(100000))
+    migrator.state_lock = threading.RLock()
+    return migrator
+
+
+def test_is_migrated_100k(benchmark, rng, migrator):
+    # Half of the lookups miss, like a run that is halfway through
+    question_ids = [rng.randint(0, 200000) for _ in range(100)]
+    benchmark(lambda: [migrator.is_migrated(question_id) for question_id in question_ids])
+
+
+def test_save_migrated_100k(benchmark, migrator):
+    benchmark(migrator.save_migrated_questions)
@@ -3,16 +3,18 @@ class CommentProcessor:
         self.questions_fetcher = questions_fetcher
         self.user_registry = user_registry
 
-    def process_question_comments(self, question_id):
+    def process_question_comments(self, question_id, question_details=None):
         """Process and register authors for all comments on a question.
         
         Args:
             question_id (str): ID of the question to process comments for
+            question_details (dict, optional): Already fetched question details
             
         Returns:
             dict: Question details including processed comments
         """
-        question_details = self.questions_fetcher.get_question_details(question_id)
+        if question_details is None:
+            question_details = self.questions_fetcher.get_question_details(question_id)
         self._register_comment_authors(question_details.get('comments', []))
         return question_details
 
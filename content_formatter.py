@@ -1,19 +1,22 @@
 import time
 import html
-from markdownify import markdownify as md
 import re
-import emoji  # You'll need to install this package: pip install emoji
 from quirks_handler import QuirksHandler
 
 class ContentFormatter:
-    def __init__(self, base_url='https://oldcommunity.example.com'):
+    def __init__(self, base_url='https://oldcommunity.example.com', link_index=None):
         self.base_url = base_url.rstrip('/')
         self.quirks_handler = QuirksHandler()
+        self.link_index = link_index
 
     def process_links(self, content):
         # First handle user profile links
         user_pattern = r'\[([^\]]+)\]\(/display/~[^\)]+\)'
         content = re.sub(user_pattern, r'\1', content)
+
+        # Links to migrated questions point to their Discourse topics
+        if self.link_index:
+            content = self.link_index.rewrite(content)
         
         # Then process regular markdown-style links
         pattern = r'\[([^\]]+)\]\((/[^)]+)\)'
@@ -22,6 +25,8 @@ class ContentFormatter:
         return content
 
     def html_to_markdown(self, html_content):
+        # markdownify is imported on first use to keep startup fast
+        from markdownify import markdownify as md
         unescaped_html = html.unescape(html_content)
         return md(unescaped_html, heading_style="ATX").strip()
 
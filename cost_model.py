@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CostModel:
+    """Predicts the API calls, bytes and wall-clock time of a migration from a dry run.
+
+    Every planned question adds the Discourse writes it needs, the Confluence reads
+    made to plan it, the size of its attachments and the size of its content. The
+    projection assumes the stages overlap, so the slowest stage sets the wall-clock
+    time; the serial total is reported as an upper bound.
+    """
+
+    def __init__(self, writes_per_minute=60, workers=1, upload_bytes_per_second=2_000_000,
+                 download_bytes_per_second=8_000_000):
+        """Initialize the cost model.
+
+        Args:
+            writes_per_minute (float): Discourse write budget of one worker
+            workers (int): Number of workers, each with its own write budget
+            upload_bytes_per_second (float): Upload bandwidth of one worker
+            download_bytes_per_second (float): Bandwidth of one download from Confluence
+        """
+        self.writes_per_minute = writes_per_minute
+        self.workers = workers
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.download_bytes_per_second = download_bytes_per_second
+        self.questions = []
+        self.lock = threading.Lock()
+
+    def add_question(self, question_id, title, posts, uploads, upload_bytes, solutions, tags, content_bytes):
+        """Record the plan of a single question.
+
+        Args:
+            question_id (str): The ID of the question
+            title (str): The title of the question
+            posts (int): Answer posts to create
+            uploads (int): Attachments to upload
+            upload_bytes (int): Total size of those attachments
+            solutions (int): Answers to mark as solution
+            tags (int): Tags set on the topic when it is created
+            content_bytes (int): Size of the rendered question and answers
+        """
+        with self.lock:
+            self.questions.append({
+                'id': question_id,
+                'title': title,
+                'writes': {
+                    'topic': 1,
+                    'posts': posts,
+                    'uploads': uploads,
+                    'solutions': solutions,
+                },
+                'tags': tags,
+                'upload_bytes': upload_bytes,
+                'content_bytes': content_bytes,
+            })
+
+    def report(self, confluence_requests=0, confluence_seconds=0.0, confluence_concurrency=1):
+        """Build the plan with totals and a wall-clock projection.
+
+        Args:
+            confluence_requests (int): Confluence requests made while planning
+            confluence_seconds (float): Total response time of those requests
+            confluence_concurrency (int): Concurrent Confluence requests in the real run
+
+        Returns:
+            dict: The plan
+        """
+        writes = {'topic': 0, 'posts': 0, 'uploads': 0, 'solutions': 0}
+        upload_bytes = 0
+        content_bytes = 0
+        for question in self.questions:
+            for kind, count in question['writes'].items():
+                writes[kind] += count
+            upload_bytes += question['upload_bytes']
+            content_bytes += question['content_bytes']
+        total_writes = sum(writes.values())
+
+        write_seconds = total_writes / (self.writes_per_minute * self.workers) * 60
+        upload_seconds = upload_bytes / (self.upload_bytes_per_second * self.workers)
+        # The attachments are downloaded from Confluence as well as uploaded
+        confluence_seconds_projected = (confluence_seconds / max(1, confluence_concurrency)
+                                        + upload_bytes / self.download_bytes_per_second / max(1, confluence_concurrency))
+        stages = {
+            'discourse_writes': write_seconds,
+            'uploads': upload_seconds,
+            'confluence_reads': confluence_seconds_projected,
+        }
+
+        return {
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'parameters': {
+                'writes_per_minute': self.writes_per_minute,
+                'workers': self.workers,
+                'upload_bytes_per_second': self.upload_bytes_per_second,
+                'download_bytes_per_second': self.download_bytes_per_second,
+                'confluence_concurrency': confluence_concurrency,
+            },
+            'totals': {
+                'questions': len(self.questions),
+                'writes': writes,
+                'total_writes': total_writes,
+                'upload_bytes': upload_bytes,
+                'content_bytes': content_bytes,
+                'confluence_requests': confluence_requests,
+                'average_confluence_latency': confluence_seconds / confluence_requests if confluence_requests else 0,
+            },
+            'projection': {
+                'stage_seconds': stages,
+                'bottleneck': max(stages, key=stages.get),
+                'wall_clock_seconds': max(stages.values()),
+                'serial_upper_bound_seconds': sum(stages.values()),
+            },
+            'questions': self.questions,
+        }
+
+    def write_report(self, report_file, **kwargs):
+        """Write the plan to a JSON file and log a summary.
+
+        Args:
+            report_file (str): Path of the JSON file
+            **kwargs: Passed on to report()
+
+        Returns:
+            dict: The plan
+        """
+        plan = self.report(**kwargs)
+        os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+        with open(report_file, 'w') as f:
+            json.dump(plan, f, indent=2)
+
+        totals = plan['totals']
+        projection = plan['projection']
+        logger.info("Plan for %d questions: %d Discourse writes %s, %d attachment bytes", totals['questions'],
+                    totals['total_writes'], totals['writes'], totals['upload_bytes'])
+        logger.info("Projected wall-clock time: %.1fh (bottleneck: %s), written to %s",
+                    projection['wall_clock_seconds'] / 3600, projection['bottleneck'], report_file)
+        return plan
@@ -0,0 +1,279 @@
+import hashlib
+import logging
+import threading
+import time
+
+from pydiscourse.client import DiscourseClient as BaseDiscourseClient
+from pydiscourse.exceptions import DiscourseClientError, DiscourseRateLimitedError
+
+from rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_api_credentials(value):
+    """Parse API credentials of the form "username:key,username2:key2".
+
+    Returns:
+        list: (username, api_key) tuples
+    """
+    credentials = []
+    for entry in (value or '').split(','):
+        if ':' in entry:
+            username, api_key = entry.split(':', 1)
+            if username.strip() and api_key.strip():
+                credentials.append((username.strip(), api_key.strip()))
+    return credentials
+
+
+def _raise_when_rate_limited(response, *args, **kwargs):
+    # pydiscourse sleeps through rate limits with the same key; the pool rather uses another one
+    if response.status_code == 429:
+        raise DiscourseRateLimitedError("Rate limited", response=response)
+
+
+class _FailFastClient(BaseDiscourseClient):
+    """A pydiscourse client that raises on the first rate limited response instead of waiting it out."""
+
+    def _request(self, verb, path, params=None, files=None, data=None, json=None, override_request_kwargs=None):
+        override_request_kwargs = dict(override_request_kwargs or {})
+        override_request_kwargs.setdefault('hooks', {'response': _raise_when_rate_limited})
+        return super()._request(verb, path, params=params, files=files, data=data, json=json,
+                                override_request_kwargs=override_request_kwargs)
+
+
+class PooledCredential:
+    """An API key of the pool with its own write budget and health."""
+
+    def __init__(self, host, username, api_key, writes_per_minute=None, timeout=None):
+        """Initialize the credential.
+
+        Args:
+            host (str): The Discourse host URL
+            username (str): The Discourse API username of the key
+            api_key (str): The Discourse API key
+            writes_per_minute (float, optional): Write budget of the key
+            timeout (float, optional): Seconds after which a request times out
+        """
+        self.username = username
+        self.api_key = api_key
+        self.client = _FailFastClient(host=host, api_username=username, api_key=api_key, timeout=timeout)
+        self.rate_limiter = RateLimiter(writes_per_minute) if writes_per_minute else None
+        # Identifies the key in logs and hashing without revealing it
+        self.fingerprint = hashlib.sha1(api_key.encode()).hexdigest()[:8]
+        self.throttled_until = 0.0
+        self.revoked = False
+        self.writes = 0
+        self.throttles = 0
+        self.user_clients = {}
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"{self.username}/{self.fingerprint}"
+
+    def available(self, now=None):
+        return not self.revoked and self.throttled_until <= (now or time.monotonic())
+
+    def client_as(self, username=None):
+        """Get the client of this key that acts as a user; the key's own user when username is None."""
+        if not username or username == self.username:
+            return self.client
+        with self.lock:
+            client = self.user_clients.get(username)
+            if client is None:
+                client = _FailFastClient(host=self.client.host, api_username=username, api_key=self.api_key,
+                                         timeout=self.client.timeout)
+                self.user_clients[username] = client
+            return client
+
+
+class CredentialPool:
+    """Spreads the writes of a migration over several Discourse API keys.
+
+    Discourse rate limits every user and API key on its own, so a pool of keys of
+    different users writes that many times faster than a single key. Each key keeps
+    its own write budget. The writes of a topic all go through the key the topic was
+    assigned to, so they come from one identity and stay in order; topics are
+    assigned by rendezvous hashing, and a topic only moves to another key when its
+    key is removed from the pool.
+
+    A key that Discourse rate limits sits out until its wait is over: writes not tied
+    to a topic go to the other keys meanwhile, and the writes of its topics wait for
+    it. A key Discourse rejects as invalid is removed for the rest of the run, and
+    its writes are sent again with the next key, which is safe since Discourse
+    refused them.
+
+    Acting as other users (see client_as) needs keys scoped to all users. Discourse
+    rejects a single-user key acting as someone else as invalid, which raises an
+    error instead of removing the key.
+    """
+
+    def __init__(self, credentials, cooldown=60):
+        """Initialize the pool.
+
+        Args:
+            credentials (list): PooledCredentials, in order of preference for writes not tied to a topic
+            cooldown (float): Seconds a rate limited key sits out when Discourse does not say
+        """
+        if not credentials:
+            raise ValueError("A credential pool needs at least one API key")
+        self.credentials = credentials
+        self.cooldown = cooldown
+        # Topic (or question, before its topic exists) to the key its writes go through
+        self.assignments = {}
+        self.lock = threading.Lock()
+        self._next = 0
+
+    def for_topic(self, topic_key):
+        """Get the key the writes of a topic go through, assigning one on first use.
+
+        When the key of the topic is rate limited, this waits until it may write again.
+        """
+        while True:
+            with self.lock:
+                credential = self.assignments.get(topic_key)
+                if credential is None or credential.revoked:
+                    credential = None
+                    available = self._available()
+                    if available:
+                        credential = max(available, key=lambda candidate: _rank(topic_key, candidate))
+                        self.assignments[topic_key] = credential
+                if credential is not None and credential.available():
+                    return credential
+            if credential is None:
+                self._wait_for_a_key()
+            else:
+                self._wait_for(credential)
+
+    def reassign(self, old_key, new_key):
+        """Let the writes of new_key go through the key assigned to old_key, e.g. a topic created for a question."""
+        with self.lock:
+            credential = self.assignments.pop(old_key, None)
+            if credential is not None:
+                self.assignments[new_key] = credential
+
+    def next_credential(self):
+        """Get a key for a write that is not tied to a topic, rotating over the available keys."""
+        while True:
+            with self.lock:
+                available = self._available()
+                if available:
+                    self._next += 1
+                    return available[self._next % len(available)]
+            self._wait_for_a_key()
+
+    def call(self, write, topic_key=None, username=None):
+        """Send a write through a key of the pool, moving to another key when it is throttled or revoked.
+
+        Args:
+            write (callable): Takes a pydiscourse client and sends the write with it
+            topic_key (optional): The topic the write belongs to; None for any key
+            username (str, optional): Discourse user to act as, instead of the user of the key
+
+        Returns:
+            The result of write
+        """
+        while True:
+            credential = self.for_topic(topic_key) if topic_key is not None else self.next_credential()
+            if credential.rate_limiter:
+                credential.rate_limiter.acquire()
+            try:
+                result = write(credential.client_as(username))
+            except DiscourseRateLimitedError as e:
+                self._throttled(credential, e)
+                continue
+            except DiscourseClientError as e:
+                if not _is_revoked(e):
+                    raise
+                if username and username != credential.username:
+                    self._check_all_users(credential, e)
+                self._revoked(credential, e)
+                continue
+            with self.lock:
+                credential.writes += 1
+            return result
+
+    def _available(self):
+        now = time.monotonic()
+        return [credential for credential in self.credentials if credential.available(now)]
+
+    def _wait_for_a_key(self):
+        with self.lock:
+            if all(credential.revoked for credential in self.credentials):
+                raise DiscourseClientError("Every API key of the credential pool was rejected by Discourse")
+            wait = min(credential.throttled_until for credential in self.credentials
+                       if not credential.revoked) - time.monotonic()
+        if wait > 0:
+            logger.info("Every API key of the pool is rate limited, waiting %.1fs", wait)
+            time.sleep(wait)
+
+    def _wait_for(self, credential):
+        wait = credential.throttled_until - time.monotonic()
+        if wait > 0:
+            logger.info("API key %s is rate limited, waiting %.1fs for it to write to its topic", credential, wait)
+            time.sleep(wait)
+
+    def _check_all_users(self, credential, error):
+        # A key scoped to its own user is rejected when it acts as another user, which is a setup error
+        try:
+            credential.client.user(credential.username)
+        except DiscourseClientError:
+            return
+        raise DiscourseClientError(f"API key {credential} can only act as {credential.username}; publishing "
+                                   f"as other users needs API keys scoped to all users",
+                                   response=error.response) from error
+
+    def _throttled(self, credential, error):
+        wait = _wait_seconds(error.response, self.cooldown)
+        with self.lock:
+            credential.throttles += 1
+            credential.throttled_until = time.monotonic() + wait
+        logger.warning("API key %s is rate limited, taking it out of rotation for %ss", credential, wait)
+
+    def _revoked(self, credential, error):
+        with self.lock:
+            credential.revoked = True
+        logger.error("API key %s was rejected by Discourse, removing it from the pool: %s", credential, error)
+
+    def summary(self):
+        """Report the use and health of every key.
+
+        Returns:
+            dict: Per key, its writes, the times it was rate limited and its state
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {
+                str(credential): {
+                    'writes': credential.writes,
+                    'throttled': credential.throttles,
+                    'state': 'revoked' if credential.revoked else 'available' if credential.available(now)
+                    else 'throttled',
+                }
+                for credential in self.credentials
+            }
+
+
+def _rank(topic_key, credential):
+    return hashlib.sha1(f"{topic_key}:{credential.fingerprint}".encode()).digest()
+
+
+def _is_revoked(error):
+    response = error.response
+    if response is None:
+        return False
+    # A revoked key or one of a deactivated user is rejected as invalid
+    return response.status_code == 401 or (response.status_code == 403 and 'key is invalid' in response.text)
+
+
+def _wait_seconds(response, default):
+    if response is None:
+        return default
+    try:
+        return response.json()['extras']['wait_seconds'] + 1
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return default
@@ -0,0 +1,171 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+# Response headers worth keeping; the others only make the cassette larger
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Location', 'Retry-After', 'Content-Length',
+                    'Discourse-Rate-Limit-Error-Code')
+
+
+def request_key(method, url):
+    """Key a request by its method and URL, with the query parameters in a stable order."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method.upper()} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))}"
+
+
+class Cassette:
+    """Records the HTTP exchanges of a run and replays them without a network.
+
+    Every request made through requests, which includes the Confluence fetcher,
+    the attachment downloads and pydiscourse, is intercepted at Session.send. The
+    cassette is a directory holding an index of the exchanges as JSON lines and the
+    response bodies gzipped under their SHA-256, so an attachment that is downloaded
+    many times is stored once. Request headers are not recorded, so credentials
+    never end up in a cassette.
+
+    On replay, the recorded responses of a method and URL are served in the order
+    they were recorded; the last one is repeated once they run out.
+
+    Clients that do not use requests, such as the asynchronous publisher, bypass
+    the cassette; the recording or replaying cassette is kept in Cassette.active so
+    that they can be turned off.
+    """
+
+    # The cassette recording or replaying, if any
+    active = None
+
+    def __init__(self, directory='target/cassette'):
+        """Initialize the cassette.
+
+        Args:
+            directory (str): Directory holding the index and the bodies
+        """
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.jsonl')
+        self.bodies_dir = os.path.join(directory, 'bodies')
+        self.lock = threading.Lock()
+        self.original_send = None
+        self.replay_speed = 0
+        self.exchanges = {}
+
+    def record(self):
+        """Start recording every HTTP exchange into the cassette."""
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        started = time.monotonic()
+        original_send = self._install()
+
+        def send(session, request, **kwargs):
+            sent_at = time.monotonic() - started
+            response = original_send(session, request, **kwargs)
+            self._store(request, response, sent_at)
+            return response
+
+        requests.Session.send = send
+        logger.info("Recording HTTP exchanges into %s", self.directory)
+
+    def replay(self, speed=0):
+        """Start serving every HTTP request from the cassette.
+
+        Args:
+            speed (float): 1 replays the recorded latencies, 2 twice as fast and
+                           0 answers without waiting
+        """
+        self.replay_speed = speed
+        exchanges = defaultdict(deque)
+        with open(self.index_file, 'r') as f:
+            for line in f:
+                try:
+                    exchange = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last exchange may be cut short by a crash
+                    continue
+                exchanges[exchange['key']].append(exchange)
+        self.exchanges = exchanges
+        self._install()
+
+        def send(session, request, **kwargs):
+            return self._serve(request)
+
+        requests.Session.send = send
+        logger.info("Replaying %d recorded HTTP exchanges from %s",
+                    sum(len(queue) for queue in exchanges.values()), self.directory)
+
+    def stop(self):
+        """Restore live HTTP requests."""
+        if self.original_send is not None:
+            requests.Session.send = self.original_send
+            self.original_send = None
+        if Cassette.active is self:
+            Cassette.active = None
+
+    def _install(self):
+        if self.original_send is None:
+            self.original_send = requests.Session.send
+        Cassette.active = self
+        return self.original_send
+
+    def _store(self, request, response, sent_at):
+        body = response.content or b''
+        body_hash = hashlib.sha256(body).hexdigest()
+        body_file = os.path.join(self.bodies_dir, f"{body_hash}.gz")
+        if not os.path.exists(body_file):
+            temp_file = f"{body_file}.{threading.get_ident()}.tmp"
+            with gzip.open(temp_file, 'wb') as f:
+                f.write(body)
+            os.replace(temp_file, body_file)
+
+        exchange = {
+            'key': request_key(request.method, request.url),
+            'sent_at': round(sent_at, 4),
+            'elapsed': round(response.elapsed.total_seconds(), 4),
+            'status': response.status_code,
+            'reason': response.reason,
+            'url': response.url,
+            'headers': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            'body': body_hash,
+        }
+        with self.lock:
+            with open(self.index_file, 'a') as f:
+                f.write(json.dumps(exchange) + "\n")
+
+    def _serve(self, request):
+        key = request_key(request.method, request.url)
+        with self.lock:
+            recorded = self.exchanges.get(key)
+            if not recorded:
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key}", request=request)
+            exchange = recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+        if self.replay_speed:
+            time.sleep(exchange['elapsed'] / self.replay_speed)
+
+        with gzip.open(os.path.join(self.bodies_dir, f"{exchange['body']}.gz"), 'rb') as f:
+            body = f.read()
+
+        response = requests.Response()
+        response.status_code = exchange['status']
+        response.reason = exchange['reason']
+        response.url = exchange['url']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response._content = body
+        # The body is already read: streamed reads serve it from _content and close() has nothing to release
+        response._content_consumed = True
+        response.raw = io.BytesIO(body)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=exchange['elapsed'])
+        response.request = request
+        return response
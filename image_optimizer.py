@@ -0,0 +1,231 @@
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Formats Discourse may not render in every browser are converted to WebP
+CONVERTED_FORMATS = {'heic', 'heif', 'avif'}
+
+
+def optimize_image(filename, content, max_dimension=2048):
+    """Shrink an image for upload.
+
+    The image is downscaled to fit max_dimension, PNGs are recompressed losslessly,
+    HEIC/HEIF/AVIF images are converted to WebP and metadata such as EXIF is dropped.
+    The original is kept whenever the result would not be smaller. Runs in a worker
+    process, so it must stay a module level function.
+
+    Args:
+        filename (str): The name of the image file
+        content (bytes): The image data
+        max_dimension (int): Largest width or height in pixels
+
+    Returns:
+        tuple: (filename, content) of the image to upload
+    """
+    from PIL import Image, ImageOps
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+    base, _, extension = filename.rpartition('.')
+    extension = extension.lower()
+    if extension == 'gif':
+        # Re-encoding would drop animation frames
+        return filename, content
+
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.load()
+    except Exception:
+        return filename, content
+
+    had_metadata = bool(image.info.get('exif'))
+    image = ImageOps.exif_transpose(image)
+    resized = max(image.size) > max_dimension
+    if resized:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    params = {}
+    if image.info.get('icc_profile'):
+        params['icc_profile'] = image.info['icc_profile']
+
+    if extension in CONVERTED_FORMATS:
+        target_extension, image_format = 'webp', 'WEBP'
+        params['quality'] = 85
+    elif extension == 'png':
+        target_extension, image_format = 'png', 'PNG'
+        params['optimize'] = True
+    elif extension in ('jpg', 'jpeg'):
+        if not resized and not had_metadata:
+            # Re-encoding a JPEG only loses quality unless it shrinks it
+            return filename, content
+        target_extension, image_format = extension, 'JPEG'
+        params.update(quality=88, optimize=True, progressive=True)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    elif extension == 'webp':
+        if not resized and not had_metadata:
+            return filename, content
+        target_extension, image_format = 'webp', 'WEBP'
+        params['quality'] = 85
+    else:
+        return filename, content
+
+    output = io.BytesIO()
+    try:
+        image.save(output, format=image_format, **params)
+    except Exception:
+        return filename, content
+    optimized = output.getvalue()
+
+    if target_extension == extension and len(optimized) >= len(content):
+        return filename, content
+    return f"{base}.{target_extension}", optimized
+
+
+class ImageOptimizer:
+    """Optimizes images before upload in a pool of worker processes.
+
+    Results are cached on disk by the hash of the original content and the largest
+    dimension it was fitted to, so an image
+    that appears more than once, or again in a later run, is only optimized once.
+    Pillow is optional: without it images are uploaded unchanged.
+    """
+
+    def __init__(self, max_dimension=2048, cache_dir='target/image_cache', workers=None):
+        """Initialize the optimizer.
+
+        Args:
+            max_dimension (int): Largest width or height in pixels
+            cache_dir (str): Directory holding the optimized images
+            workers (int, optional): Number of worker processes (defaults to the CPU count)
+        """
+        self.max_dimension = max_dimension
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.available = importlib.util.find_spec('PIL') is not None
+        if not self.available:
+            logger.warning("Pillow is not installed, images will be uploaded without optimization")
+        self._executor = None
+        self._cache = None
+        self.lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def executor(self):
+        """The process pool, started on first use."""
+        with self.lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    @property
+    def cache(self):
+        """Optimized file name per content hash, read from the cache directory on first use."""
+        with self.lock:
+            if self._cache is None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._cache = {}
+                for name in os.listdir(self.cache_dir):
+                    digest, _, stored_name = name.partition('_')
+                    if stored_name and not name.endswith('.tmp'):
+                        self._cache[digest] = stored_name
+            return self._cache
+
+    def submit(self, filename, content):
+        """Start optimizing an image.
+
+        Args:
+            filename (str): The name of the image file
+            content (bytes): The image data
+
+        Returns:
+            Future: Resolves to the (filename, content) to upload; the original image
+                    if the optimization fails
+        """
+        # A smaller max_dimension must not reuse the images cached for a larger one
+        hasher = hashlib.sha256(content)
+        hasher.update(f":{self.max_dimension}".encode())
+        digest = hasher.hexdigest()
+        cached_name = self.cache.get(digest)
+        if cached_name is not None:
+            try:
+                with open(os.path.join(self.cache_dir, f"{digest}_{cached_name}"), 'rb') as f:
+                    optimized = f.read()
+            except OSError:
+                # The cached file was removed since the cache was read, so the image is optimized again
+                with self.lock:
+                    self._cache.pop(digest, None)
+            else:
+                future = Future()
+                # Keep the caller's name, only the extension comes from the cached result
+                future.set_result((self._rename(filename, cached_name), optimized))
+                return future
+
+        if not self.available:
+            future = Future()
+            future.set_result((filename, content))
+            return future
+
+        result = Future()
+
+        def finish(done):
+            # The result is always set, as an exception raised here would leave the caller waiting forever
+            if done.exception() is not None:
+                logger.warning("Could not optimize %s: %s", filename, done.exception())
+                result.set_result((filename, content))
+                return
+            try:
+                self._store(digest, len(content), done.result())
+            except Exception as e:
+                logger.warning("Could not cache the optimized %s: %s", filename, e)
+            result.set_result(done.result())
+
+        self.executor.submit(optimize_image, filename, content, self.max_dimension).add_done_callback(finish)
+        return result
+
+    def optimize(self, filename, content):
+        """Optimize an image and wait for the result.
+
+        Returns:
+            tuple: (filename, content) of the image to upload
+        """
+        return self.submit(filename, content).result()
+
+    def _store(self, digest, original_size, optimized_image):
+        filename, optimized = optimized_image
+        stored_name = os.path.basename(filename)
+        # Written aside first, so an interrupted run leaves no truncated image in the cache
+        path = os.path.join(self.cache_dir, f"{digest}_{stored_name}")
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(optimized)
+        os.replace(f"{path}.tmp", path)
+        with self.lock:
+            self._cache[digest] = stored_name
+            self.bytes_in += original_size
+            self.bytes_out += len(optimized)
+
+    def _rename(self, filename, cached_name):
+        extension = cached_name.rpartition('.')[2]
+        return f"{filename.rpartition('.')[0]}.{extension}" if '.' in filename else filename
+
+    def log_savings(self):
+        """Log how much the optimized images saved so far."""
+        if self.bytes_in:
+            logger.info("Image optimization reduced %d bytes of images to %d bytes", self.bytes_in, self.bytes_out)
+
+    def shutdown(self):
+        """Stop the worker processes; they are started again if another image is submitted."""
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
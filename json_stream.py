@@ -0,0 +1,161 @@
+import json
+from collections.abc import Mapping
+
+_decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARACTERS = '0123456789+-.eE'
+
+
+def iter_json_array(chunks, key=None):
+    """Yield the items of a JSON array while the document streams in.
+
+    The document is either the array itself or an object holding it under key,
+    like {"results": [...]}. Only the item being decoded and the chunk it arrives
+    in are held in memory, however long the array is.
+
+    Args:
+        chunks (iterable): Consecutive pieces of the document as str
+        key (str, optional): Key of the array when the document is an object
+
+    Yields:
+        The decoded items, in order
+
+    Raises:
+        ValueError: If the document is not valid JSON or holds no array where expected
+    """
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+
+    def read_more():
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                # Drop what was consumed so the buffer stays the size of one item
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+
+    def peek():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return None
+
+    def decode():
+        nonlocal position
+        if peek() is None:
+            raise ValueError("Unexpected end of the JSON document")
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+                continue
+            # A number cut off by the end of the buffer continues in the next chunk
+            if (isinstance(value, (int, float)) and (end == len(buffer) or buffer[end] in NUMBER_CHARACTERS)
+                    and read_more()):
+                continue
+            position = end
+            return value
+
+    def expect(*characters):
+        nonlocal position
+        character = peek()
+        if character not in characters:
+            raise ValueError(f"Expected {' or '.join(characters)} at offset {position} of the JSON document, "
+                             f"found {character!r}")
+        position += 1
+        return character
+
+    if peek() is None:
+        return
+
+    if peek() == '{':
+        position += 1
+        if peek() == '}':
+            return
+        while True:
+            name = decode()
+            expect(':')
+            if name == key and peek() == '[':
+                break
+            decode()
+            if expect(',', '}') == '}':
+                # The object has no array under key, e.g. an empty listing
+                return
+
+    expect('[')
+    if peek() == ']':
+        return
+    while True:
+        yield decode()
+        if expect(',', ']') == ']':
+            return
+
+
+class ListingRecord(Mapping):
+    """An item of a Confluence listing, projected down to the fields the migration uses.
+
+    The fields live in __slots__, so a record takes a fraction of the memory of the
+    dict it was decoded from. Records read like those dicts: record['id'],
+    record.get('topics') and 'topics' in record, where a field the listing did not
+    return counts as missing. dict(record) turns one back into a dict, for storing
+    it as JSON.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_item(cls, item):
+        """Project a decoded listing item onto a record."""
+        record = cls()
+        for field in cls.__slots__:
+            if field in item:
+                setattr(record, field, item[field])
+        return record
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(f"{type(self).__name__} has no field {key!r}")
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return (field for field in self.__slots__ if hasattr(self, field))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class QuestionRecord(ListingRecord):
+    """A question of the question listing."""
+
+    __slots__ = ('id', 'title', 'dateAsked', 'author', 'topics', 'answersCount', 'spaceKey', 'acceptedAnswerId')
+
+
+class AnswerRecord(ListingRecord):
+    """An answer of the answer listing of a question."""
+
+    __slots__ = ('id', 'author', 'dateAnswered', 'accepted')
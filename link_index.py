@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Suffix ContentFormatter adds to links that still point to the old community
+OLD_COMMUNITY_SUFFIX = '  <small>_(old community)_</small>'
+
+
+class LinkIndex:
+    """Maps Confluence questions and answers to the Discourse topics and posts they became.
+
+    Links between questions are rewritten with a dictionary lookup while content is
+    rendered. A link to a question that is not migrated yet is left pointing to the
+    old community, and the post holding it is deferred; once the targets exist,
+    fix_links() edits the deferred posts in one pass.
+
+    The index is an append-only JSON lines file that is replayed on first use, so
+    recording a migrated topic or post costs a single line.
+    """
+
+    def __init__(self, confluence_url, discourse_url, index_file='target/link_index.jsonl'):
+        """Initialize the link index.
+
+        Args:
+            confluence_url (str): Base URL of the old community
+            discourse_url (str): Base URL of the Discourse forum
+            index_file (str): Path of the JSON lines file holding the index
+        """
+        self.discourse_url = discourse_url.rstrip('/')
+        self.index_file = index_file
+        self.link_pattern = re.compile(
+            r'\[([^\]]+)\]\((?:' + re.escape(confluence_url.rstrip('/')) + r')?'
+            r'/questions/(\d+)(?:/answers/(\d+))?[^)\s]*\)'
+            r'(' + re.escape(OLD_COMMUNITY_SUFFIX) + r')?'
+        )
+        self._topics = None
+        self.posts = {}
+        # Question of each answer, for answers recorded with it
+        self.answer_questions = {}
+        # Number of continuation posts per question, which are not answers
+        self.continuations = {}
+        self.deferred = {}
+        self.lock = threading.RLock()
+
+    @property
+    def topics(self):
+        """Discourse topic ID per Confluence question ID, loaded from disk on first use."""
+        with self.lock:
+            if self._topics is None:
+                self._topics = {}
+                self.load_index()
+            return self._topics
+
+    def load_index(self):
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last record may be cut short by a crash
+                    continue
+                self._apply(record)
+        logger.info("Link index has %d topics, %d posts and %d posts with deferred links",
+                    len(self._topics), len(self.posts), len(self.deferred))
+
+    def _apply(self, record):
+        if 'topic_id' in record:
+            self._topics[record['question_id']] = record['topic_id']
+        elif 'answer_id' in record:
+            self.posts[record['answer_id']] = record['post_id']
+            if record.get('question_id'):
+                self.answer_questions[record['answer_id']] = record['question_id']
+        elif 'continuation' in record:
+            self.continuations[record['question_id']] = self.continuations.get(record['question_id'], 0) + 1
+        elif 'targets' in record:
+            self.deferred[record['post_id']] = record
+        elif 'resolved' in record:
+            self.deferred.pop(record['resolved'], None)
+
+    def _append(self, record):
+        with self.lock:
+            self.topics  # Replays the file before it is appended to
+            self._apply(record)
+            os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+            with open(self.index_file, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+    def add_topic(self, question_id, topic_id):
+        """Record the topic a question was migrated to."""
+        self._append({'question_id': str(question_id), 'topic_id': topic_id})
+
+    def add_answer(self, answer_id, post_id, question_id=None):
+        """Record the post an answer was migrated to, and the question it answers."""
+        record = {'answer_id': str(answer_id), 'post_id': post_id}
+        if question_id is not None:
+            record['question_id'] = str(question_id)
+        self._append(record)
+
+    def question_of(self, content_id):
+        """Get the ID of the question a question or answer ID belongs to."""
+        with self.lock:
+            self.topics  # Replays the file before it is read
+            return self.answer_questions.get(str(content_id), str(content_id))
+
+    def add_continuation(self, question_id, post_id):
+        """Record a continuation post of a question or one of its answers."""
+        self._append({'question_id': str(question_id), 'continuation': post_id})
+
+    def url_for(self, question_id, answer_id=None):
+        """Get the Discourse URL of a question or answer.
+
+        Returns:
+            str: The URL, or None if the question is not migrated yet
+        """
+        topic_id = self.topics.get(str(question_id))
+        if answer_id and str(answer_id) in self.posts:
+            return f"{self.discourse_url}/p/{self.posts[str(answer_id)]}"
+        return f"{self.discourse_url}/t/{topic_id}" if topic_id else None
+
+    def rewrite(self, content, skip_question_id=None):
+        """Point the links to migrated questions and answers at their Discourse topics and posts.
+
+        Args:
+            content (str): Markdown content
+            skip_question_id (str, optional): Question whose own links are left alone, such as the
+                                              link to the original question in a topic's header
+
+        Returns:
+            str: The content with its links rewritten
+        """
+        def replace(match):
+            text, question_id, answer_id = match.group(1), match.group(2), match.group(3)
+            if question_id == str(skip_question_id):
+                return match.group(0)
+            url = self.url_for(question_id, answer_id)
+            return f"[{text}]({url})" if url else match.group(0)
+
+        return self.link_pattern.sub(replace, content)
+
+    def unresolved_targets(self, content, skip_question_id=None):
+        """List the questions linked from content that are not migrated yet."""
+        return sorted({
+            match.group(2) for match in self.link_pattern.finditer(content)
+            if match.group(2) != str(skip_question_id) and str(match.group(2)) not in self.topics
+        })
+
+    def defer(self, post_id, question_id, content):
+        """Remember a post whose links could not all be rewritten yet.
+
+        Args:
+            post_id (int): The ID of the created post
+            question_id (str): The question the post belongs to
+            content (str): The content the post was created with
+        """
+        targets = self.unresolved_targets(content, question_id)
+        if targets:
+            self._append({'post_id': post_id, 'question_id': str(question_id), 'targets': targets})
+
+    def fix_links(self, discourse_client, write_behind=None):
+        """Rewrite the deferred links whose target questions have been migrated since.
+
+        Args:
+            discourse_client (DiscourseClient): The client to read and edit the posts with
+            write_behind (WriteBehindQueue, optional): Queues the edits instead of making them right away
+
+        Returns:
+            int: Number of posts edited
+        """
+        with self.lock:
+            topics = self.topics
+            ready = [entry for entry in self.deferred.values()
+                     if any(target in topics for target in entry['targets'])]
+        if not ready:
+            return 0
+
+        logger.info("Fixing links in %d of %d deferred posts...", len(ready), len(self.deferred))
+        edited = 0
+        for entry in ready:
+            # A queued edit of the post holds its newest content
+            raw = None if write_behind is None else write_behind.pending_edit(entry['post_id'])
+            if raw is None:
+                raw = discourse_client.get_post_raw(entry['post_id'])
+            rewritten = self.rewrite(raw, entry['question_id'])
+            if rewritten != raw:
+                topic_id = self.topics.get(entry['question_id'])
+                if write_behind is not None:
+                    write_behind.edit_post(entry['post_id'], rewritten, edit_reason='Link to migrated topics',
+                                           topic_id=topic_id)
+                else:
+                    discourse_client.update_post(entry['post_id'], rewritten, edit_reason='Link to migrated topics',
+                                                 topic_id=topic_id)
+                edited += 1
+            remaining = self.unresolved_targets(rewritten, entry['question_id'])
+            if remaining:
+                self._append({**entry, 'targets': remaining})
+            else:
+                self._append({'resolved': entry['post_id']})
+        logger.info("Edited %d posts, %d posts still link to questions that are not migrated",
+                    edited, len(self.deferred))
+        return edited
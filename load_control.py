@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits in-flight requests with additive-increase/multiplicative-decrease.
+
+    While requests complete within the latency SLO the limit grows by roughly one
+    request per round of requests; a slow response, a server error or a timeout
+    cuts it by the decrease factor.
+    """
+
+    def __init__(self, latency_slo=1.0, min_limit=1, max_limit=8, initial_limit=1, decrease_factor=0.5):
+        """Initialize the limiter.
+
+        Args:
+            latency_slo (float): Target response time in seconds
+            min_limit (int): Lowest number of concurrent requests
+            max_limit (int): Highest number of concurrent requests
+            initial_limit (int): Number of concurrent requests to start with
+            decrease_factor (float): Factor the limit is multiplied by on overload
+        """
+        self.latency_slo = latency_slo
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Block until another request may be sent."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded):
+        """Record the outcome of a request and adjust the limit.
+
+        Args:
+            latency (float): Response time of the request in seconds
+            overloaded (bool): True for a server error or a timeout
+        """
+        with self.condition:
+            self.in_flight -= 1
+            previous = int(self.limit)
+            if overloaded or latency > self.latency_slo:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) != previous:
+                logging.debug(f"Confluence concurrency limit {previous} -> {int(self.limit)} (latency {latency:.2f}s)")
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """Pauses requests while a server is unhealthy.
+
+    After a number of consecutive failures the circuit opens and every caller waits.
+    Once the cooldown has passed, a single probe request is let through: when it
+    succeeds the circuit closes again, when it fails the cooldown starts over.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, cooldown=60.0):
+        """Initialize the circuit breaker.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            cooldown (float): Seconds to wait before probing an open circuit
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.condition = threading.Condition()
+
+    def before_request(self):
+        """Block while the circuit is open; let one probe through after the cooldown."""
+        with self.condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return
+                if self.state == self.OPEN:
+                    remaining = self.opened_at + self.cooldown - time.monotonic()
+                    if remaining <= 0:
+                        self.state = self.HALF_OPEN
+                        logging.info("Circuit half-open, probing Confluence")
+                        return
+                    self.condition.wait(remaining)
+                else:
+                    # A probe is already in flight
+                    self.condition.wait()
+
+    def record_success(self):
+        """Record a healthy response."""
+        with self.condition:
+            if self.state != self.CLOSED:
+                logging.info("Confluence healthy again, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.condition.notify_all()
+
+    def record_failure(self):
+        """Record a server error or timeout."""
+        with self.condition:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"Confluence unhealthy after {self.failures} failures, "
+                                    f"pausing requests for {self.cooldown:.0f}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self.condition.notify_all()
@@ -1,25 +1,144 @@
+import atexit
+import contextlib
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import time
+
+# Per-event fields attached to every record, from the log context or from `extra`
+CONTEXT_FIELDS = ('worker_id', 'space_key', 'question_id', 'answer_id', 'topic_id', 'post_id', 'stage', 'duration')
+
+_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+# Callables told the name and duration of every stage that finishes
+_stage_observers = []
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Attach fields, such as the question ID, to every record logged in this block."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@contextlib.contextmanager
+def log_stage(stage, **fields):
+    """Attach a stage name to the records logged in this block and log how long it took."""
+    started = time.monotonic()
+    with log_context(stage=stage, **fields):
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            logging.getLogger('migration').debug("%s finished", stage, extra={'duration': round(elapsed, 3)})
+            for observer in _stage_observers:
+                observer(stage, elapsed)
+
+
+def add_stage_observer(observer):
+    """Tell observer(stage, seconds) about every stage that finishes, e.g. to tune the migration."""
+    _stage_observers.append(observer)
+
+
+def remove_stage_observer(observer):
+    if observer in _stage_observers:
+        _stage_observers.remove(observer)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto a record before it leaves the logging thread."""
+
+    def filter(self, record):
+        for field, value in _context.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """The plain text format, followed by the context fields of the record."""
+
+    def format(self, record):
+        message = super().format(record)
+        context = ' '.join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if hasattr(record, field))
+        return f"{message} [{context}]" if context else message
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records unformatted, so the message is only built by the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logger(json_format=None, level=None):
+    """Configure and return a logger that outputs to stdout.
+
+    Records are handed to a background thread through a queue, so logging never
+    blocks the migration on writing to stdout. The output is plain text, or one
+    JSON object per line when json_format is set or LOG_FORMAT=json.
+
+    Args:
+        json_format (bool, optional): Write JSON lines (defaults to LOG_FORMAT)
+        level (str, optional): Log level name (defaults to LOG_LEVEL or INFO)
+
+    Returns:
+        logging.Logger: The root logger
+    """
+    global _listener
 
-def setup_logger():
-    """Configure and return a logger that outputs to stdout."""
     # Get the root logger
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    # Create the queue and its stdout writer if they don't exist
+    if _listener is None and not logger.handlers:
+        if json_format is None:
+            json_format = os.getenv('LOG_FORMAT', 'text').lower() == 'json'
 
-    # Create stdout handler if it doesn't exist
-    if not logger.handlers:
         handler = logging.StreamHandler()
-        handler.setLevel(logging.INFO)
-        
-        # Create formatter and add it to the handler
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        
-        # Add handler to logger
-        logger.addHandler(handler)
+        if json_format:
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        logger.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, handler)
+        _listener.start()
+        # Flush the queued records when the process exits
+        atexit.register(_listener.stop)
 
     # Also setup pydiscourse logger specifically
     pydiscourse_logger = logging.getLogger('pydiscourse.client')
     pydiscourse_logger.setLevel(logging.INFO)
 
-    return logger 
\ No newline at end of file
+    return logger
@@ -0,0 +1,183 @@
+import bisect
+import json
+import logging
+import os
+import threading
+
+# Fields of a question listing record that the bulk migration path relies on
+INDEX_FIELDS = ('id', 'title', 'dateAsked', 'author', 'topics', 'answersCount', 'spaceKey')
+
+
+class MigrationCheckpoint:
+    """Persisted cursor over the sorted question index of a bulk migration.
+
+    The checkpoint is split in two files so that advancing the cursor stays cheap:
+    the index snapshot (every question to migrate, oldest first) is only rewritten
+    when the source changes, while the small cursor file is rewritten after every
+    question.
+
+    A checkpoint that is not persistent keeps its state in memory only, for runs
+    that must not move the cursor of the real migration.
+    """
+
+    def __init__(self, directory='target', space_key=None, persistent=True):
+        """Initialize the checkpoint.
+
+        Args:
+            directory (str): Directory holding the checkpoint files
+            space_key (str, optional): The Confluence space key the index belongs to
+            persistent (bool): Whether the checkpoint is read from and written to its files
+        """
+        suffix = f"_{space_key}" if space_key else ""
+        self.index_file = os.path.join(directory, f"question_index{suffix}.json")
+        self.cursor_file = os.path.join(directory, f"migration_cursor{suffix}.json")
+        self.space_key = space_key
+        self.persistent = persistent
+        self.questions = []
+        self.known_ids = set()
+        self.position = 0
+        self.in_flight = []
+        # Questions may be started and completed by several threads
+        self.lock = threading.RLock()
+
+    def load(self):
+        """Load a previously saved checkpoint.
+
+        Returns:
+            bool: True if an index snapshot and cursor were found
+        """
+        if not self.persistent or not (os.path.exists(self.index_file) and os.path.exists(self.cursor_file)):
+            return False
+
+        with open(self.index_file, 'r') as f:
+            self.questions = json.load(f)
+        with open(self.cursor_file, 'r') as f:
+            cursor = json.load(f)
+
+        self.known_ids = {question['id'] for question in self.questions}
+        self.position = min(cursor.get('position', 0), len(self.questions))
+        self.in_flight = cursor.get('in_flight', [])
+        logging.info(f"Loaded checkpoint at position {self.position}/{len(self.questions)} "
+                     f"with {len(self.in_flight)} in-flight question(s)")
+        return True
+
+    def reset(self):
+        """Remove the checkpoint files and start over from an empty index."""
+        for path in (self.index_file, self.cursor_file):
+            if self.persistent and os.path.exists(path):
+                os.remove(path)
+        self.questions = []
+        self.known_ids = set()
+        self.position = 0
+        self.in_flight = []
+
+    def set_index(self, questions):
+        """Replace the index snapshot with a freshly enumerated, sorted question list.
+
+        Args:
+            questions (list): Question records sorted by creation date (oldest first)
+        """
+        self.questions = [self._project(question) for question in questions]
+        self.known_ids = {question['id'] for question in self.questions}
+        self.position = 0
+        self.in_flight = []
+        self._save_index()
+        self.save_cursor()
+
+    def merge_new_questions(self, questions):
+        """Insert questions that appeared in the source since the snapshot was taken.
+
+        New questions are placed in date order. Any that land before the cursor are
+        queued as in-flight so that the resumed run still picks them up.
+
+        Args:
+            questions (list): Question records not yet present in the index
+
+        Returns:
+            int: Number of questions added to the index
+        """
+        added = 0
+        dates = [question['dateAsked'] for question in self.questions]
+        for question in sorted(questions, key=lambda q: q['dateAsked']):
+            if question['id'] in self.known_ids:
+                continue
+            index = bisect.bisect_right(dates, question['dateAsked'])
+            dates.insert(index, question['dateAsked'])
+            self.questions.insert(index, self._project(question))
+            self.known_ids.add(question['id'])
+            if index < self.position:
+                self.position += 1
+                self.in_flight.append(question['id'])
+            added += 1
+
+        if added:
+            self._save_index()
+            self.save_cursor()
+        return added
+
+    def pending_in_flight(self):
+        """Get the in-flight questions that lie behind the cursor.
+
+        An in-flight question at or after the cursor is picked up again by simply
+        resuming at the cursor, so only those behind it need separate handling.
+
+        Returns:
+            list: Question records, in index order
+        """
+        in_flight = set(self.in_flight)
+        return [question for question in self.questions[:self.position] if question['id'] in in_flight]
+
+    def start(self, question_id, advance=False):
+        """Record that a question is about to be migrated.
+
+        Args:
+            question_id: The ID of the question
+            advance (bool): Whether to move the cursor past the current position right away,
+                            so the next question can start while this one is in flight
+        """
+        with self.lock:
+            if question_id not in self.in_flight:
+                self.in_flight.append(question_id)
+            if advance:
+                self.position += 1
+            self.save_cursor()
+
+    def complete(self, question_id, advance=True):
+        """Record that a question has been handled.
+
+        Args:
+            question_id: The ID of the question that was handled
+            advance (bool): Whether to move the cursor past the current position
+        """
+        with self.lock:
+            if question_id in self.in_flight:
+                self.in_flight.remove(question_id)
+            if advance:
+                self.position += 1
+            self.save_cursor()
+
+    def save_cursor(self):
+        """Write the cursor file."""
+        with self.lock:
+            self._write_json(self.cursor_file, {
+                'space_key': self.space_key,
+                'position': self.position,
+                'in_flight': list(self.in_flight),
+                'index_size': len(self.questions),
+            })
+
+    def _save_index(self):
+        self._write_json(self.index_file, self.questions)
+
+    def _project(self, question):
+        return {field: question[field] for field in INDEX_FIELDS if field in question}
+
+    def _write_json(self, path, data):
+        if not self.persistent:
+            return
+        # Write to a temporary file first so a crash never leaves a truncated checkpoint
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import threading
+
+
+def topic_external_id(question_id):
+    """Get the Discourse external ID identifying the topic of a Confluence question."""
+    return f"confluence-question-{question_id}"
+
+
+def answer_marker(answer_id):
+    """Get the hidden marker identifying the Discourse post of a Confluence answer."""
+    return f"<!-- confluence-answer:{answer_id} -->"
+
+
+def part_marker(content_id, part):
+    """Get the hidden marker identifying a continuation post of a question or answer."""
+    return f"<!-- confluence-part:{content_id}:{part} -->"
+
+
+class MigrationJournal:
+    """Write-ahead journal of the Discourse writes made for each question.
+
+    Before a topic or answer post is created a 'pending' record is appended, and once
+    the write has succeeded its outcome is appended. After a crash, a question with a
+    created topic resumes at the first answer that was not posted. A write that was
+    pending but never confirmed is looked up in Discourse through its idempotency key
+    (the topic external ID or the answer marker) rather than being written again.
+
+    Questions and answers split over several posts record how many parts they have
+    when they are about to be written, and every continuation post is journaled like
+    an answer, so a resumed run posts only the parts that are missing.
+    """
+
+    def __init__(self, journal_file='target/migration_journal.jsonl'):
+        """Initialize the journal.
+
+        Args:
+            journal_file (str): Path of the JSON lines file holding the journal
+        """
+        self.journal_file = journal_file
+        self._states = None
+        self.lock = threading.RLock()
+
+    @property
+    def states(self):
+        """Journaled state per question ID, loaded from disk on first use."""
+        with self.lock:
+            if self._states is None:
+                self._states = {}
+                self.load_journal()
+            return self._states
+
+    def load_journal(self):
+        """Replay the journal and compact it down to the unfinished questions."""
+        if not os.path.exists(self.journal_file):
+            return
+
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self._apply(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last record may be cut short by a crash
+                    logging.warning(f"Ignoring truncated journal record: {line[:80]}")
+
+        self._states = {question_id: state for question_id, state in self._states.items()
+                        if not state['completed']}
+        self._compact()
+        if self.states:
+            logging.info(f"Journal has {len(self.states)} partially migrated question(s)")
+
+    def _compact(self):
+        temp_file = f"{self.journal_file}.tmp"
+        with open(temp_file, 'w') as f:
+            for question_id, state in self.states.items():
+                for record in self._records_for(question_id, state):
+                    f.write(json.dumps(record) + "\n")
+        os.replace(temp_file, self.journal_file)
+
+    def _records_for(self, question_id, state):
+        if state['topic_id'] is not None:
+            yield {'question_id': question_id, 'step': 'topic_created',
+                   'topic_id': state['topic_id'], 'post_id': state['post_id']}
+        elif state['topic_pending']:
+            yield {'question_id': question_id, 'step': 'topic_pending'}
+        for content_id, parts in state['parts'].items():
+            yield {'question_id': question_id, 'step': 'parts_expected', 'content_id': content_id, 'parts': parts}
+        for key, post_id in state['posted_parts'].items():
+            content_id, _, part = key.rpartition(':')
+            yield {'question_id': question_id, 'step': 'part_posted', 'content_id': content_id,
+                   'part': int(part), 'post_id': post_id}
+        for key in state['pending_parts']:
+            content_id, _, part = key.rpartition(':')
+            yield {'question_id': question_id, 'step': 'part_pending', 'content_id': content_id, 'part': int(part)}
+        for answer_id, post_id in state['answers'].items():
+            yield {'question_id': question_id, 'step': 'answer_posted', 'answer_id': answer_id, 'post_id': post_id}
+        for answer_id in state['pending_answers']:
+            yield {'question_id': question_id, 'step': 'answer_pending', 'answer_id': answer_id}
+        for post_id in state['solutions']:
+            yield {'question_id': question_id, 'step': 'solution_accepted', 'post_id': post_id}
+
+    def _state(self, question_id):
+        return self.states.setdefault(str(question_id), {
+            'topic_pending': False,
+            'topic_id': None,
+            'post_id': None,
+            'answers': {},
+            'pending_answers': [],
+            'solutions': [],
+            # Number of parts per split question or answer, and the continuation posts by "content_id:part"
+            'parts': {},
+            'posted_parts': {},
+            'pending_parts': [],
+            'completed': False,
+        })
+
+    def _apply(self, record):
+        state = self._state(record['question_id'])
+        step = record['step']
+        if step == 'topic_pending':
+            state['topic_pending'] = True
+        elif step == 'topic_created':
+            state['topic_pending'] = False
+            state['topic_id'] = record['topic_id']
+            state['post_id'] = record['post_id']
+        elif step == 'answer_pending':
+            if record['answer_id'] not in state['pending_answers']:
+                state['pending_answers'].append(record['answer_id'])
+        elif step == 'answer_posted':
+            state['answers'][record['answer_id']] = record['post_id']
+            if record['answer_id'] in state['pending_answers']:
+                state['pending_answers'].remove(record['answer_id'])
+        elif step == 'parts_expected':
+            state['parts'][record['content_id']] = record['parts']
+        elif step == 'part_pending':
+            key = f"{record['content_id']}:{record['part']}"
+            if key not in state['pending_parts']:
+                state['pending_parts'].append(key)
+        elif step == 'part_posted':
+            key = f"{record['content_id']}:{record['part']}"
+            state['posted_parts'][key] = record['post_id']
+            if key in state['pending_parts']:
+                state['pending_parts'].remove(key)
+        elif step == 'solution_accepted':
+            if record['post_id'] not in state['solutions']:
+                state['solutions'].append(record['post_id'])
+        elif step == 'completed':
+            state['completed'] = True
+
+    def _append(self, question_id, step, **values):
+        record = {'question_id': str(question_id), 'step': step, **values}
+        with self.lock:
+            self._apply(record)
+            os.makedirs(os.path.dirname(self.journal_file) or '.', exist_ok=True)
+            with open(self.journal_file, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def state(self, question_id):
+        """Get the journaled progress of a question.
+
+        Returns:
+            dict: The question's state, or None if nothing was journaled for it
+        """
+        return self.states.get(str(question_id))
+
+    def topic_pending(self, question_id):
+        """Record that the topic of a question is about to be created."""
+        self._append(question_id, 'topic_pending')
+
+    def topic_created(self, question_id, topic_id, post_id):
+        """Record that the topic of a question was created."""
+        self._append(question_id, 'topic_created', topic_id=topic_id, post_id=post_id)
+
+    def answer_pending(self, question_id, answer_id):
+        """Record that an answer is about to be posted."""
+        self._append(question_id, 'answer_pending', answer_id=str(answer_id))
+
+    def answer_posted(self, question_id, answer_id, post_id):
+        """Record that an answer was posted."""
+        self._append(question_id, 'answer_posted', answer_id=str(answer_id), post_id=post_id)
+
+    def parts_expected(self, question_id, content_id, parts):
+        """Record that a question or answer is posted in several parts, before its first post is written."""
+        self._append(question_id, 'parts_expected', content_id=str(content_id), parts=parts)
+
+    def part_pending(self, question_id, content_id, part):
+        """Record that a continuation post is about to be created."""
+        self._append(question_id, 'part_pending', content_id=str(content_id), part=part)
+
+    def part_posted(self, question_id, content_id, part, post_id):
+        """Record that a continuation post was created."""
+        self._append(question_id, 'part_posted', content_id=str(content_id), part=part, post_id=post_id)
+
+    def missing_parts(self, question_id, content_id):
+        """List the continuation parts of a question or answer that have no journaled post.
+
+        Returns:
+            list: Part numbers from 1, of the parts not posted or only pending
+        """
+        state = self.state(question_id)
+        if not state:
+            return []
+        parts = state['parts'].get(str(content_id), 1)
+        return [part for part in range(1, parts) if f"{content_id}:{part}" not in state['posted_parts']]
+
+    def solution_accepted(self, question_id, post_id):
+        """Record that a post was accepted as the solution."""
+        self._append(question_id, 'solution_accepted', post_id=post_id)
+
+    def adopt(self, journal_file, question_ids):
+        """Take over the unfinished questions of another worker from its journal.
+
+        The other journal is only read, never compacted, as the worker that wrote it
+        may still be running. Questions this journal already knows are left alone.
+
+        Args:
+            journal_file (str): Path of the journal of the other worker
+            question_ids (iterable): The questions to take over
+
+        Returns:
+            int: Number of questions taken over
+        """
+        if not os.path.exists(journal_file):
+            return 0
+        other = MigrationJournal(journal_file)
+        other._states = {}
+        with open(journal_file, 'r') as f:
+            for line in f:
+                try:
+                    other._apply(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+
+        adopted = 0
+        with self.lock:
+            for question_id in {str(question_id) for question_id in question_ids}:
+                state = other._states.get(question_id)
+                if not state or state['completed'] or question_id in self.states:
+                    continue
+                for record in other._records_for(question_id, state):
+                    values = {name: value for name, value in record.items() if name not in ('question_id', 'step')}
+                    self._append(question_id, record['step'], **values)
+                adopted += 1
+        if adopted:
+            logging.info(f"Took over {adopted} partially migrated question(s) from {journal_file}")
+        return adopted
+
+    def completed(self, question_id):
+        """Record that a question was fully migrated."""
+        with self.lock:
+            self._append(question_id, 'completed')
+            self.states.pop(str(question_id), None)
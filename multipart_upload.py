@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from pydiscourse.exceptions import DiscourseClientError
+
+logger = logging.getLogger(__name__)
+
+# Number of part URLs Discourse presigns per request
+PRESIGN_BATCH_SIZE = 10
+
+
+class MultipartUploader:
+    """Uploads large files to Discourse in parts, through its multipart upload flow.
+
+    Discourse creates the upload and presigns a URL of its storage backend for
+    every part; the parts are then sent to those URLs in parallel, and Discourse
+    assembles them when the upload is completed. Only the create, presign and
+    complete calls go to Discourse itself and wait on the write budget.
+
+    The parts that made it are recorded per file, keyed by the SHA-1 of its
+    content, so an upload that failed halfway resumes with the missing parts, in
+    the same run or a later one.
+
+    The flow needs direct uploads to S3 compatible storage enabled on the forum.
+    Without it, creating the first upload fails and every file takes the single
+    request path instead.
+    """
+
+    def __init__(self, client, part_size=8 * 1024 * 1024, workers=4, state_file='target/multipart_uploads.json',
+                 wait_for_write_budget=None, part_retries=3, timeout=120):
+        """Initialize the uploader.
+
+        Args:
+            client (pydiscourse.DiscourseClient): The client of the API user
+            part_size (int): Size of every part but the last in bytes (storage backends require 5 MB or more)
+            workers (int): Number of parts sent at the same time
+            state_file (str): File recording the parts of unfinished uploads
+            wait_for_write_budget (callable, optional): Called before every request to Discourse
+            part_retries (int): Attempts per part before the upload fails
+            timeout (float): Seconds after which sending a part times out
+        """
+        self.client = client
+        self.part_size = part_size
+        self.workers = workers
+        self.state_file = state_file
+        self.wait_for_write_budget = wait_for_write_budget or (lambda: None)
+        self.part_retries = part_retries
+        self.timeout = timeout
+        # Cleared when the forum turns out not to support multipart uploads
+        self.available = True
+        self._uploads = None
+        self.lock = threading.RLock()
+
+    @property
+    def uploads(self):
+        """Unfinished uploads by content checksum, loaded from disk on first use."""
+        with self.lock:
+            if self._uploads is None:
+                self._uploads = {}
+                if os.path.exists(self.state_file):
+                    with open(self.state_file, 'r') as f:
+                        self._uploads = json.load(f)
+            return self._uploads
+
+    def save_uploads(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+            temp_file = f"{self.state_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.uploads, f)
+            os.replace(temp_file, self.state_file)
+
+    def upload(self, filename, content):
+        """Upload a file in parts, resuming an earlier attempt at the same content.
+
+        Args:
+            filename (str): The name of the file
+            content (bytes): The content of the file
+
+        Returns:
+            dict: The upload, as returned by Discourse, or None when the forum does not
+                  support multipart uploads
+
+        Raises:
+            requests.exceptions.RequestException: If the upload fails; the parts sent so far are kept
+        """
+        checksum = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            state = self.uploads.get(checksum)
+        if state and state['part_size'] != self.part_size:
+            state = None
+
+        if state:
+            logger.info("Resuming multipart upload of %s with %d of %d parts sent",
+                        filename, len(state['parts']), self._part_count(content))
+            try:
+                self._send_parts(state, content)
+            except DiscourseClientError as e:
+                # Discourse no longer knows the upload, so it starts over
+                logger.warning("Could not resume the upload of %s, starting over: %s", filename, e)
+                state = None
+
+        if not state:
+            state = self._create(filename, content, checksum)
+            if state is None:
+                return None
+            self._send_parts(state, content)
+
+        upload = self._complete(state)
+        with self.lock:
+            self.uploads.pop(checksum, None)
+            self.save_uploads()
+        logger.info("Uploaded %s in %d parts", filename, len(state['parts']))
+        return upload
+
+    def _part_count(self, content):
+        return max(1, -(-len(content) // self.part_size))
+
+    def _create(self, filename, content, checksum):
+        self.wait_for_write_budget()
+        try:
+            response = self.client._post('/uploads/create-multipart.json', json=True, file_name=filename,
+                                         file_size=len(content), upload_type='composer',
+                                         metadata={'sha1-checksum': checksum})
+        except DiscourseClientError as e:
+            if e.response is not None and e.response.status_code in (403, 404):
+                logger.warning("Multipart uploads are not available on this forum, uploading in one request: %s", e)
+                self.available = False
+                return None
+            raise
+
+        state = {
+            'filename': filename,
+            'size': len(content),
+            'part_size': self.part_size,
+            'unique_identifier': response['unique_identifier'],
+            'external_upload_identifier': response['external_upload_identifier'],
+            'parts': {},
+        }
+        with self.lock:
+            self.uploads[checksum] = state
+            self.save_uploads()
+        return state
+
+    def _send_parts(self, state, content):
+        missing = [number for number in range(1, self._part_count(content) + 1) if str(number) not in state['parts']]
+        if not missing:
+            return
+
+        presigned_urls = {}
+        for index in range(0, len(missing), PRESIGN_BATCH_SIZE):
+            self.wait_for_write_budget()
+            response = self.client._post('/uploads/batch-presign-multipart-parts.json', json=True,
+                                         part_numbers=missing[index:index + PRESIGN_BATCH_SIZE],
+                                         unique_identifier=state['unique_identifier'])
+            presigned_urls.update(response['presigned_urls'])
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='part') as executor:
+            futures = [executor.submit(self._send_part, state, number, presigned_urls[str(number)],
+                                       content[(number - 1) * self.part_size:number * self.part_size])
+                       for number in missing]
+            # Every part is waited for, so the ones that made it are recorded before an error is raised
+            errors = [future.exception() for future in futures]
+        for error in errors:
+            if error:
+                raise error
+
+    def _send_part(self, state, number, url, data):
+        for attempt in range(1, self.part_retries + 1):
+            try:
+                response = requests.put(url, data=data, timeout=self.timeout)
+                response.raise_for_status()
+                break
+            except requests.exceptions.RequestException as e:
+                if attempt == self.part_retries:
+                    raise
+                logger.warning("Part %d of %s failed (attempt %d), retrying: %s", number, state['filename'], attempt, e)
+                time.sleep(2 ** attempt)
+
+        with self.lock:
+            state['parts'][str(number)] = response.headers.get('ETag', '').strip('"')
+            self.save_uploads()
+
+    def _complete(self, state):
+        parts = [{'part_number': int(number), 'etag': etag}
+                 for number, etag in sorted(state['parts'].items(), key=lambda item: int(item[0]))]
+        self.wait_for_write_budget()
+        return self.client._post('/uploads/complete-multipart.json', json=True,
+                                 unique_identifier=state['unique_identifier'], parts=parts)
@@ -0,0 +1,31 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch_pages(fetch_page, workers=8, first_page=0):
+    """Fetch numbered pages concurrently and yield them in order.
+
+    A window of pages is kept in flight; every page that is not the last one
+    makes room for the next page number. At most workers - 1 pages past the
+    end are requested and their results are discarded.
+
+    Args:
+        fetch_page (callable): Takes a page number and returns (items, is_last_page)
+        workers (int): Number of pages requested at the same time
+        first_page (int): Number of the first page
+
+    Yields:
+        list: The items of each page, in page order
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page') as executor:
+        pending = deque(executor.submit(fetch_page, page) for page in range(first_page, first_page + workers))
+        next_page = first_page + workers
+        while pending:
+            items, is_last_page = pending.popleft().result()
+            yield items
+            if is_last_page:
+                for future in pending:
+                    future.cancel()
+                return
+            pending.append(executor.submit(fetch_page, next_page))
+            next_page += 1
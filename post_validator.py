@@ -0,0 +1,240 @@
+import logging
+import os
+import threading
+
+from pydiscourse.exceptions import DiscourseError
+
+logger = logging.getLogger(__name__)
+
+# Discourse defaults, used when the site settings cannot be read
+DEFAULT_LIMITS = {
+    'max_post_length': 32000,
+    'min_topic_title_length': 15,
+    'max_topic_title_length': 255,
+    'max_tags_per_topic': 5,
+    'max_tag_length': 20,
+    'allow_duplicate_topic_titles': False,
+}
+
+CONTINUATION_HEADER = "<small>_(continued)_</small>\n\n"
+
+# Places to split an oversized post at, best first
+SPLIT_SEPARATORS = ('\n\n', '</table>', '</pre>', '</p>', '</div>', '\n', ' ')
+
+
+def normalize_title(title):
+    """Normalize a title the way Discourse compares titles for duplicates."""
+    return ' '.join(title.lower().split())
+
+
+def split_content(content, max_length):
+    """Split content into parts of at most max_length characters.
+
+    Parts end at a paragraph, block or line boundary where one falls in the second
+    half of the part, and code fences that a split would cut are closed and reopened.
+
+    Returns:
+        list: The parts, in order
+    """
+    parts = []
+    while len(content) > max_length:
+        window = content[:max_length - 4]
+        cut = len(window)
+        for separator in SPLIT_SEPARATORS:
+            index = window.rfind(separator)
+            if index > len(window) // 2:
+                cut = index + len(separator)
+                break
+        part, content = content[:cut].rstrip(), content[cut:].lstrip()
+        if part.count('```') % 2:
+            part += '\n```'
+            content = '```\n' + content
+        parts.append(part)
+    parts.append(content)
+    return parts
+
+
+class PostValidator:
+    """Checks topics and posts against the limits of the forum before they are written.
+
+    Discourse rejects posts longer than max_post_length, titles that are too short,
+    too long or already used, and topics with too many tags. These are checked
+    before the attachments of a question are uploaded, so a topic Discourse would
+    refuse costs neither uploads nor a write: titles are lengthened, shortened and
+    numbered to be unique, tags are cut to the allowed number and length, and
+    bodies over the post length are split into continuation posts.
+
+    The limits are read from the site settings once. The titles of topics are kept
+    in a file with the question they were given to, seeded from the topics of the
+    forum on first use, so titles stay unique across runs while a question that is
+    retried keeps its title. Workers of a sharded migration also claim their titles
+    in the shared state, so two shards never give the same title to two topics.
+    """
+
+    def __init__(self, discourse_client, titles_file='target/topic_titles.txt', margin=500, dry_run=False,
+                 shared_titles=None):
+        """Initialize the validator.
+
+        Args:
+            discourse_client (DiscourseClient): The client to read the site settings and topics with
+            titles_file (str): File holding the normalized titles in use and their questions, one per line
+            margin (int): Characters of the post length left for markers added after the split
+            dry_run (bool): Keep titles in memory only
+            shared_titles (ShardCoordinator, optional): Shared state to claim titles in across workers
+        """
+        self.discourse_client = discourse_client
+        self.titles_file = titles_file
+        self.margin = margin
+        self.dry_run = dry_run
+        self.shared_titles = shared_titles
+        self._limits = None
+        self._titles = None
+        self.lock = threading.RLock()
+
+    @property
+    def limits(self):
+        """The limits of the forum, read from its site settings on first use."""
+        with self.lock:
+            if self._limits is None:
+                self._limits = dict(DEFAULT_LIMITS)
+                try:
+                    settings = self.discourse_client.get_site_settings(DEFAULT_LIMITS)
+                except (DiscourseError, ValueError) as e:
+                    logger.warning("Could not read the site settings, assuming the Discourse defaults: %s", e)
+                    settings = {}
+                for name, value in settings.items():
+                    default = DEFAULT_LIMITS[name]
+                    self._limits[name] = str(value).lower() == 'true' if isinstance(default, bool) else int(value)
+                logger.info("Discourse limits: %s", self._limits)
+            return self._limits
+
+    @property
+    def titles(self):
+        """Question ID by normalized title in use (empty for other topics), loaded on first use."""
+        with self.lock:
+            if self._titles is None:
+                self._titles = self._load_titles()
+            return self._titles
+
+    def _load_titles(self):
+        if os.path.exists(self.titles_file):
+            titles = {}
+            with open(self.titles_file, 'r') as f:
+                for line in f:
+                    question_id, _, title = line.rstrip('\n').partition('\t')
+                    if title:
+                        titles[title] = question_id
+            return titles
+
+        logger.info("Loading the titles of the forum's topics...")
+        titles = {normalize_title(topic['title']): '' for topic in self.discourse_client.iter_topics()
+                  if topic.get('title')}
+        if not self.dry_run:
+            os.makedirs(os.path.dirname(self.titles_file) or '.', exist_ok=True)
+            temp_file = f"{self.titles_file}.tmp"
+            with open(temp_file, 'w') as f:
+                f.writelines(f"\t{title}\n" for title in sorted(titles))
+            os.replace(temp_file, self.titles_file)
+        logger.info("Loaded %d topic titles", len(titles))
+        return titles
+
+    def question_titles(self):
+        """Get the titles given to the topics of questions, by question ID.
+
+        Returns:
+            dict: The normalized title of each question that got one; empty if no titles were kept yet
+        """
+        with self.lock:
+            if self._titles is None and not os.path.exists(self.titles_file):
+                return {}
+            return {question_id: title for title, question_id in self.titles.items() if question_id}
+
+    def validate_title(self, title, question_id):
+        """Fit a title to the title length limits and make it unique.
+
+        Args:
+            title (str): The title of the question
+            question_id (str): The ID of the question, which may reuse the title it was given before
+
+        Returns:
+            str: The title to create the topic with
+        """
+        limits = self.limits
+        title = ' '.join(title.split())
+        if len(title) < limits['min_topic_title_length']:
+            title = f"{title} (migrated question)"
+        # Leave room for a number that makes the title unique
+        max_length = limits['max_topic_title_length'] - 6
+        if len(title) > max_length:
+            title = title[:max_length - 1].rsplit(' ', 1)[0].rstrip(' ,.;:-') + '…'
+
+        if limits['allow_duplicate_topic_titles']:
+            return title
+        question_id = str(question_id)
+        with self.lock:
+            unique_title = title
+            number = 1
+            while not self._title_available(unique_title, question_id):
+                number += 1
+                unique_title = f"{title} ({number})"
+            if unique_title != title:
+                logger.info("Title '%s' is taken, using '%s'", title, unique_title)
+            if normalize_title(unique_title) not in self.titles:
+                self._remember_title(unique_title, question_id)
+        return unique_title
+
+    def _title_available(self, title, question_id):
+        normalized = normalize_title(title)
+        if self.titles.get(normalized, question_id) != question_id:
+            return False
+        if self.shared_titles is None or self.dry_run:
+            return True
+        # Claimed by the first worker to ask; a question claiming its own title again keeps it
+        return self.shared_titles.claim_title(normalized, question_id) == question_id
+
+    def _remember_title(self, title, question_id):
+        normalized = normalize_title(title)
+        self.titles[normalized] = question_id
+        if not self.dry_run:
+            os.makedirs(os.path.dirname(self.titles_file) or '.', exist_ok=True)
+            with open(self.titles_file, 'a') as f:
+                f.write(f"{question_id}\t{normalized}\n")
+
+    def validate_tags(self, tags, required=()):
+        """Fit tags to the tag length and count limits of the forum.
+
+        Args:
+            tags (List[str]): The cleaned tags of the topic
+            required (iterable): Tags kept before any other when there are too many
+
+        Returns:
+            List[str]: The tags to create the topic with, without duplicates
+        """
+        limits = self.limits
+        fitted = {}
+        for tag in tags:
+            name = tag[:limits['max_tag_length']]
+            if name in fitted and fitted[name] != tag:
+                logger.warning("Tags '%s' and '%s' both become '%s', keeping one", fitted[name], tag, name)
+            fitted.setdefault(name, tag)
+
+        required = [tag[:limits['max_tag_length']] for tag in required]
+        names = [name for name in required if name in fitted]
+        names += [name for name in fitted if name not in names]
+        if len(names) > limits['max_tags_per_topic']:
+            logger.warning("Dropping tags %s, the forum allows %d per topic",
+                           names[limits['max_tags_per_topic']:], limits['max_tags_per_topic'])
+        return names[:limits['max_tags_per_topic']]
+
+    def split_post(self, content):
+        """Split the content of a post into the post and its continuation posts.
+
+        Returns:
+            list: The content of the post followed by that of its continuations
+        """
+        max_length = self.limits['max_post_length'] - self.margin
+        if len(content) <= max_length:
+            return [content]
+        parts = split_content(content, max_length - len(CONTINUATION_HEADER))
+        logger.info("Splitting a post of %d characters into %d posts", len(content), len(parts))
+        return [parts[0]] + [CONTINUATION_HEADER + part for part in parts[1:]]
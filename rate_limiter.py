@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket limiting how many calls are made per minute.
+
+    Each worker owns its own limiter, so every worker keeps to its own rate budget
+    regardless of how many workers are running.
+    """
+
+    def __init__(self, calls_per_minute, burst=None):
+        """Initialize the rate limiter.
+
+        Args:
+            calls_per_minute (float): Sustained number of calls allowed per minute
+            burst (int, optional): Number of calls that may be made back to back (defaults to 1)
+        """
+        self.rate = calls_per_minute / 60.0
+        self.capacity = burst or 1
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # Calls made and seconds spent waiting for a token, which tell how saturated the budget is
+        self.calls = 0
+        self.waited = 0.0
+
+    @property
+    def calls_per_minute(self):
+        return self.rate * 60.0
+
+    def set_rate(self, calls_per_minute):
+        """Change the sustained rate, e.g. when the budget is tuned during a run."""
+        with self.lock:
+            self.rate = calls_per_minute / 60.0
+
+    def acquire(self):
+        """Block until a call may be made, then consume one token."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from paging import fetch_pages
+
+logger = logging.getLogger(__name__)
+
+
+def title_hash(title):
+    """Hash a title the way both sides can agree on, ignoring case, spacing and punctuation."""
+    normalized = re.sub(r'[\W_]+', ' ', title or '').strip().lower()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+class Reconciler:
+    """Checks that every Confluence question arrived complete in Discourse.
+
+    Both sides are listed concurrently with parallel paging: the Confluence
+    question listing and the topics of the migrated categories. Each listing is
+    cached as a snapshot, so a repeated check within the snapshot age makes no
+    requests. Per question, a digest of the answer count, the accepted flag and the
+    title hash is compared with the digest of its topic, and the differences are
+    written to a report. Continuation posts of split bodies are not counted as
+    answers, and a title the forum's limits made us change is compared as it was
+    given. The IDs of questions without a topic are written to a file that
+    --question-ids can migrate again.
+    """
+
+    def __init__(self, questions_fetcher, discourse_client, link_index, retry_queue,
+                 snapshot_dir='target/reconcile', workers=8, snapshot_max_age=3600, write_behind=None,
+                 post_validator=None):
+        """Initialize the reconciler.
+
+        Args:
+            questions_fetcher (ConfluenceQuestionsFetcher): Lists the Confluence questions
+            discourse_client (DiscourseClient): Lists the Discourse topics
+            link_index (LinkIndex): The topic each question was migrated to
+            retry_queue (RetryQueue): Holds the uploads that have not succeeded yet
+            snapshot_dir (str): Directory holding the snapshots and the report
+            workers (int): Number of pages fetched at the same time on each side
+            snapshot_max_age (float): Seconds a snapshot is reused for; 0 always refreshes
+            write_behind (WriteBehindQueue, optional): Holds the solutions and edits not flushed yet
+            post_validator (PostValidator, optional): Holds the titles the topics were given
+        """
+        self.questions_fetcher = questions_fetcher
+        self.discourse_client = discourse_client
+        self.link_index = link_index
+        self.retry_queue = retry_queue
+        self.snapshot_dir = snapshot_dir
+        self.workers = workers
+        self.snapshot_max_age = snapshot_max_age
+        self.write_behind = write_behind
+        self.post_validator = post_validator
+
+    def reconcile(self, space_key=None):
+        """Compare both sides and write the report.
+
+        Args:
+            space_key (str, optional): The Confluence space key that was migrated
+
+        Returns:
+            dict: The report
+        """
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='reconcile') as executor:
+            confluence = executor.submit(self._snapshot, 'confluence', lambda: self.list_questions(space_key))
+            discourse = executor.submit(self._snapshot, 'discourse', self.list_topics)
+            questions, topics = confluence.result(), discourse.result()
+
+        report = self.compare(questions, topics)
+        self._write_report(report)
+        return report
+
+    def list_questions(self, space_key=None, batch_size=50):
+        """List the digests of all Confluence questions.
+
+        Returns:
+            list: One digest per question
+        """
+        def fetch_page(page):
+            batch = list(self.questions_fetcher.iter_questions(space_key, limit=batch_size, start=page * batch_size))
+            return batch, len(batch) < batch_size
+
+        digests = []
+        for batch in fetch_pages(fetch_page, self.workers):
+            for question in batch:
+                accepted = question.get('acceptedAnswerId')
+                digests.append({
+                    'id': str(question['id']),
+                    'title': question['title'],
+                    'answers': question.get('answersCount', 0),
+                    # Not every version of the listing tells whether an answer was accepted
+                    'accepted': None if 'acceptedAnswerId' not in question else accepted is not None,
+                    'hash': title_hash(question['title']),
+                })
+        return digests
+
+    def list_topics(self):
+        """List the digests of the topics in the categories questions are migrated to.
+
+        Returns:
+            list: One digest per topic
+        """
+        digests = {}
+        # Looked up without creating the categories that are missing, which hold no topics to compare
+        for category_id, category_slug in self.discourse_client.category_manager.find_categories().values():
+            for topics in self.discourse_client.iter_topic_pages(category_id, category_slug, self.workers):
+                for topic in topics:
+                    digests[topic['id']] = {
+                        'id': topic['id'],
+                        'title': topic['title'],
+                        'answers': max(0, topic.get('posts_count', 1) - 1),
+                        'accepted': bool(topic.get('has_accepted_answer')),
+                        'hash': title_hash(topic['title']),
+                        'migrated': 'migrated_question' in (topic.get('tags') or []),
+                    }
+        return list(digests.values())
+
+    def compare(self, questions, topics):
+        """Compare the question digests with the topic digests.
+
+        Questions are matched to topics through the link index, and by title hash
+        for questions migrated before the index existed.
+
+        Returns:
+            dict: The report
+        """
+        topics_by_id = {topic['id']: topic for topic in topics}
+        topics_by_hash = {}
+        for topic in topics:
+            topics_by_hash.setdefault(topic['hash'], topic)
+
+        # Uploads are queued under the question or answer they belong to, and counted per question
+        pending_uploads = {}
+        for entry in self.retry_queue.entries.values():
+            if entry['kind'] == 'upload':
+                question_id = self.link_index.question_of(entry['payload'].get('content_id'))
+                pending_uploads[question_id] = pending_uploads.get(question_id, 0) + 1
+
+        # Titles that had to be changed for the forum are compared as they were given
+        given_titles = self.post_validator.question_titles() if self.post_validator else {}
+
+        differences = {'missing': [], 'answers': [], 'accepted': [], 'title': [], 'attachments': []}
+        matched_topics = set()
+        for question in questions:
+            expected_hash = title_hash(given_titles[question['id']]) if question['id'] in given_titles else question['hash']
+            topic_id = self.link_index.topics.get(question['id'])
+            topic = topics_by_id.get(topic_id) if topic_id else topics_by_hash.get(expected_hash)
+            if topic is None:
+                differences['missing'].append({'question_id': question['id'], 'title': question['title']})
+                continue
+
+            matched_topics.add(topic['id'])
+            entry = {'question_id': question['id'], 'topic_id': topic['id'], 'title': question['title']}
+            answers = topic['answers'] - self.link_index.continuations.get(question['id'], 0)
+            if answers != question['answers']:
+                differences['answers'].append({**entry, 'confluence': question['answers'], 'discourse': answers})
+            if question['accepted'] is not None and topic['accepted'] != question['accepted']:
+                differences['accepted'].append({**entry, 'confluence': question['accepted'], 'discourse': topic['accepted']})
+            if topic['hash'] != expected_hash:
+                differences['title'].append({**entry, 'discourse_title': topic['title']})
+            if question['id'] in pending_uploads:
+                differences['attachments'].append({**entry, 'pending_uploads': pending_uploads[question['id']]})
+
+        unmatched = [{'topic_id': topic['id'], 'title': topic['title']} for topic in topics
+                     if topic['migrated'] and topic['id'] not in matched_topics]
+
+        return {
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'summary': {
+                'questions': len(questions),
+                'topics': len(topics),
+                'complete': len(questions) - len({entry['question_id'] for entries in differences.values()
+                                                  for entry in entries}),
+                **{kind: len(entries) for kind, entries in differences.items()},
+                'unmatched_topics': len(unmatched),
+                'pending_uploads': sum(pending_uploads.values()),
+                'pending_writes': self.write_behind.summary()['pending'] if self.write_behind else {},
+            },
+            'differences': differences,
+            'unmatched_topics': unmatched,
+        }
+
+    def _snapshot(self, side, fetch):
+        snapshot_file = os.path.join(self.snapshot_dir, f"{side}_snapshot.json")
+        if os.path.exists(snapshot_file) and time.time() - os.path.getmtime(snapshot_file) < self.snapshot_max_age:
+            with open(snapshot_file, 'r') as f:
+                items = json.load(f)
+            logger.info("Using the cached %s snapshot with %d entries", side, len(items))
+            return items
+
+        started = time.monotonic()
+        items = fetch()
+        logger.info("Listed %d %s entries in %.1fs", len(items), side, time.monotonic() - started)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        temp_file = f"{snapshot_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(items, f)
+        os.replace(temp_file, snapshot_file)
+        return items
+
+    def _write_report(self, report):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        report_file = os.path.join(self.snapshot_dir, 'report.json')
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        # Questions without a topic can be migrated again with --question-ids
+        missing_file = os.path.join(self.snapshot_dir, 'missing_question_ids.txt')
+        with open(missing_file, 'w') as f:
+            for entry in report['differences']['missing']:
+                f.write(f"{entry['question_id']}\n")
+
+        logger.info("Reconciliation: %s", report['summary'])
+        logger.info("Report written to %s, questions to migrate again in %s", report_file, missing_file)
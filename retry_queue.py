@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from pydiscourse.exceptions import DiscourseClientError, DiscourseRateLimitedError, DiscourseServerError
+
+
+def is_transient(error):
+    """Check whether a failure is likely to go away when the work is retried.
+
+    Args:
+        error (Exception): The error that made the work fail
+
+    Returns:
+        bool: True for server errors, rate limiting, timeouts and connection problems
+    """
+    if isinstance(error, (DiscourseServerError, DiscourseRateLimitedError)):
+        return True
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is not None:
+        return status_code >= 500 or status_code == 429
+    # A client error without a response is a rejected request, not a hiccup
+    return not isinstance(error, DiscourseClientError)
+
+
+class RetryQueue:
+    """Durable dead-letter store for units of work that failed during a migration.
+
+    Each entry records the kind of work ('question', 'answers', 'solution' or
+    'upload'), what is needed to redo it and the class of the error. Transient
+    failures are retried with exponential backoff by a dedicated retry pass;
+    permanent failures and entries that ran out of attempts stay in the store for
+    inspection.
+    """
+
+    def __init__(self, queue_file='target/retry_queue.json', base_delay=30, max_delay=3600, max_attempts=8):
+        """Initialize the retry queue.
+
+        Args:
+            queue_file (str): Path of the JSON file holding the queue
+            base_delay (float): Seconds to wait before the first retry
+            max_delay (float): Upper bound of the wait between retries in seconds
+            max_attempts (int): Failed attempts after which an entry is no longer retried
+        """
+        self.queue_file = queue_file
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._entries = None
+        self.lock = threading.RLock()
+
+    @property
+    def entries(self):
+        """The queued entries by key, loaded from disk on first use."""
+        if self._entries is None:
+            self._entries = self.load_queue()
+        return self._entries
+
+    def load_queue(self):
+        if os.path.exists(self.queue_file):
+            with open(self.queue_file, 'r') as f:
+                return {entry['key']: entry for entry in json.load(f)}
+        return {}
+
+    def save_queue(self):
+        with self.lock:
+            self._save_queue()
+
+    def _save_queue(self):
+        os.makedirs(os.path.dirname(self.queue_file) or '.', exist_ok=True)
+        temp_file = f"{self.queue_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(list(self.entries.values()), f, indent=2)
+        os.replace(temp_file, self.queue_file)
+
+    def record(self, kind, key, payload, error):
+        """Record a failed unit of work, or another failed attempt of a known one.
+
+        Args:
+            kind (str): The kind of work
+            key (str): Unique key of the unit of work
+            payload (dict): Everything needed to redo the work
+            error (Exception): The error that made the work fail
+        """
+        with self.lock:
+            entry = self.entries.get(key, {'key': key, 'kind': kind, 'attempts': 0, 'first_failed_at': time.time()})
+            entry['attempts'] += 1
+            entry['payload'] = {**entry.get('payload', {}), **payload}
+            entry['error_class'] = type(error).__name__
+            entry['error'] = str(error)
+            entry['transient'] = is_transient(error)
+            delay = min(self.max_delay, self.base_delay * 2 ** (entry['attempts'] - 1))
+            entry['next_attempt_at'] = time.time() + delay
+            self.entries[key] = entry
+            self.save_queue()
+        logging.warning(f"Queued {kind} {key} for retry after {entry['error_class']} "
+                        f"(attempt {entry['attempts']}, transient: {entry['transient']})")
+
+    def bind_post(self, content_id, post_id, content=None):
+        """Attach the Discourse post holding some content to its queued upload failures.
+
+        Content split over several posts is bound post by post, so each failure is
+        patched into the post that holds its placeholder.
+
+        Args:
+            content_id (str): The Confluence question or answer ID
+            post_id (int): The ID of the Discourse post created from that content
+            content (str, optional): The raw content of the post; only the failures whose
+                                     placeholder it contains are bound when given
+        """
+        with self.lock:
+            changed = False
+            for entry in self.entries.values():
+                if entry['kind'] != 'upload' or str(entry['payload'].get('content_id')) != str(content_id):
+                    continue
+                if content is None or entry['payload']['placeholder'] in content:
+                    entry['payload']['post_id'] = post_id
+                    changed = True
+            if changed:
+                self.save_queue()
+
+    def resolve(self, key):
+        """Remove an entry whose work has succeeded."""
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.save_queue()
+
+    def due(self, include_permanent=False):
+        """Get the entries that should be retried now.
+
+        Args:
+            include_permanent (bool): Also retry entries whose error was not transient
+
+        Returns:
+            list: Entries in the order they first failed
+        """
+        now = time.time()
+        entries = [
+            entry for entry in self.entries.values()
+            if (entry['transient'] or include_permanent)
+            and entry['attempts'] < self.max_attempts
+            and entry['next_attempt_at'] <= now
+        ]
+        return sorted(entries, key=lambda entry: entry['first_failed_at'])
+
+    def next_due_at(self, include_permanent=False):
+        """Get the time the next retryable entry becomes due.
+
+        Returns:
+            float: A timestamp, or None if nothing is left to retry
+        """
+        times = [
+            entry['next_attempt_at'] for entry in self.entries.values()
+            if (entry['transient'] or include_permanent) and entry['attempts'] < self.max_attempts
+        ]
+        return min(times) if times else None
+
+    def summary(self):
+        """Count the entries per kind.
+
+        Returns:
+            dict: Number of entries per kind
+        """
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry['kind']] = counts.get(entry['kind'], 0) + 1
+        return counts
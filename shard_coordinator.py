@@ -0,0 +1,352 @@
+import csv
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from migration_checkpoint import INDEX_FIELDS
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class ShardCoordinator:
+    """Coordinates several migration workers through a shared SQLite database.
+
+    The first worker to start enumerates the questions once and splits them into
+    shards, either by date window or by a hash of the question ID. Workers then claim
+    shards one at a time. A whole question (topic, answers and solution) is always
+    handled by the worker that claimed its shard, so the writes of a topic stay in
+    order. The database runs in WAL mode, which lets workers read while another one
+    writes. WAL relies on memory shared between the processes, so all workers must
+    run on the same host, and the database must not be on a network filesystem.
+
+    While a worker holds a shard, a background thread renews its lease, so a
+    question that takes longer than the lease does not let another worker claim
+    the shard and migrate its questions a second time.
+    """
+
+    def __init__(self, db_path, worker_id, lease_seconds=600):
+        """Initialize the coordinator.
+
+        Args:
+            db_path (str): Path of the shared SQLite database
+            worker_id (str): Unique name of this worker
+            lease_seconds (int): Seconds without a heartbeat after which a claimed shard
+                                 is handed to another worker
+        """
+        self.db_path = db_path
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+        self.heartbeat_thread = None
+        self.stop_event = threading.Event()
+        # Set when another worker took over the shard being held
+        self.lease_lost = threading.Event()
+        # Worker whose expired lease the last claimed shard was taken from
+        self.taken_over_from = None
+
+    def _create_tables(self):
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS questions (
+                id TEXT PRIMARY KEY,
+                date_asked INTEGER NOT NULL,
+                shard TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS questions_shard ON questions (shard, date_asked);
+            CREATE TABLE IF NOT EXISTS shards (
+                shard TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                heartbeat REAL
+            );
+            CREATE TABLE IF NOT EXISTS migrated (
+                question_id TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS users (
+                full_name TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                email TEXT
+            );
+            CREATE TABLE IF NOT EXISTS exported (
+                file TEXT PRIMARY KEY,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS titles (
+                title TEXT PRIMARY KEY,
+                question_id TEXT NOT NULL
+            );
+        ''')
+        # Databases created before emails were shared lack the column
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(users)')}
+        if 'email' not in columns:
+            self.conn.execute('ALTER TABLE users ADD COLUMN email TEXT')
+
+    def ensure_plan(self, fetch_questions, mode='date', shard_count=8, window_days=30):
+        """Split the questions into shards, unless another worker already did.
+
+        Args:
+            fetch_questions (callable): Returns the full list of questions to migrate
+            mode (str): 'date' to shard by date window, 'hash' to shard by question ID
+            shard_count (int): Number of shards in hash mode
+            window_days (int): Width of a shard in days in date mode
+
+        Returns:
+            int: Number of shards in the plan
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            planned = self.conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+            if not planned:
+                questions = fetch_questions()
+                rows = []
+                for question in questions:
+                    shard = self._shard_key(question, mode, shard_count, window_days)
+                    record = {field: question[field] for field in INDEX_FIELDS if field in question}
+                    rows.append((str(question['id']), question['dateAsked'], shard, json.dumps(record)))
+                self.conn.executemany('INSERT OR IGNORE INTO questions VALUES (?, ?, ?, ?)', rows)
+                self.conn.executemany('INSERT OR IGNORE INTO shards (shard) VALUES (?)',
+                                      sorted({(row[2],) for row in rows}))
+                planned = self.conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+                logging.info(f"Planned {planned} {mode} shards for {len(rows)} questions")
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return planned
+
+    def _shard_key(self, question, mode, shard_count, window_days):
+        if mode == 'hash':
+            # Question IDs are numeric; fall back to a stable string hash otherwise
+            try:
+                bucket = int(question['id']) % shard_count
+            except (TypeError, ValueError):
+                bucket = sum(str(question['id']).encode()) % shard_count
+            return f"hash:{bucket:04d}/{shard_count}"
+        window_ms = window_days * DAY_MS
+        window_start = question['dateAsked'] // window_ms * window_ms
+        return "date:" + time.strftime('%Y-%m-%d', time.gmtime(window_start / 1000))
+
+    def claim_shard(self):
+        """Claim the oldest shard that is pending or whose lease has expired.
+
+        When the shard is taken from another worker, that worker is kept in
+        taken_over_from, so its journal of the shard's questions can be taken over.
+
+        Returns:
+            str: The claimed shard key, or None when no work is left
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute(
+                "SELECT shard, worker_id FROM shards WHERE status = 'pending' "
+                "OR (status = 'claimed' AND heartbeat < ?) ORDER BY shard LIMIT 1",
+                (time.time() - self.lease_seconds,)
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE shards SET status = 'claimed', worker_id = ?, heartbeat = ? WHERE shard = ?",
+                    (self.worker_id, time.time(), row[0])
+                )
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.taken_over_from = row[1] if row and row[1] != self.worker_id else None
+        return row[0] if row else None
+
+    def shard_questions(self, shard):
+        """Get the questions of a shard, oldest first.
+
+        Args:
+            shard (str): The shard key
+
+        Returns:
+            list: Question records
+        """
+        rows = self.conn.execute(
+            'SELECT data FROM questions WHERE shard = ? ORDER BY date_asked', (shard,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def heartbeat(self, shard, conn=None):
+        """Extend the lease on a claimed shard.
+
+        Returns:
+            bool: False if the shard is no longer held by this worker
+        """
+        cursor = (conn or self.conn).execute(
+            "UPDATE shards SET heartbeat = ? WHERE shard = ? AND worker_id = ? AND status = 'claimed'",
+            (time.time(), shard, self.worker_id))
+        return cursor.rowcount > 0
+
+    def start_heartbeat(self, shard, interval=None):
+        """Renew the lease on a shard from a background thread until stop_heartbeat() is called.
+
+        Args:
+            shard (str): The claimed shard
+            interval (float, optional): Seconds between two heartbeats; a third of the lease by default
+        """
+        self.stop_heartbeat()
+        interval = interval or self.lease_seconds / 3
+
+        def run():
+            # SQLite connections belong to the thread that opened them
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            try:
+                while not self.stop_event.wait(interval):
+                    if not self.heartbeat(shard, conn):
+                        logging.error(f"Worker {self.worker_id} lost its lease on shard {shard}")
+                        self.lease_lost.set()
+                        return
+            finally:
+                conn.close()
+
+        self.stop_event.clear()
+        self.lease_lost.clear()
+        self.heartbeat_thread = threading.Thread(target=run, name='shard-heartbeat', daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        if self.heartbeat_thread is not None:
+            self.stop_event.set()
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+
+    def complete_shard(self, shard):
+        """Mark a shard as fully processed."""
+        self.conn.execute("UPDATE shards SET status = 'done', heartbeat = ? WHERE shard = ? AND worker_id = ?",
+                          (time.time(), shard, self.worker_id))
+
+    def is_migrated(self, question_id):
+        """Check whether any worker has migrated a question."""
+        row = self.conn.execute('SELECT 1 FROM migrated WHERE question_id = ?', (str(question_id),)).fetchone()
+        return row is not None
+
+    def record_migrated(self, question_id):
+        """Record that this worker migrated a question."""
+        self.conn.execute('INSERT OR IGNORE INTO migrated VALUES (?, ?)', (str(question_id), self.worker_id))
+
+    def claim_title(self, title, question_id):
+        """Claim a normalized topic title for a question, unless another question holds it.
+
+        Args:
+            title (str): The normalized title
+            question_id (str): The question that wants the title
+
+        Returns:
+            str: The ID of the question holding the title, which is question_id if the claim succeeded
+        """
+        self.conn.execute('INSERT OR IGNORE INTO titles VALUES (?, ?)', (title, str(question_id)))
+        return self.conn.execute('SELECT question_id FROM titles WHERE title = ?', (title,)).fetchone()[0]
+
+    def merge_users(self, user_registry):
+        """Merge the users registered by this worker into the shared user table.
+
+        Args:
+            user_registry (UserRegistry): The registry of this worker
+        """
+        rows = [(full_name, username, user_registry.get_email(username))
+                for full_name, username in user_registry.get_all_users().items()
+                if full_name and username and isinstance(username, str)]
+        self.conn.executemany('INSERT INTO users (full_name, username, email) VALUES (?, ?, ?) '
+                              'ON CONFLICT (full_name) DO UPDATE SET email = COALESCE(users.email, excluded.email)',
+                              rows)
+
+    def export_state(self, migrated_questions_file, registry_file, link_index_file=None):
+        """Merge the shared state of all workers into the regular state files.
+
+        Entries already present in the files are kept, so the export can be run at
+        any time and as often as needed. The files are written to a temporary file
+        that replaces them, so a reader never sees them half written.
+
+        Args:
+            migrated_questions_file (str): Path of the migrated questions JSON file
+            registry_file (str): Path of the user registry CSV file
+            link_index_file (str, optional): Path of the link index, which the link indexes
+                                             of the workers are appended to
+        """
+        migrated = []
+        if os.path.exists(migrated_questions_file):
+            with open(migrated_questions_file, 'r') as f:
+                migrated = json.load(f)
+        known = {str(question_id) for question_id in migrated}
+        for (question_id,) in self.conn.execute('SELECT question_id FROM migrated ORDER BY question_id'):
+            if question_id not in known:
+                migrated.append(int(question_id) if question_id.isdigit() else question_id)
+                known.add(question_id)
+        temp_file = f"{migrated_questions_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(migrated, f)
+        os.replace(temp_file, migrated_questions_file)
+
+        users = {}
+        if os.path.exists(registry_file):
+            with open(registry_file, 'r', newline='') as f:
+                for row in csv.DictReader(f):
+                    users[row['FullName']] = {'FullName': row['FullName'], 'username': row['username'],
+                                              'email': row.get('email') or ''}
+        for full_name, username, email in self.conn.execute('SELECT full_name, username, email FROM users'):
+            user = users.setdefault(full_name, {'FullName': full_name, 'username': username, 'email': ''})
+            if not user['email'] and user['username'] == username:
+                user['email'] = email or ''
+        temp_file = f"{registry_file}.tmp"
+        with open(temp_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['FullName', 'username', 'email'])
+            writer.writeheader()
+            writer.writerows(users.values())
+        os.replace(temp_file, registry_file)
+
+        if link_index_file:
+            self._export_link_indexes(link_index_file)
+
+        logging.info(f"Exported {len(migrated)} migrated questions and {len(users)} users")
+
+    def _export_link_indexes(self, link_index_file):
+        """Append what the workers added to their link indexes since the last export.
+
+        The indexes are append-only, so the part of each that was exported already is
+        remembered by its length and only the records after it are copied.
+        """
+        root, extension = os.path.splitext(link_index_file)
+        exported = dict(self.conn.execute('SELECT file, length FROM exported'))
+        tails = {}
+        for worker_file in sorted(glob.glob(f"{glob.escape(root)}_*{extension}")):
+            with open(worker_file, 'rb') as f:
+                f.seek(exported.get(worker_file, 0))
+                tail = f.read()
+            # A record the worker is still writing is left for the next export
+            tail = tail[:tail.rfind(b'\n') + 1]
+            if tail:
+                tails[worker_file] = tail
+        if not tails:
+            return
+
+        temp_file = f"{link_index_file}.tmp"
+        with open(temp_file, 'wb') as f:
+            if os.path.exists(link_index_file):
+                with open(link_index_file, 'rb') as existing:
+                    content = existing.read()
+                # Drop a record cut short by a crash, which would swallow the next line
+                f.write(content[:content.rfind(b'\n') + 1])
+            for tail in tails.values():
+                f.write(tail)
+        os.replace(temp_file, link_index_file)
+        self.conn.executemany('INSERT INTO exported VALUES (?, ?) ON CONFLICT (file) DO UPDATE SET length = excluded.length',
+                              [(worker_file, exported.get(worker_file, 0) + len(tail)) for worker_file, tail in tails.items()])
+        logging.info(f"Exported the link indexes of {len(tails)} workers into {link_index_file}")
+
+    def progress(self):
+        """Get the number of shards in each status.
+
+        Returns:
+            dict: Shard count per status
+        """
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM shards GROUP BY status').fetchall())
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_migrator(tmp_path, monkeypatch):
+    """Build QuestionMigrators in a scratch directory, against servers that are never reached."""
+    monkeypatch.chdir(tmp_path)
+    for name, value in (('CONFLUENCE_URL', 'http://127.0.0.1:9'), ('CONFLUENCE_USERNAME', 'user'),
+                        ('CONFLUENCE_PASSWORD', 'password'), ('DISCOURSE_URL', 'http://127.0.0.1:9'),
+                        ('DISCOURSE_API_KEY', 'key'), ('DISCOURSE_API_USERNAME', 'system')):
+        monkeypatch.setenv(name, value)
+    # Optional features are turned on by the tests that need them
+    for name in ('ASYNC_PUBLISHER', 'WRITE_BEHIND', 'POST_AS_AUTHOR', 'DISCOURSE_API_CREDENTIALS', 'OPTIMIZE_IMAGES'):
+        monkeypatch.delenv(name, raising=False)
+
+    def make(**kwargs):
+        from QuestionMigrator import QuestionMigrator
+        kwargs.setdefault('dry_run', False)
+        migrator = QuestionMigrator(**kwargs)
+        migrator.question_pause = 0
+        return migrator
+    return make
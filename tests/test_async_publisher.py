@@ -0,0 +1,48 @@
+import threading
+import time
+
+from http_cassette import Cassette
+from migration_checkpoint import MigrationCheckpoint
+
+
+def test_publisher_is_turned_off_while_a_cassette_runs(tmp_path, make_migrator, monkeypatch):
+    monkeypatch.setenv('ASYNC_PUBLISHER', 'true')
+    cassette = Cassette(str(tmp_path / 'cassette'))
+    cassette.record()
+    try:
+        migrator = make_migrator(dry_run=True)
+    finally:
+        cassette.stop()
+
+    assert migrator.discourse_client.publisher is None
+    assert migrator.topic_workers == 1
+
+
+def test_bulk_path_keeps_several_topics_in_flight(make_migrator):
+    migrator = make_migrator()
+    migrator.topic_workers = 3
+    checkpoint = MigrationCheckpoint('target')
+    checkpoint.set_index([{'id': str(number), 'title': f"Question {number}", 'dateAsked': number * 1000}
+                          for number in range(9)])
+
+    lock = threading.Lock()
+    running = []
+    peak = [0]
+
+    def migrate_question(question):
+        with lock:
+            running.append(question['id'])
+            peak[0] = max(peak[0], len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(question['id'])
+        return True
+    migrator.migrate_question = migrate_question
+
+    migrator._migrate_checkpoint(checkpoint)
+
+    assert peak[0] == 3
+    reloaded = MigrationCheckpoint('target')
+    assert reloaded.load()
+    assert reloaded.position == 9
+    assert reloaded.in_flight == []
@@ -0,0 +1,88 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from ConfluenceQuestionsFetcher import ConfluenceQuestionsFetcher
+from attachment_processor import AttachmentProcessor
+
+
+class _ConfluenceHandler(BaseHTTPRequestHandler):
+    """Serves /download/attachments/ok.png, rate limits busy.png and answers slow.png too late."""
+
+    def _respond(self, body):
+        if 'busy' in self.path:
+            self.send_response(429)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'slow' in self.path:
+            time.sleep(1)
+        self.send_response(200)
+        self.send_header('Content-Length', '4')
+        self.end_headers()
+        if body:
+            self.wfile.write(b'\x89PNG')
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, *args):
+        pass
+
+
+class _FakeDiscourse:
+    def __init__(self):
+        self.uploads = []
+
+    def upload_file(self, filename, content):
+        self.uploads.append((filename, content))
+        return {'url': f"/uploads/{filename}"}, None
+
+
+@pytest.fixture
+def confluence():
+    server = HTTPServer(('127.0.0.1', 0), _ConfluenceHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def _processor(confluence, discourse=None):
+    fetcher = ConfluenceQuestionsFetcher(confluence, 'user', 'password', request_timeout=0.3)
+    return AttachmentProcessor(confluence, ('user', 'password'), discourse or _FakeDiscourse(), dry_run=False,
+                               questions_fetcher=fetcher)
+
+
+def _image(name):
+    return f'<p><img class="confluence-embedded-image" src="/download/attachments/1/{name}"></p>'
+
+
+def test_attachments_are_requested_within_the_load_limits(confluence):
+    processor = _processor(confluence)
+    limiter = processor.questions_fetcher.concurrency_limiter
+    limiter.limit = 4
+
+    assert processor.attachment_size(f"{confluence}/download/attachments/1/ok.png") == 4
+    assert processor.questions_fetcher.request_count == 1
+    # Rate limiting counts as overload, like a server error
+    assert processor.attachment_size(f"{confluence}/download/attachments/1/busy.png") == 0
+    assert limiter.limit < 4
+    assert processor.questions_fetcher.circuit_breaker.failures == 1
+
+
+def test_attachment_download_times_out(confluence):
+    discourse = _FakeDiscourse()
+    processor = _processor(confluence, discourse)
+
+    content = processor.process_attachments(_image('ok.png') + _image('slow.png'), '7')
+
+    assert discourse.uploads == [('attachment_7_ok.png', b'\x89PNG')]
+    assert 'Failed to download attachment: attachment_7_slow.png' in content
+    assert processor.questions_fetcher.circuit_breaker.failures == 1
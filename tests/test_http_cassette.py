@@ -0,0 +1,74 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from ConfluenceQuestionsFetcher import ConfluenceQuestionsFetcher
+from http_cassette import Cassette
+
+LISTING = {'results': [{'id': str(number), 'title': f"Question {number}", 'answersCount': number % 3,
+                        'body': {'content': 'x' * 200}} for number in range(50)]}
+
+
+class _ListingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(LISTING).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def confluence():
+    server = HTTPServer(('127.0.0.1', 0), _ListingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('stream_listings', [True, False])
+def test_replays_recorded_listing(tmp_path, confluence, stream_listings):
+    fetcher = ConfluenceQuestionsFetcher(confluence, 'user', 'password', stream_listings=stream_listings)
+    cassette = Cassette(str(tmp_path / 'cassette'))
+
+    cassette.record()
+    try:
+        recorded = [dict(question) for question in fetcher.iter_questions('SPACE', limit=50)]
+    finally:
+        cassette.stop()
+
+    replay = Cassette(str(tmp_path / 'cassette'))
+    replay.replay()
+    try:
+        replayed = [dict(question) for question in fetcher.iter_questions('SPACE', limit=50)]
+    finally:
+        replay.stop()
+
+    assert len(recorded) == 50
+    assert replayed == recorded
+
+
+def test_unrecorded_request_fails_like_the_network(tmp_path, confluence):
+    fetcher = ConfluenceQuestionsFetcher(confluence, 'user', 'password')
+    cassette = Cassette(str(tmp_path / 'cassette'))
+    cassette.record()
+    try:
+        list(fetcher.iter_questions('SPACE'))
+    finally:
+        cassette.stop()
+
+    replay = Cassette(str(tmp_path / 'cassette'))
+    replay.replay()
+    try:
+        with pytest.raises(Exception, match='No recorded response'):
+            list(fetcher.iter_questions('OTHER'))
+    finally:
+        replay.stop()
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from image_optimizer import ImageOptimizer
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _png(size=200):
+    output = io.BytesIO()
+    Image.new('RGB', (size, size), (200, 30, 30)).save(output, format='PNG')
+    return output.getvalue()
+
+
+def _size(content):
+    return Image.open(io.BytesIO(content)).size
+
+
+@pytest.fixture
+def make_optimizer(tmp_path):
+    optimizers = []
+
+    def make(max_dimension):
+        optimizer = ImageOptimizer(max_dimension=max_dimension, cache_dir=str(tmp_path / 'cache'), workers=1)
+        optimizers.append(optimizer)
+        return optimizer
+    yield make
+    for optimizer in optimizers:
+        optimizer.shutdown()
+
+
+def test_failing_cache_write_still_returns_the_image(make_optimizer, monkeypatch):
+    optimizer = make_optimizer(50)
+
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(optimizer, '_store', fail)
+
+    filename, content = optimizer.submit('chart.png', _png()).result(timeout=60)
+
+    assert filename == 'chart.png'
+    assert _size(content) == (50, 50)
+
+
+def test_cache_is_kept_per_max_dimension(make_optimizer):
+    image = _png()
+
+    assert _size(make_optimizer(50).optimize('chart.png', image)[1]) == (50, 50)
+    assert _size(make_optimizer(20).optimize('chart.png', image)[1]) == (20, 20)
+    # Served from the cache of the first optimizer
+    assert _size(make_optimizer(50).optimize('chart.png', image)[1]) == (50, 50)
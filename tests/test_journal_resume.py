@@ -0,0 +1,71 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from migration_journal import topic_external_id
+
+TOPIC = {'id': 42, 'title': 'Question 7', 'post_stream': {'posts': [{'id': 420, 'post_number': 1}]}}
+
+
+class _DiscourseHandler(BaseHTTPRequestHandler):
+    """Answers topic lookups the way Discourse does: external IDs redirect to the topic."""
+
+    def do_GET(self):
+        if self.path.startswith(f"/t/external_id/{topic_external_id('7')}.json"):
+            self.send_response(301)
+            self.send_header('Location', f"{self.server.url}/t/question-7/42.json")
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.startswith('/t/question-7/42.json'):
+            self.server.topic_api_keys.append(self.headers.get('Api-Key'))
+            body = json.dumps(TOPIC).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        else:
+            body = json.dumps({'errors': ['The requested URL or resource could not be found.']}).encode()
+            self.send_response(404)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def discourse(monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), _DiscourseHandler)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.topic_api_keys = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_topic_created_before_a_crash_is_found_on_resume(make_migrator, discourse, monkeypatch):
+    monkeypatch.setenv('DISCOURSE_URL', discourse.url)
+    migrator = make_migrator()
+    # The run stopped after creating the topic and before journaling it
+    migrator.journal.topic_pending('7')
+
+    assert migrator._resume_topic('7') == 42
+
+    assert discourse.topic_api_keys == ['key']
+    assert migrator.journal.state('7')['topic_id'] == 42
+    assert migrator.link_index.topics['7'] == 42
+
+
+def test_question_without_a_topic_is_not_resumed(make_migrator, discourse, monkeypatch):
+    monkeypatch.setenv('DISCOURSE_URL', discourse.url)
+    migrator = make_migrator()
+    migrator.journal.topic_pending('8')
+
+    assert migrator._resume_topic('8') is None
+    assert migrator.journal.state('8')['topic_id'] is None
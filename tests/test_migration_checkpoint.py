@@ -0,0 +1,63 @@
+from migration_checkpoint import MigrationCheckpoint
+
+QUESTIONS = [{'id': str(number), 'title': f"Question {number}", 'dateAsked': number * 1000} for number in range(60)]
+
+
+def _checkpoint_at(position):
+    checkpoint = MigrationCheckpoint('target')
+    checkpoint.set_index(QUESTIONS)
+    checkpoint.position = position
+    checkpoint.save_cursor()
+
+
+def _cursor():
+    checkpoint = MigrationCheckpoint('target')
+    assert checkpoint.load()
+    return checkpoint.position, checkpoint.in_flight
+
+
+def test_try_run_leaves_the_cursor_of_the_migration_alone(make_migrator):
+    _checkpoint_at(50)
+    migrator = make_migrator(try_count=1)
+    migrator.questions_fetcher.get_all_questions = lambda space_key=None: list(QUESTIONS)
+
+    def migrate_question(question):
+        migrator.topics_created += 1
+        return True
+    migrator.migrate_question = migrate_question
+
+    migrator.migrate_questions()
+
+    assert migrator.topics_created == 1
+    assert _cursor() == (50, [])
+
+
+def test_interrupted_question_is_resumed_first(make_migrator):
+    _checkpoint_at(10)
+    migrator = make_migrator()
+    migrator.questions_fetcher.fetch_new_questions = lambda space_key, known_ids: []
+    migrated = []
+
+    def migrate_question(question):
+        migrated.append(question['id'])
+        if question['id'] == '11':
+            raise KeyboardInterrupt
+        return True
+    migrator.migrate_question = migrate_question
+    checkpoint = migrator._load_checkpoint()
+    checkpoint.questions = checkpoint.questions[:12]
+
+    try:
+        migrator._migrate_checkpoint(checkpoint)
+    except KeyboardInterrupt:
+        pass
+    assert _cursor() == (11, ['11'])
+
+    migrated.clear()
+    migrator.migrate_question = lambda question: migrated.append(question['id']) or True
+    checkpoint = migrator._load_checkpoint()
+    checkpoint.questions = checkpoint.questions[:13]
+    migrator._migrate_checkpoint(checkpoint)
+
+    assert migrated == ['11', '12']
+    assert _cursor() == (13, [])
@@ -0,0 +1,101 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from multipart_upload import MultipartUploader
+
+PART_SIZE = 1024
+
+
+class _StorageHandler(BaseHTTPRequestHandler):
+    """Stores the parts PUT to /<upload>/<part>, failing the parts listed in server.failing."""
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        number = int(self.path.rsplit('/', 1)[-1])
+        if number in self.server.failing:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.server.parts[number] = data
+        self.server.puts.append(number)
+        self.send_response(200)
+        self.send_header('ETag', f'"etag-{number}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def storage():
+    server = HTTPServer(('127.0.0.1', 0), _StorageHandler)
+    server.parts = {}
+    server.puts = []
+    server.failing = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class _FakeDiscourse:
+    """The multipart endpoints of Discourse, presigning URLs of the storage stub."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.created = 0
+        self.completed = []
+
+    def _post(self, path, json=True, **kwargs):
+        if path == '/uploads/create-multipart.json':
+            self.created += 1
+            return {'unique_identifier': f'upload-{self.created}', 'external_upload_identifier': 'external'}
+        if path == '/uploads/batch-presign-multipart-parts.json':
+            base = f"http://127.0.0.1:{self.storage.server_port}/{kwargs['unique_identifier']}"
+            return {'presigned_urls': {str(number): f"{base}/{number}" for number in kwargs['part_numbers']}}
+        if path == '/uploads/complete-multipart.json':
+            self.completed.append(kwargs['parts'])
+            return {'url': '/uploads/file.bin'}
+        raise AssertionError(path)
+
+
+def _uploader(discourse, tmp_path):
+    return MultipartUploader(discourse, part_size=PART_SIZE, workers=2, state_file=str(tmp_path / 'uploads.json'),
+                             part_retries=1, timeout=5)
+
+
+def test_failed_part_is_resumed_by_a_later_run(tmp_path, storage):
+    content = bytes(range(256)) * 20
+    discourse = _FakeDiscourse(storage)
+    storage.failing = {3}
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        _uploader(discourse, tmp_path).upload('file.bin', content)
+    assert sorted(storage.puts) == [1, 2, 4, 5]
+    assert discourse.completed == []
+
+    storage.failing = set()
+    storage.puts = []
+    upload = _uploader(discourse, tmp_path).upload('file.bin', content)
+
+    assert upload == {'url': '/uploads/file.bin'}
+    assert storage.puts == [3]
+    assert discourse.created == 1
+    assert discourse.completed == [[{'part_number': number, 'etag': f'etag-{number}'} for number in range(1, 6)]]
+    assert b''.join(storage.parts[number] for number in range(1, 6)) == content
+
+
+def test_completed_upload_leaves_no_state(tmp_path, storage):
+    discourse = _FakeDiscourse(storage)
+    uploader = _uploader(discourse, tmp_path)
+
+    uploader.upload('file.bin', b'x' * (PART_SIZE + 1))
+
+    assert sorted(storage.puts) == [1, 2]
+    assert _uploader(discourse, tmp_path).uploads == {}
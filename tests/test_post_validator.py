@@ -0,0 +1,39 @@
+from post_validator import PostValidator, split_content
+from shard_coordinator import ShardCoordinator
+
+
+class _FakeDiscourse:
+    """A forum with the default limits and no topics yet."""
+
+    def get_site_settings(self, names):
+        return {}
+
+    def iter_topics(self):
+        return iter([])
+
+
+def test_split_content_fits_the_limit_and_reopens_code_fences():
+    content = '\n\n'.join(f"Paragraph {index} " + 'word ' * 40 for index in range(20))
+    content += '\n\n```\n' + '\n'.join(f"line {index}" for index in range(200)) + '\n```'
+
+    parts = split_content(content, 1000)
+
+    assert len(parts) > 1
+    assert all(len(part) <= 1000 for part in parts)
+    assert all(part.count('```') % 2 == 0 for part in parts)
+    assert parts[0].endswith('word')
+
+
+def test_sharded_workers_never_share_a_title(tmp_path):
+    db_path = str(tmp_path / 'coordination.db')
+    validators = [PostValidator(_FakeDiscourse(), str(tmp_path / f'topic_titles_{worker}.txt'),
+                                shared_titles=ShardCoordinator(db_path, worker))
+                  for worker in ('w1', 'w2')]
+
+    first = validators[0].validate_title('How do I restart the indexer?', '1')
+    second = validators[1].validate_title('How do I restart the indexer?', '2')
+
+    assert first == 'How do I restart the indexer?'
+    assert second == 'How do I restart the indexer? (2)'
+    # A retried question keeps its title, whichever worker retries it
+    assert validators[1].validate_title('How do I restart the indexer?', '1') == first
@@ -0,0 +1,31 @@
+from DiscourseCategoryManager import DiscourseCategoryManager
+from reconciler import Reconciler
+
+
+class _FakeDiscourse:
+    """A forum with only the general category, which must not get any other."""
+
+    def __init__(self):
+        self.category_manager = DiscourseCategoryManager(self, space_categories={'OPS': 'Operations'})
+        self.listed = []
+
+    def categories(self):
+        return [{'id': 5, 'name': 'General Questions', 'slug': 'general-questions'}]
+
+    def create_category(self, **kwargs):
+        raise AssertionError(f"created category {kwargs['name']}")
+
+    def iter_topic_pages(self, category_id, category_slug, workers):
+        self.listed.append((category_id, category_slug))
+        yield [{'id': 42, 'title': 'How do I log in?', 'posts_count': 3, 'tags': ['migrated_question']}]
+
+
+def test_listing_topics_creates_no_category(tmp_path):
+    discourse = _FakeDiscourse()
+    reconciler = Reconciler(None, discourse, None, None, snapshot_dir=str(tmp_path))
+
+    topics = reconciler.list_topics()
+
+    assert discourse.listed == [(5, 'general-questions')]
+    assert [(topic['id'], topic['answers'], topic['migrated']) for topic in topics] == [(42, 2, True)]
+    assert not discourse.category_manager.categories_ready
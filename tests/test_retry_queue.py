@@ -0,0 +1,32 @@
+from answer_processor import AnswerProcessor
+from retry_queue import RetryQueue
+
+
+class _FakeDiscourse:
+    def __init__(self):
+        self.posts = {}
+
+    def create_post(self, topic_id, content, username=None):
+        post_id = 100 + len(self.posts)
+        self.posts[post_id] = content
+        return {'id': post_id}
+
+
+def test_upload_failures_are_bound_to_the_part_holding_their_placeholder(tmp_path):
+    queue = RetryQueue(str(tmp_path / 'retry_queue.json'))
+    placeholders = {filename: f"[Error uploading file '{filename}': timed out]" for filename in ('a.png', 'b.png')}
+    for filename, placeholder in placeholders.items():
+        queue.record('upload', f"upload:7:{filename}", {'content_id': '7', 'filename': filename,
+                                                       'url': f"http://confluence/{filename}",
+                                                       'placeholder': placeholder}, TimeoutError())
+    parts = [f"First part\n\n{placeholders['a.png']}", 'Middle part', f"Last part\n\n{placeholders['b.png']}"]
+    discourse = _FakeDiscourse()
+    processor = AnswerProcessor(None, discourse, None, None, None, dry_run=False, retry_queue=queue)
+
+    queue.bind_post('7', 99, parts[0])
+    processor.post_continuations(42, None, '7', parts)
+
+    entries = RetryQueue(str(tmp_path / 'retry_queue.json')).entries
+    assert entries['upload:7:a.png']['payload']['post_id'] == 99
+    assert entries['upload:7:b.png']['payload']['post_id'] == 101
+    assert placeholders['b.png'] in discourse.posts[101]
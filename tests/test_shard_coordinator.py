@@ -0,0 +1,107 @@
+import json
+
+from link_index import LinkIndex
+from migration_journal import MigrationJournal
+from shard_coordinator import ShardCoordinator
+
+CONFLUENCE_URL = 'https://oldcommunity.example.com'
+DISCOURSE_URL = 'https://forum.example.com'
+
+
+class _FakeDiscourse:
+    def __init__(self, posts):
+        self.posts = posts
+
+    def get_post_raw(self, post_id):
+        return self.posts[post_id]
+
+    def update_post(self, post_id, raw, edit_reason=None, topic_id=None):
+        self.posts[post_id] = raw
+
+
+def _link_index(tmp_path, worker_id=None):
+    name = f'link_index_{worker_id}.jsonl' if worker_id else 'link_index.jsonl'
+    return LinkIndex(CONFLUENCE_URL, DISCOURSE_URL, str(tmp_path / name))
+
+
+def test_export_merges_links_between_shards(tmp_path):
+    coordinator = ShardCoordinator(str(tmp_path / 'coordination.db'), 'export')
+    content = f"See [the other question]({CONFLUENCE_URL}/questions/2/other)"
+    first, second = _link_index(tmp_path, 'w1'), _link_index(tmp_path, 'w2')
+    first.add_topic('1', 11)
+    first.defer(101, '1', content)
+    second.add_topic('2', 22)
+    # The worker of the first shard never sees the topic of the second
+    assert first.fix_links(_FakeDiscourse({101: content})) == 0
+
+    def export():
+        coordinator.export_state(str(tmp_path / 'migrated.json'), str(tmp_path / 'users.csv'),
+                                 str(tmp_path / 'link_index.jsonl'))
+    export()
+    export()
+
+    with open(tmp_path / 'link_index.jsonl') as f:
+        assert len(f.readlines()) == 3
+    discourse = _FakeDiscourse({101: content})
+    assert _link_index(tmp_path).fix_links(discourse) == 1
+    assert discourse.posts[101] == f"See [the other question]({DISCOURSE_URL}/t/22)"
+
+    # Only what the workers recorded since is appended by the next export
+    second.add_topic('3', 33)
+    export()
+    with open(tmp_path / 'link_index.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert records[-2:] == [{'resolved': 101}, {'question_id': '3', 'topic_id': 33}]
+    assert _link_index(tmp_path).topics == {'1': 11, '2': 22, '3': 33}
+
+
+def _questions():
+    return [{'id': question_id, 'title': f"Question {question_id}", 'dateAsked': 1600000000000 + question_id}
+            for question_id in (1, 2)]
+
+
+def test_expired_shard_is_taken_over_with_its_journal(tmp_path):
+    db_path = str(tmp_path / 'coordination.db')
+    first, second = ShardCoordinator(db_path, 'w1'), ShardCoordinator(db_path, 'w2')
+    assert first.ensure_plan(_questions, mode='hash', shard_count=1) == 1
+    shard = first.claim_shard()
+    first_journal = MigrationJournal(str(tmp_path / 'migration_journal_w1.jsonl'))
+    first_journal.topic_created(1, 11, 101)
+    first_journal.completed(2)
+
+    # The lease of the first worker is alive
+    assert second.claim_shard() is None
+
+    first.conn.execute('UPDATE shards SET heartbeat = 0')
+    assert second.claim_shard() == shard
+    assert second.taken_over_from == 'w1'
+    assert not first.heartbeat(shard)
+
+    second_journal = MigrationJournal(str(tmp_path / 'migration_journal_w2.jsonl'))
+    assert second_journal.adopt(first_journal.journal_file, [question['id'] for question in second.shard_questions(shard)]) == 1
+    assert second_journal.state(1)['topic_id'] == 11
+    assert second_journal.state(2) is None
+    # The journal of the first worker is left as it was
+    assert MigrationJournal(first_journal.journal_file).state(1)['post_id'] == 101
+
+
+def test_worker_resumes_the_questions_of_a_shard_it_took_over(tmp_path, make_migrator, monkeypatch):
+    coordinator = ShardCoordinator(str(tmp_path / 'target' / 'coordination.db'), 'w1')
+    coordinator.ensure_plan(_questions, mode='hash', shard_count=1)
+    coordinator.claim_shard()
+    coordinator.conn.execute('UPDATE shards SET heartbeat = 0')
+    MigrationJournal(str(tmp_path / 'target' / 'migration_journal_w1.jsonl')).topic_created(1, 11, 101)
+
+    migrator = make_migrator(worker_id='w2')
+    seen = {}
+
+    def migrate_question(question):
+        seen[question['id']] = migrator.journal.state(question['id'])
+        return True
+    monkeypatch.setattr(migrator, 'migrate_question', migrate_question)
+    monkeypatch.setattr(migrator, 'provision_users', lambda: None)
+    migrator.migrate_shards(ShardCoordinator(coordinator.db_path, 'w2'), shard_mode='hash', shard_count=1)
+
+    assert seen[1]['topic_id'] == 11
+    assert seen[2] is None
+    assert coordinator.progress() == {'done': 1}
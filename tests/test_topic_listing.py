@@ -0,0 +1,82 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+from DiscourseClient import DiscourseClient
+
+PAGE_SIZE = 30
+TOPIC_COUNT = 75
+
+
+class _TopicListHandler(BaseHTTPRequestHandler):
+    """Serves topic lists, rate limiting the first request for every page and failing the pages in server.failing."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        page = int(parse_qs(url.query).get('page', ['0'])[0])
+        self.server.paths.add(url.path)
+        if page in self.server.failing:
+            return self._reply(500, {'errors': ['Internal error']})
+        if page not in self.server.limited:
+            self.server.limited.add(page)
+            return self._reply(429, {'errors': ['Slow down']}, {'Retry-After': '0'})
+        topics = [{'id': number, 'title': f"Topic {number}"}
+                  for number in range(page * PAGE_SIZE, min(TOPIC_COUNT, (page + 1) * PAGE_SIZE))]
+        more = (page + 1) * PAGE_SIZE < TOPIC_COUNT
+        self._reply(200, {'topic_list': {'topics': topics, 'more_topics_url': f"?page={page + 1}" if more else None}})
+
+    def _reply(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def discourse(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = HTTPServer(('127.0.0.1', 0), _TopicListHandler)
+    server.limited = set()
+    server.failing = set()
+    server.paths = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, DiscourseClient(f"http://127.0.0.1:{server.server_port}", 'key', 'system')
+    server.shutdown()
+    server.server_close()
+
+
+def test_rate_limited_pages_are_retried(discourse):
+    server, client = discourse
+
+    topics = client.get_all_topics()
+
+    assert [topic['id'] for topic in topics] == list(range(TOPIC_COUNT))
+
+
+def test_failed_page_fails_the_listing(discourse):
+    server, client = discourse
+    server.failing = {1}
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get_all_topics()
+
+
+def test_category_without_slug_is_listed_by_id(discourse):
+    server, client = discourse
+
+    topics = list(client.iter_topics(category_id=7))
+
+    assert len(topics) == TOPIC_COUNT
+    assert server.paths == {'/c/7/l/latest.json'}
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import re
+import threading
+
+from pydiscourse.exceptions import DiscourseClientError
+
+logger = logging.getLogger(__name__)
+
+
+def discourse_username(confluence_username, max_length=20):
+    """Derive a valid Discourse username from a Confluence username or email address.
+
+    Discourse usernames hold letters, digits, dots, dashes and underscores, start and
+    end with a letter or digit, and are at least 3 characters long.
+
+    Args:
+        confluence_username (str): The Confluence username
+        max_length (int): The forum's maximum username length
+
+    Returns:
+        str: The Discourse username
+    """
+    name = confluence_username.split('@')[0]
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    name = re.sub(r'[_.-]{2,}', '_', name)
+    name = name[:max_length].strip('_.-')
+    return name.ljust(3, '0')
+
+
+class UserMapping:
+    """Maps Confluence authors to Discourse usernames to publish their posts as them.
+
+    The registered authors are resolved in bulk before the migration: a single pass
+    over the forum's user list matches them by email address, and authors without an
+    account are created when that is allowed. A Discourse user is only taken for an
+    author when their emails match, since a username alone may belong to someone
+    else. The mapping is cached in memory and on disk, so publishing a post as its
+    author costs no extra request. An author that cannot be mapped, or whose email
+    is not known, is published as the API user.
+
+    Authors that were not provisioned are looked up while the migration runs,
+    outside the lock of the mapping, so workers only wait for a lookup of the same
+    author.
+    """
+
+    def __init__(self, discourse_client, user_registry, mapping_file='target/user_mapping.json', create_missing=False):
+        """Initialize the user mapping.
+
+        Args:
+            discourse_client (DiscourseClient): The client to look up and create users with
+            user_registry (UserRegistry): The registry of Confluence authors
+            mapping_file (str): Path of the JSON file caching the mapping
+            create_missing (bool): Create a Discourse account for authors that have none
+        """
+        self.discourse_client = discourse_client
+        self.user_registry = user_registry
+        self.mapping_file = mapping_file
+        self.create_missing = create_missing
+        self._mapping = None
+        self.lock = threading.RLock()
+        # Authors being looked up, with an event set once they are
+        self.resolving = {}
+
+    @property
+    def mapping(self):
+        """Discourse username per Confluence username, loaded from disk on first use.
+
+        Authors that could not be mapped are kept with None, so they are not looked up
+        again for every post.
+        """
+        with self.lock:
+            if self._mapping is None:
+                self._mapping = self.load_mapping()
+            return self._mapping
+
+    def load_mapping(self):
+        if os.path.exists(self.mapping_file):
+            with open(self.mapping_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def save_mapping(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.mapping_file) or '.', exist_ok=True)
+            temp_file = f"{self.mapping_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.mapping, f, indent=2, sort_keys=True)
+            os.replace(temp_file, self.mapping_file)
+
+    def provision(self):
+        """Resolve every registered author that is not mapped yet.
+
+        Returns:
+            int: Number of authors that were mapped
+        """
+        with self.lock:
+            pending = {username: full_name for full_name, username in self.user_registry.get_all_users().items()
+                       if username and self.mapping.get(username) is None}
+        if not pending:
+            return 0
+
+        logger.info("Mapping %d Confluence authors to Discourse users...", len(pending))
+        by_email = {}
+        for user in self.discourse_client.list_users():
+            if user.get('email'):
+                by_email[user['email'].lower()] = user['username']
+
+        matches = {}
+        for username, full_name in pending.items():
+            email = self.user_registry.get_email(username)
+            match = email and by_email.get(email.lower())
+            if not match and self.create_missing and email:
+                match = self._create_user(username, full_name, email)
+            matches[username] = match or None
+
+        with self.lock:
+            self.mapping.update(matches)
+            self.save_mapping()
+        mapped = sum(1 for match in matches.values() if match)
+        logger.info("Mapped %d of %d authors, the others are published as the API user", mapped, len(pending))
+        return mapped
+
+    def username_for(self, author):
+        """Get the Discourse username to publish a post of a Confluence author as.
+
+        Args:
+            author (dict): The author data of a question or answer
+
+        Returns:
+            str: The Discourse username, or None to publish as the API user
+        """
+        username = (author or {}).get('name')
+        if not username:
+            return None
+        with self.lock:
+            if username in self.mapping:
+                return self.mapping[username]
+            event = self.resolving.get(username)
+            resolving = event is None
+            if resolving:
+                event = self.resolving[username] = threading.Event()
+        if not resolving:
+            # Another worker is looking the author up
+            event.wait()
+            with self.lock:
+                return self.mapping.get(username)
+
+        # An author that was not provisioned up front is resolved once and cached
+        try:
+            match = self._resolve(author)
+            with self.lock:
+                self.mapping[username] = match
+                self.save_mapping()
+            return match
+        finally:
+            with self.lock:
+                self.resolving.pop(username, None)
+            event.set()
+
+    def _resolve(self, author):
+        username = author['name']
+        email = username if '@' in username else author.get('email')
+        if not email:
+            # Without an email a Discourse user cannot be told apart from a namesake
+            return None
+        users = self.discourse_client.client.user_by_email(email)
+        for user in users or []:
+            if (user.get('email') or email).lower() == email.lower():
+                return user['username']
+        if self.create_missing:
+            return self._create_user(username, author.get('fullName'), email)
+        return None
+
+    def _create_user(self, username, full_name, email):
+        candidate = discourse_username(username)
+        try:
+            response = self.discourse_client.create_user(full_name or candidate, candidate, email)
+        except DiscourseClientError as e:
+            logger.warning("Could not create Discourse user %s for %s: %s", candidate, username, e)
+            return None
+        if not response.get('success', True):
+            logger.warning("Could not create Discourse user %s for %s: %s", candidate, username, response.get('message'))
+            return None
+        logger.info("Created Discourse user %s for %s", candidate, username)
+        return candidate
@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Durable queue of the secondary writes of a migration, flushed off the main path.
+
+    Accepting solutions, tagging topics and editing posts do not have to happen while
+    topics and answers are created, so they are queued instead of costing round trips
+    per topic. Operations are keyed by what they change, which merges redundant ones:
+    a topic keeps only its latest solution, tags added to a topic are combined and a
+    post keeps only its latest content.
+
+    The queue is flushed in batches, a few operations at a time within the Discourse
+    write budget, either by a background thread while the migration runs or after the
+    main load. Operations that fail stay queued for the next flush until they run out
+    of attempts.
+
+    Queuing an operation appends it to a log next to the queue file, so it costs one
+    small write however long the queue is. The queue file is rewritten, and the log
+    emptied, once per flushed batch.
+    """
+
+    def __init__(self, queue_file='target/write_behind.json', batch_size=20, workers=4, max_attempts=5):
+        """Initialize the write-behind queue.
+
+        Args:
+            queue_file (str): Path of the JSON file holding the queue; operations queued
+                since it was written are appended to the same path with .log
+            batch_size (int): Operations flushed before the queue file is updated
+            workers (int): Operations of a batch sent at the same time
+            max_attempts (int): Failed flushes after which an operation is left for inspection
+        """
+        self.queue_file = queue_file
+        self.log_file = f"{queue_file}.log"
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._entries = None
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.version = 0
+        # Statistics of this run, for the run report
+        self.stats = {'queued': 0, 'merged': 0, 'flushed': 0, 'failed': 0}
+        self.flush_thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def entries(self):
+        """The queued operations by key, loaded from disk on first use."""
+        with self.lock:
+            if self._entries is None:
+                self._entries = self.load_queue()
+            return self._entries
+
+    def load_queue(self):
+        """Load the queue file and replay the operations logged since it was written."""
+        entries = {}
+        # Versions tell an operation queued again during a flush from the one flushed
+        saved_version = 0
+        if os.path.exists(self.queue_file):
+            with open(self.queue_file, 'r') as f:
+                saved = json.load(f)
+            # Queue files of earlier versions hold the list of entries only
+            if isinstance(saved, list):
+                saved = {'version': 0, 'entries': saved}
+            saved_version = saved['version']
+            entries = {entry['key']: entry for entry in saved['entries']}
+
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last operation may be cut short by a crash
+                        logger.warning("Ignoring truncated write-behind record: %s", line[:80])
+                        continue
+                    # Operations the queue file was written after are in it already, or flushed
+                    if entry['version'] > saved_version:
+                        entries[entry['key']] = entry
+
+        self.version = max([saved_version] + [entry['version'] for entry in entries.values()])
+        return entries
+
+    def save_queue(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.queue_file) or '.', exist_ok=True)
+            temp_file = f"{self.queue_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump({'version': self.version, 'entries': list(self.entries.values())}, f, indent=2)
+            os.replace(temp_file, self.queue_file)
+            # The queue file holds every logged operation now
+            if os.path.exists(self.log_file):
+                os.remove(self.log_file)
+
+    def accept_solution(self, topic_id, post_id, question_id=None):
+        """Queue marking a post as the solution of its topic, replacing an earlier queued solution."""
+        self._enqueue(f"solution:{topic_id}", 'solution',
+                      {'topic_id': topic_id, 'post_id': post_id, 'question_id': question_id})
+
+    def add_tags(self, topic_id, tags):
+        """Queue adding tags to a topic, combined with the tags queued for it already."""
+        with self.lock:
+            queued = self.entries.get(f"tags:{topic_id}")
+            combined = sorted(set(queued['payload']['tags'] if queued else []) | set(tags))
+            self._enqueue(f"tags:{topic_id}", 'tags', {'topic_id': topic_id, 'tags': combined})
+
+    def edit_post(self, post_id, raw_content, edit_reason='', topic_id=None):
+        """Queue replacing the content of a post, replacing an earlier queued edit."""
+        self._enqueue(f"edit:{post_id}", 'edit', {'post_id': post_id, 'raw': raw_content, 'edit_reason': edit_reason,
+                                                  'topic_id': topic_id})
+
+    def pending_edit(self, post_id):
+        """Get the content queued for a post.
+
+        Returns:
+            str: The raw content the post will get, or None if no edit is queued
+        """
+        with self.lock:
+            entry = self.entries.get(f"edit:{post_id}")
+            return entry['payload']['raw'] if entry else None
+
+    def _enqueue(self, key, kind, payload):
+        with self.lock:
+            entries = self.entries
+            self.version += 1
+            if key in entries:
+                self.stats['merged'] += 1
+            self.stats['queued'] += 1
+            entry = {'key': key, 'kind': kind, 'payload': payload, 'version': self.version,
+                     'queued_at': time.time(), 'attempts': 0}
+            entries[key] = entry
+            os.makedirs(os.path.dirname(self.log_file) or '.', exist_ok=True)
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def flush(self, discourse_client, journal=None):
+        """Send the queued operations to Discourse in batches.
+
+        Args:
+            discourse_client (DiscourseClient): The client to write with
+            journal (MigrationJournal, optional): Records the accepted solutions
+
+        Returns:
+            int: Number of operations flushed
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending = sorted((dict(entry) for entry in self.entries.values()
+                                  if entry['attempts'] < self.max_attempts), key=lambda entry: entry['queued_at'])
+            if not pending:
+                return 0
+
+            logger.info("Flushing %d secondary writes...", len(pending))
+            flushed = 0
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='write-behind') as executor:
+                for start in range(0, len(pending), self.batch_size):
+                    batch = pending[start:start + self.batch_size]
+                    errors = list(executor.map(lambda entry: self._apply(entry, discourse_client, journal), batch))
+                    with self.lock:
+                        for entry, error in zip(batch, errors):
+                            current = self.entries.get(entry['key'])
+                            if error is None:
+                                flushed += 1
+                                self.stats['flushed'] += 1
+                                # An operation queued again during the flush stays for the next one
+                                if current is not None and current['version'] == entry['version']:
+                                    del self.entries[entry['key']]
+                            else:
+                                self.stats['failed'] += 1
+                                if current is not None and current['version'] == entry['version']:
+                                    current['attempts'] += 1
+                                    current['error'] = str(error)
+                        self.save_queue()
+                    logger.info("Flushed %d of %d secondary writes", start + len(batch), len(pending))
+            return flushed
+
+    def _apply(self, entry, discourse_client, journal=None):
+        payload = entry['payload']
+        try:
+            if entry['kind'] == 'solution':
+                discourse_client.accept_solution(payload['topic_id'], payload['post_id'])
+                if journal is not None and payload.get('question_id') is not None:
+                    journal.solution_accepted(payload['question_id'], payload['post_id'])
+            elif entry['kind'] == 'tags':
+                discourse_client.tag_manager.add_tags_to_topic(payload['topic_id'], payload['tags'])
+            elif entry['kind'] == 'edit':
+                discourse_client.update_post(payload['post_id'], payload['raw'], edit_reason=payload['edit_reason'],
+                                             topic_id=payload.get('topic_id'))
+            else:
+                logger.warning("Unknown write-behind operation: %s", entry['kind'])
+        except requests.exceptions.RequestException as e:
+            logger.error("Failed to flush %s: %s", entry['key'], e)
+            return e
+        except Exception as e:
+            # Any other error fails this operation only, not the batch or the flush thread
+            logger.exception("Unexpected error flushing %s", entry['key'])
+            return e
+        return None
+
+    def start_background_flush(self, discourse_client, interval, journal=None):
+        """Flush the queue every interval seconds while the migration runs."""
+        if self.flush_thread is not None:
+            return
+
+        def run():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.flush(discourse_client, journal)
+                except Exception:
+                    # The next flush tries again, e.g. after the disk filled up
+                    logger.exception("Background flush of the write-behind queue failed")
+
+        self.stop_event.clear()
+        self.flush_thread = threading.Thread(target=run, name='write-behind-flush', daemon=True)
+        self.flush_thread.start()
+
+    def stop_background_flush(self):
+        if self.flush_thread is not None:
+            self.stop_event.set()
+            self.flush_thread.join()
+            self.flush_thread = None
+
+    def summary(self):
+        """Report the queue and the flushes of this run.
+
+        Returns:
+            dict: Operations pending per kind, and those queued, merged, flushed and failed in this run
+        """
+        with self.lock:
+            pending = {}
+            for entry in self.entries.values():
+                pending[entry['kind']] = pending.get(entry['kind'], 0) + 1
+            return {'pending': pending, **self.stats}